@@ -1,4 +1,9 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.forms import modelformset_factory
+from django.template.response import TemplateResponse
+from django.utils.timezone import now
 
 from ega.models import (
     ChampionPrediction,
@@ -7,9 +12,14 @@ from ega.models import (
     LeagueMember,
     Match,
     Prediction,
+    RoundStanding,
+    ScoreChange,
+    ScoringJob,
+    Standing,
     Team,
     TeamStats,
     Tournament,
+    update_match_results,
 )
 
 
@@ -42,9 +52,67 @@ class TeamStatsAdmin(admin.ModelAdmin):
     list_filter = ('tournament', 'team')
 
 
+class MatchResultForm(forms.ModelForm):
+    class Meta:
+        model = Match
+        fields = (
+            'home_goals',
+            'away_goals',
+            'pk_home_goals',
+            'pk_away_goals',
+            'finished',
+        )
+
+
+MatchResultFormSet = modelformset_factory(Match, form=MatchResultForm, extra=0)
+
+
 class MatchAdmin(admin.ModelAdmin):
     list_display = ('tournament', 'home', 'home_goals', 'away_goals', 'away')
     list_filter = ('tournament', 'when', 'finished')
+    actions = ['enter_results']
+
+    @admin.action(description='Enter results for selected matches')
+    def enter_results(self, request, queryset):
+        queryset = queryset.select_related('home', 'away', 'tournament')
+        if 'apply' in request.POST:
+            formset = MatchResultFormSet(
+                request.POST, queryset=queryset, prefix='results'
+            )
+            if formset.is_valid():
+                # saved and scored at once, see update_match_results
+                changed = update_match_results(formset.save(commit=False))
+                self.message_user(
+                    request,
+                    '%d match results updated.' % len(changed),
+                    messages.SUCCESS,
+                )
+                return None
+        else:
+            formset = MatchResultFormSet(queryset=queryset, prefix='results')
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Enter results',
+            opts=self.model._meta,
+            formset=formset,
+            action_checkbox_name=helpers.ACTION_CHECKBOX_NAME,
+        )
+        return TemplateResponse(
+            request, 'admin/ega/match/enter_results.html', context
+        )
+
+    def save_model(self, request, obj, form, change):
+        # predictions and team stats are updated by the run_worker command
+        obj.defer_scoring = True
+        super().save_model(request, obj, form, change)
+        if getattr(obj, 'scoring_job', None) is not None:
+            self.message_user(
+                request,
+                'Scoring queued (%d pending jobs).'
+                % ScoringJob.objects.count(),
+                messages.INFO,
+            )
 
 
 class PredictionAdmin(admin.ModelAdmin):
@@ -57,9 +125,52 @@ class ChampionPredictionAdmin(admin.ModelAdmin):
     list_filter = ('tournament',)
 
 
+class RoundStandingAdmin(admin.ModelAdmin):
+    list_display = ('user', 'tournament', 'round', 'position', 'total')
+    list_filter = ('tournament', 'round')
+    search_fields = ('user__username',)
+
+
+class ScoreChangeAdmin(admin.ModelAdmin):
+    list_display = ('prediction', 'old_score', 'new_score', 'created', 'run')
+    list_filter = ('match__tournament',)
+    search_fields = ('user__username',)
+    raw_id_fields = ('prediction', 'match', 'user')
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class ScoringJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'match',
+        'created',
+        'run_after',
+        'attempts',
+        'failed',
+        'last_error',
+    )
+    list_filter = ('match__tournament',)
+    actions = ['retry']
+
+    @admin.display(boolean=True)
+    def failed(self, obj):
+        return obj.failed
+
+    @admin.action(description='Retry selected jobs now')
+    def retry(self, request, queryset):
+        queryset.update(run_after=now(), attempts=0)
+
+
+class StandingAdmin(admin.ModelAdmin):
+    list_display = ('user', 'tournament', 'total', 'x3', 'champion')
+    list_filter = ('tournament',)
+    search_fields = ('user__username',)
+
+
 class TournamentAdmin(admin.ModelAdmin):
     filter_horizontal = ('teams',)
-    list_display = ('name', 'published', 'finished')
+    list_display = ('name', 'published', 'finished', 'archived')
     prepopulated_fields = dict(slug=('name',))
 
 
@@ -68,6 +179,10 @@ admin.site.register(EgaUser, EgaUserAdmin)
 admin.site.register(League, LeagueAdmin)
 admin.site.register(Match, MatchAdmin)
 admin.site.register(Prediction, PredictionAdmin)
+admin.site.register(RoundStanding, RoundStandingAdmin)
+admin.site.register(ScoreChange, ScoreChangeAdmin)
+admin.site.register(ScoringJob, ScoringJobAdmin)
+admin.site.register(Standing, StandingAdmin)
 admin.site.register(Team, TeamAdmin)
 admin.site.register(TeamStats, TeamStatsAdmin)
 admin.site.register(Tournament, TournamentAdmin)
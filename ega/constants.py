@@ -37,6 +37,7 @@ HOURS_TO_DEADLINE = 0
 EXACTLY_MATCH_POINTS = 3
 WINNER_MATCH_POINTS = 1
 STARRED_MATCH_POINTS = 1
+PENALTIES_MATCH_POINTS = 1
 
 MATCH_WON_POINTS = 3
 MATCH_TIE_POINTS = 1
@@ -44,15 +45,25 @@ MATCH_LOST_POINTS = 0
 
 HISTORY_MATCHES_PER_PAGE = 13
 RANKING_TEAMS_PER_PAGE = 10
+# users shown in home ranking tables: the top ones, plus the current user
+# and its neighbours
+HOME_RANKING_TOP = 5
+LEAGUE_RANKING_TOP = 3
+RANKING_AROUND_USER = 1
+# cached rankings are invalidated on scoring, this is just a safety net
+RANKING_CACHE_TIMEOUT = 60 * 60
+# rows fetched at once (server-side cursor) when exporting rankings
+RANKING_EXPORT_CHUNK_SIZE = 2000
+RANKING_EXPORT_FORMATS = ('csv', 'jsonl')
+# deferred match scoring (see run_worker command)
+SCORING_JOB_BATCH_SIZE = 10
+SCORING_JOB_MAX_ATTEMPTS = 5
+SCORING_JOB_RETRY_DELAY = 60  # seconds, times the failed attempts
+SCORING_WORKER_POLL_INTERVAL = 5  # seconds
+# matches checked per verify_scores worker task
+VERIFY_SCORES_CHUNK_SIZE = 50
 
-# TODO: use knockout match placeholders?
-ROUND16_MATCHES = (
-    ('1A', '2B'),
-    ('1C', '2D'),
-    ('1D', '2C'),
-    ('1B', '2A'),
-    ('1E', '2F'),
-    ('1G', '2H'),
-    ('1F', '2E'),
-    ('1H', '2G'),
-)
+# knockout match placeholders for the winner (or loser) of another match,
+# by its id as shown in the admin (e.g. W49, L61), so the referenced match
+# must be created first; others are group positions (e.g. 1A, 2B)
+KNOCKOUT_RESULT_PLACEHOLDER = r'^(?P<result>[WL])(?P<match>\d+)$'
@@ -0,0 +1,40 @@
+import csv
+import json
+
+from ega.constants import RANKING_EXPORT_FORMATS
+
+
+RANKING_EXPORT_COLUMNS = (
+    'position',
+    'user_id',
+    'username',
+    'x1',
+    'x3',
+    'xx1',
+    'xx3',
+    'champion',
+    'total',
+)
+
+
+class Echo(object):
+    """File-like object returning what is written, to stream CSV lines."""
+
+    def write(self, value):
+        return value
+
+
+def ranking_lines(ranking, format='csv'):
+    """Yield the ranking as CSV or JSON lines, one row at a time."""
+    if format not in RANKING_EXPORT_FORMATS:
+        raise ValueError('Unsupported export format: %s' % format)
+
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(RANKING_EXPORT_COLUMNS)
+    for row in ranking.iterator():
+        values = [getattr(row, name, None) for name in RANKING_EXPORT_COLUMNS]
+        if format == 'csv':
+            yield writer.writerow(values)
+        else:
+            yield json.dumps(dict(zip(RANKING_EXPORT_COLUMNS, values))) + '\n'
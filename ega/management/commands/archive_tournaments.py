@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from ega.models import Tournament
+
+
+class Command(BaseCommand):
+    help = 'Freeze (again) final standings for finished tournaments'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'slugs', nargs='*', help='Tournament slugs (default: all)'
+        )
+
+    def handle(self, *args, **options):
+        tournaments = Tournament.objects.filter(finished=True)
+        if options['slugs']:
+            tournaments = tournaments.filter(slug__in=options['slugs'])
+
+        for tournament in tournaments:
+            tournament.archive()
+            self.stdout.write(
+                'Tournament archived: %s (%d users)\n'
+                % (tournament, tournament.finalstanding_set.count())
+            )
@@ -0,0 +1,71 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from ega.models import dictfetchall, rowfetchall
+
+
+class FakeCursor(object):
+    """In-memory cursor returning synthetic ranking rows."""
+
+    columns = (
+        'user_id',
+        'username',
+        'avatar',
+        'x1',
+        'x3',
+        'xx1',
+        'xx3',
+        'champion',
+        'total',
+        'position',
+    )
+
+    def __init__(self, rows):
+        self.description = [(name,) for name in self.columns]
+        self.rows = rows
+
+    def fetchall(self):
+        # fresh tuples, as a DB cursor would return
+        return [tuple(row) for row in self.rows]
+
+
+class Command(BaseCommand):
+    help = 'Compare memory and time of dict vs compact ranking rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def measure(self, fetchall, rows, repeat):
+        timings = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            fetchall(FakeCursor(rows))
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        result = fetchall(FakeCursor(rows))
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+        return min(timings), size
+
+    def handle(self, *args, **options):
+        rows = [
+            [i, 'user%d' % i, 'avatars/%d.png' % i, 3, 2, 1, 0, 5, 16, i + 1]
+            for i in range(options['rows'])
+        ]
+        self.stdout.write(
+            '%d rows, best of %d:\n' % (len(rows), options['repeat'])
+        )
+        for name, fetchall in (
+            ('dict', dictfetchall),
+            ('compact', rowfetchall),
+        ):
+            elapsed, size = self.measure(fetchall, rows, options['repeat'])
+            self.stdout.write(
+                '%-8s %8.1f ms %8.1f MiB\n'
+                % (name, elapsed * 1000, size / 1024.0 / 1024)
+            )
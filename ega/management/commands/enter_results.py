@@ -0,0 +1,90 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ega.models import Match, update_match_results
+
+
+RESULT_COLUMNS = ('home_goals', 'away_goals', 'pk_home_goals', 'pk_away_goals')
+
+
+class Command(BaseCommand):
+    help = 'Enter many match results at once, scoring them in a single pass'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help=(
+                'CSV file (- for stdin) with match, home_goals, away_goals '
+                'and optional pk_home_goals, pk_away_goals columns'
+            ),
+        )
+        parser.add_argument(
+            '--unfinished',
+            action='store_true',
+            help='Do not mark the matches as finished (partial results)',
+        )
+        parser.add_argument(
+            '--reopen',
+            action='store_true',
+            help='With --unfinished, mark finished matches as unfinished',
+        )
+
+    def read_results(self, path):
+        if path == '-':
+            return list(csv.DictReader(sys.stdin))
+        with open(path, newline='') as f:
+            return list(csv.DictReader(f))
+
+    def handle(self, *args, **options):
+        rows = self.read_results(options['path'])
+        results = {}
+        for line, row in enumerate(rows, start=2):
+            try:
+                match_id = int(row['match'])
+                results[match_id] = {
+                    name: int(row[name]) if row.get(name) else None
+                    for name in RESULT_COLUMNS
+                }
+            except (KeyError, TypeError, ValueError):
+                raise CommandError('Invalid result at line %d' % line)
+            if None in (
+                results[match_id]['home_goals'],
+                results[match_id]['away_goals'],
+            ):
+                raise CommandError('Missing goals at line %d' % line)
+
+        matches = Match.objects.in_bulk(results)
+        unknown = set(results) - set(matches)
+        if unknown:
+            raise CommandError(
+                'Unknown match: %s' % ', '.join(map(str, sorted(unknown)))
+            )
+        finished = sorted(
+            match_id for match_id, match in matches.items() if match.finished
+        )
+        if options['unfinished'] and finished and not options['reopen']:
+            raise CommandError(
+                'Already finished: %s (use --reopen to mark them unfinished)'
+                % ', '.join(map(str, finished))
+            )
+
+        for match_id, result in results.items():
+            match = matches[match_id]
+            for name, value in result.items():
+                setattr(match, name, value)
+            if not options['unfinished']:
+                match.finished = True
+            elif options['reopen']:
+                match.finished = False
+
+        changed = update_match_results(list(matches.values()))
+        for match in changed:
+            self.stdout.write(
+                'Updated result: %s: %s - %s\n'
+                % (match, match.home_goals, match.away_goals)
+            )
+        self.stdout.write(
+            '%d of %d match results changed\n' % (len(changed), len(results))
+        )
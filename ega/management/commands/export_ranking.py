@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ega.constants import RANKING_EXPORT_FORMATS
+from ega.exports import ranking_lines
+from ega.models import League, Tournament
+
+
+class Command(BaseCommand):
+    help = 'Export a tournament (or league, or round) ranking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', help='Tournament slug')
+        parser.add_argument(
+            '--format', choices=RANKING_EXPORT_FORMATS, default='csv'
+        )
+        parser.add_argument('--round', help='Only this round scores')
+        parser.add_argument('--league', help='League slug')
+
+    def handle(self, *args, **options):
+        try:
+            tournament = Tournament.objects.get(slug=options['slug'])
+        except Tournament.DoesNotExist:
+            raise CommandError('Unknown tournament: %s' % options['slug'])
+
+        scores = tournament.ranking(round=options['round'])
+        if options['league']:
+            try:
+                league = tournament.league_set.get(slug=options['league'])
+            except League.DoesNotExist:
+                raise CommandError('Unknown league: %s' % options['league'])
+            scores = league.ranking(round=options['round'])
+
+        for line in ranking_lines(scores, options['format']):
+            self.stdout.write(line, ending='')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ega.models import AllTimeStanding
+
+
+class Command(BaseCommand):
+    help = 'Recompute all-time standings from finished tournaments'
+
+    def handle(self, *args, **options):
+        AllTimeStanding.rebuild()
+        self.stdout.write(
+            'All-time standings rebuilt (%d users)\n'
+            % AllTimeStanding.objects.count()
+        )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from ega.models import Tournament
+
+
+class Command(BaseCommand):
+    help = 'Replay matches scores to rebuild standings for every round'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'slugs', nargs='*', help='Tournament slugs (default: all)'
+        )
+
+    def handle(self, *args, **options):
+        tournaments = Tournament.objects.all()
+        if options['slugs']:
+            tournaments = tournaments.filter(slug__in=options['slugs'])
+
+        for tournament in tournaments:
+            tournament.rebuild_round_standings()
+            rounds = tournament.roundstanding_set.values('round').distinct()
+            self.stdout.write(
+                'Round standings rebuilt: %s (%d rounds)\n'
+                % (tournament, rounds.count())
+            )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from ega.models import Tournament
+
+
+class Command(BaseCommand):
+    help = 'Recompute users standings from their predictions scores'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'slugs', nargs='*', help='Tournament slugs (default: all)'
+        )
+
+    def handle(self, *args, **options):
+        tournaments = Tournament.objects.all()
+        if options['slugs']:
+            tournaments = tournaments.filter(slug__in=options['slugs'])
+
+        for tournament in tournaments:
+            tournament.rebuild_standings()
+            self.stdout.write(
+                'Standings rebuilt: %s (%d users)\n'
+                % (tournament, tournament.standing_set.count())
+            )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from ega.models import TeamStats, Tournament
+
+
+class Command(BaseCommand):
+    help = 'Recompute team stats from scratch from the match results'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'slugs', nargs='*', help='Tournament slugs (default: all)'
+        )
+
+    def handle(self, *args, **options):
+        tournaments = Tournament.objects.all()
+        if options['slugs']:
+            tournaments = tournaments.filter(slug__in=options['slugs'])
+
+        for tournament in tournaments:
+            team_stats = TeamStats.rebuild(tournament)
+            self.stdout.write(
+                'Team stats rebuilt: %s (%d teams)\n'
+                % (tournament, len(team_stats))
+            )
@@ -0,0 +1,129 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ega.models import RescoreCheckpoint, Tournament
+
+
+class Command(BaseCommand):
+    help = 'Recompute predictions scores and team stats for a tournament'
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', help='Tournament slug')
+        parser.add_argument('--round', help='Only matches from this round')
+        parser.add_argument(
+            '--from-match', type=int, help='First match id to rescore'
+        )
+        parser.add_argument(
+            '--to-match', type=int, help='Last match id to rescore'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10,
+            help='Matches rescored per transaction (default: 10)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many scores would change',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue an interrupted rescore after its last match',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            tournament = Tournament.objects.get(slug=options['slug'])
+        except Tournament.DoesNotExist:
+            raise CommandError('Unknown tournament: %s' % options['slug'])
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        # interrupted rescores are resumed from their saved checkpoint
+        checkpoints = RescoreCheckpoint.objects.filter(
+            tournament=tournament, round=options['round'] or ''
+        )
+        checkpoint = None
+        if options['resume']:
+            checkpoint = checkpoints.first()
+            if checkpoint is None:
+                raise CommandError('No interrupted rescore to resume')
+
+        matches = tournament.match_set.order_by('id')
+        if options['round']:
+            matches = matches.filter(round=options['round'])
+        if options['from_match'] is not None:
+            matches = matches.filter(id__gte=options['from_match'])
+        if options['to_match'] is not None:
+            matches = matches.filter(id__lte=options['to_match'])
+        if checkpoint is not None:
+            matches = matches.filter(id__gt=checkpoint.last_match)
+        match_ids = list(matches.values_list('id', flat=True))
+
+        total = len(match_ids)
+        done = changes = predictions = 0
+        started = time.monotonic()
+        for i in range(0, total, options['batch_size']):
+            stop = i + options['batch_size']
+            batch = match_ids[i:stop]
+            try:
+                with transaction.atomic():
+                    for match in tournament.match_set.filter(
+                        id__in=batch
+                    ).order_by('id'):
+                        if options['dry_run']:
+                            changes += match.score_changes()
+                            predictions += match.prediction_set.count()
+                        else:
+                            match.rescore()
+                    if not options['dry_run']:
+                        # committed along with the batch scores
+                        RescoreCheckpoint.objects.update_or_create(
+                            tournament=tournament,
+                            round=options['round'] or '',
+                            defaults=dict(last_match=batch[-1]),
+                        )
+            except KeyboardInterrupt:
+                if not options['dry_run']:
+                    self.stderr.write('Interrupted, resume with --resume\n')
+                raise
+
+            done += len(batch)
+            elapsed = time.monotonic() - started
+            if options['dry_run']:
+                self.stdout.write(
+                    '%d/%d matches (last id %d), %d predictions, '
+                    '%.1f predictions/s\n'
+                    % (
+                        done,
+                        total,
+                        batch[-1],
+                        predictions,
+                        predictions / elapsed if elapsed else 0,
+                    )
+                )
+            else:
+                self.stdout.write(
+                    '%d/%d matches (last id %d), %.1f matches/s\n'
+                    % (
+                        done,
+                        total,
+                        batch[-1],
+                        done / elapsed if elapsed else 0,
+                    )
+                )
+
+        if options['dry_run']:
+            self.stdout.write(
+                '%s: %d matches, %d scores would change\n'
+                % (tournament, total, changes)
+            )
+        else:
+            checkpoints.delete()
+            self.stdout.write(
+                '%s: %d matches rescored\n' % (tournament, total)
+            )
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ega.constants import SCORING_JOB_BATCH_SIZE, SCORING_WORKER_POLL_INTERVAL
+from ega.models import ScoringJob
+
+
+class Command(BaseCommand):
+    help = 'Run queued match scoring jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=SCORING_JOB_BATCH_SIZE,
+            help='Jobs fetched per poll',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once there are no pending jobs',
+        )
+
+    def run_batch(self, batch_size):
+        jobs = list(ScoringJob.pending().select_related('match')[:batch_size])
+        done = 0
+        for job in jobs:
+            try:
+                if job.run():
+                    done += 1
+                    self.stdout.write('Scored: %s\n' % job.match)
+            except Exception as e:
+                self.stderr.write('Failed: %s (%r)\n' % (job.match, e))
+        return jobs, done
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            jobs, done = self.run_batch(options['batch_size'])
+            if jobs:
+                self.stdout.write(
+                    '%d/%d jobs in %.2fs, %d queued\n'
+                    % (
+                        done,
+                        len(jobs),
+                        time.monotonic() - started,
+                        ScoringJob.objects.count(),
+                    )
+                )
+            elif options['once']:
+                break
+            else:
+                time.sleep(SCORING_WORKER_POLL_INTERVAL)
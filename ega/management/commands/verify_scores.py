@@ -0,0 +1,161 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ega.constants import VERIFY_SCORES_CHUNK_SIZE
+
+# models are imported where used: spawned workers import this module
+# before setting up django (see init_worker)
+
+
+def init_worker():
+    django.setup()
+    # forked workers must not share the parent DB connections
+    connections.close_all()
+
+
+def verify_matches(match_ids):
+    """Return (match id, wrong scores count) for mismatching matches."""
+    from ega.models import Match
+
+    mismatches = []
+    for match in Match.objects.filter(id__in=match_ids).select_related(
+        'tournament'
+    ):
+        changes = match.score_changes()
+        if changes:
+            mismatches.append((match.id, changes))
+    return mismatches
+
+
+def verify_team_stats(tournament_id):
+    """Return the number of wrong (or missing) tournament team stats."""
+    from ega.models import TeamStats, Tournament
+
+    tournament = Tournament.objects.get(id=tournament_id)
+    expected = TeamStats.recompute_all(tournament)
+    empty = dict.fromkeys(TeamStats.STATS_FIELDS, 0)
+    mismatches = 0
+    for stats in TeamStats.objects.filter(tournament=tournament):
+        # teams with no finished matches have no stats at all
+        values = expected.pop(stats.team_id, empty)
+        if any(getattr(stats, k) != v for k, v in values.items()):
+            mismatches += 1
+    return mismatches + len(expected)
+
+
+class Command(BaseCommand):
+    help = 'Check stored scores and team stats against the match results'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'slugs', nargs='*', help='Tournament slugs (default: all)'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count(),
+            help='Worker processes (1 to check in this process)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=VERIFY_SCORES_CHUNK_SIZE,
+            help='Matches checked per worker task',
+        )
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            help='Rescore mismatching matches and rebuild stats/standings',
+        )
+
+    def run_tasks(self, tasks, processes):
+        if processes <= 1:
+            return [func(arg) for func, arg in tasks]
+        # do not hand the open connections over to the forked workers
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=processes, initializer=init_worker
+        ) as executor:
+            futures = [executor.submit(func, arg) for func, arg in tasks]
+            return [f.result() for f in futures]
+
+    def handle(self, *args, **options):
+        from ega.models import Match, TeamStats, Tournament
+
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        tournaments = Tournament.objects.order_by('id')
+        if options['slugs']:
+            tournaments = tournaments.filter(slug__in=options['slugs'])
+            unknown = set(options['slugs']) - set(
+                tournaments.values_list('slug', flat=True)
+            )
+            if unknown:
+                raise CommandError(
+                    'Unknown tournament: %s' % ', '.join(sorted(unknown))
+                )
+        tournaments = list(tournaments)
+
+        tasks = []
+        for tournament in tournaments:
+            match_ids = list(
+                tournament.match_set.order_by('id').values_list(
+                    'id', flat=True
+                )
+            )
+            for i in range(0, len(match_ids), options['chunk_size']):
+                stop = i + options['chunk_size']
+                tasks.append((verify_matches, match_ids[i:stop]))
+            tasks.append((verify_team_stats, tournament.id))
+        results = self.run_tasks(tasks, options['processes'])
+
+        wrong_matches = []
+        wrong_stats = {}
+        for (func, arg), result in zip(tasks, results):
+            if func is verify_matches:
+                wrong_matches.extend(result)
+            elif result:
+                wrong_stats[arg] = result
+
+        changes = sum(count for _, count in wrong_matches)
+        self.stdout.write(
+            '%d matches with %d wrong scores, %d wrong team stats\n'
+            % (len(wrong_matches), changes, sum(wrong_stats.values()))
+        )
+        if options['repair']:
+            for match in Match.objects.filter(
+                id__in=[match_id for match_id, _ in wrong_matches]
+            ).order_by('id'):
+                match.rescore()
+                self.stdout.write('Rescored: %s\n' % match)
+            for tournament in tournaments:
+                if tournament.id in wrong_stats:
+                    TeamStats.rebuild(tournament)
+                    self.stdout.write('Rebuilt team stats: %s\n' % tournament)
+
+        # standings are checked last, so repaired scores are taken into account
+        wrong_standings = 0
+        for tournament in tournaments:
+            users = tournament.standings_mismatches()
+            if not users:
+                continue
+            wrong_standings += len(users)
+            self.stdout.write(
+                '%s: %d wrong standings\n' % (tournament, len(users))
+            )
+            if options['repair']:
+                tournament.rebuild_standings()
+                self.stdout.write('Rebuilt standings: %s\n' % tournament)
+
+        mismatches = (
+            len(wrong_matches) + sum(wrong_stats.values()) + wrong_standings
+        )
+        if mismatches and not options['repair']:
+            raise CommandError(
+                'Found %d mismatches (use --repair to fix them)' % mismatches
+            )
+        self.stdout.write('Done.\n')
@@ -0,0 +1,82 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+STANDINGS_SQL = """
+INSERT INTO ega_standing
+    (user_id, tournament_id, x1, x3, xx1, xx3, champion, total)
+SELECT r.user_id, r.tournament_id, r.x1, r.x3, r.xx1, r.xx3,
+       COALESCE(cp.score, 0), COALESCE(cp.score, 0) + r.total
+FROM (SELECT
+    pred.user_id,
+    m.tournament_id,
+    SUM(case when score=1 then 1 else 0 end) AS x1,
+    SUM(case when score=3 then 1 else 0 end) AS x3,
+    SUM(case when score=2 then 1 else 0 end) AS xx1,
+    SUM(case when score=4 then 1 else 0 end) AS xx3,
+    SUM(score) AS total
+    FROM ega_prediction pred
+    INNER JOIN ega_match m ON (pred.match_id=m.id)
+    GROUP BY pred.user_id, m.tournament_id
+) r
+LEFT OUTER JOIN ega_championprediction cp
+    ON (cp.user_id=r.user_id AND cp.tournament_id=r.tournament_id)
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0010_team_emoji'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Standing',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('x1', models.IntegerField(default=0)),
+                ('x3', models.IntegerField(default=0)),
+                ('xx1', models.IntegerField(default=0)),
+                ('xx3', models.IntegerField(default=0)),
+                ('champion', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                (
+                    'tournament',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='ega.tournament',
+                    ),
+                ),
+                (
+                    'user',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='standing',
+            index=models.Index(
+                fields=['tournament', '-total', '-x3', '-champion'],
+                name='ega_standing_ranking_idx',
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name='standing',
+            unique_together={('tournament', 'user')},
+        ),
+        migrations.RunSQL(STANDINGS_SQL, migrations.RunSQL.noop),
+    ]
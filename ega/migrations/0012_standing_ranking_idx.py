@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0011_standing'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='standing',
+            name='ega_standing_ranking_idx',
+        ),
+        migrations.AddIndex(
+            model_name='standing',
+            index=models.Index(
+                fields=['tournament', '-total', '-x3', '-champion', 'user'],
+                name='ega_standing_ranking_idx',
+            ),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0012_standing_ranking_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoundStanding',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('round', models.CharField(max_length=128)),
+                ('position', models.PositiveIntegerField()),
+                ('total', models.IntegerField(default=0)),
+                ('exacts', models.IntegerField(default=0)),
+                (
+                    'tournament',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='ega.tournament',
+                    ),
+                ),
+                (
+                    'user',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                'unique_together': {('tournament', 'round', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,113 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0013_roundstanding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournament',
+            name='archived',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='FinalStanding',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('position', models.PositiveIntegerField()),
+                ('x1', models.IntegerField(default=0)),
+                ('x3', models.IntegerField(default=0)),
+                ('xx1', models.IntegerField(default=0)),
+                ('xx3', models.IntegerField(default=0)),
+                ('champion', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('played', models.IntegerField(default=0)),
+                ('score', models.IntegerField(default=0)),
+                ('winners', models.IntegerField(default=0)),
+                ('exacts', models.IntegerField(default=0)),
+                (
+                    'tournament',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='ega.tournament',
+                    ),
+                ),
+                (
+                    'user',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FinalTeamStats',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                (
+                    'zone',
+                    models.CharField(blank=True, default='', max_length=64),
+                ),
+                ('played', models.PositiveIntegerField(default=0)),
+                ('won', models.PositiveIntegerField(default=0)),
+                ('tie', models.PositiveIntegerField(default=0)),
+                ('lost', models.PositiveIntegerField(default=0)),
+                ('gf', models.PositiveIntegerField(default=0)),
+                ('gc', models.PositiveIntegerField(default=0)),
+                ('dg', models.IntegerField(default=0)),
+                ('points', models.PositiveIntegerField(default=0)),
+                ('tie_breaker', models.PositiveIntegerField(default=0)),
+                (
+                    'team',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='ega.team',
+                    ),
+                ),
+                (
+                    'tournament',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='ega.tournament',
+                    ),
+                ),
+            ],
+            options={
+                'unique_together': {('tournament', 'team')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='finalstanding',
+            index=models.Index(
+                fields=['tournament', 'position', 'user'],
+                name='ega_finalstanding_ranking_idx',
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name='finalstanding',
+            unique_together={('tournament', 'user')},
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0014_final_standings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllTimeStanding',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('total', models.IntegerField(default=0)),
+                ('exacts', models.IntegerField(default=0)),
+                ('tournaments', models.IntegerField(default=0)),
+                (
+                    'best_finish',
+                    models.PositiveIntegerField(blank=True, null=True),
+                ),
+                (
+                    'user',
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='alltimestanding',
+            index=models.Index(
+                fields=['-total', '-exacts', 'user'],
+                name='ega_alltimestanding_rank_idx',
+            ),
+        ),
+    ]
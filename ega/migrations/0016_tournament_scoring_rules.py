@@ -0,0 +1,50 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0015_alltimestanding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournament',
+            name='exact_points',
+            field=models.PositiveSmallIntegerField(default=3),
+        ),
+        migrations.AddField(
+            model_name='tournament',
+            name='goal_difference_points',
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                help_text='Bonus for the right winner and goal difference.',
+            ),
+        ),
+        migrations.AddField(
+            model_name='tournament',
+            name='knockout_multiplier',
+            field=models.PositiveSmallIntegerField(
+                default=1,
+                help_text='Exact, winner and goal difference points multiplier for knockout matches.',
+            ),
+        ),
+        migrations.AddField(
+            model_name='tournament',
+            name='penalties_points',
+            field=models.PositiveSmallIntegerField(
+                default=1, help_text='Bonus for the right penalties winner.'
+            ),
+        ),
+        migrations.AddField(
+            model_name='tournament',
+            name='starred_points',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='tournament',
+            name='winner_points',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
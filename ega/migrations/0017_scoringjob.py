@@ -0,0 +1,48 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0016_tournament_scoring_rules'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoringJob',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                (
+                    'created',
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    'run_after',
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                (
+                    'match',
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='ega.match',
+                    ),
+                ),
+            ],
+            options={
+                'ordering': ('run_after', 'id'),
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_default_predictions(apps, schema_editor):
+    EgaUser = apps.get_model('ega', 'EgaUser')
+    DefaultPrediction = apps.get_model('ega', 'DefaultPrediction')
+
+    def goals(value):
+        return None if value in (None, '') else int(value)
+
+    users = EgaUser.objects.filter(
+        preferences__default_prediction__isnull=False
+    )
+    defaults = []
+    for user in users.iterator():
+        default = user.preferences['default_prediction']
+        penalties = default.get('penalties')
+        defaults.append(
+            DefaultPrediction(
+                user=user,
+                home_goals=goals(default.get('home_goals')),
+                away_goals=goals(default.get('away_goals')),
+                penalties=penalties if penalties in ('L', 'V') else '',
+            )
+        )
+    DefaultPrediction.objects.bulk_create(defaults, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0017_scoringjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DefaultPrediction',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                (
+                    'home_goals',
+                    models.PositiveIntegerField(blank=True, null=True),
+                ),
+                (
+                    'away_goals',
+                    models.PositiveIntegerField(blank=True, null=True),
+                ),
+                ('penalties', models.CharField(blank=True, max_length=1)),
+                (
+                    'user',
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(
+            populate_default_predictions, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,116 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:02
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_predicted_rankings(apps, schema_editor):
+    # rankings were kept for the tournament last predicted by the user, and
+    # without the teams stats (recomputed on their next predictions update)
+    EgaUser = apps.get_model('ega', 'EgaUser')
+    Prediction = apps.get_model('ega', 'Prediction')
+    PredictedStanding = apps.get_model('ega', 'PredictedStanding')
+    Team = apps.get_model('ega', 'Team')
+
+    team_ids = set(Team.objects.values_list('id', flat=True))
+
+    users = EgaUser.objects.filter(
+        preferences__predicted_ranking__isnull=False
+    )
+    standings = []
+    for user in users.iterator():
+        ranking = user.preferences.pop('predicted_ranking')
+        last = (
+            Prediction.objects.filter(user=user, match__knockout=False)
+            .exclude(last_updated=None)
+            .order_by('-last_updated')
+            .values_list('match__tournament', flat=True)
+            .first()
+        )
+        if last is not None:
+            for label, team_id in ranking.items():
+                if team_id not in team_ids:
+                    continue
+                position, zone = re.match(r'(\d+)(.*)', label).groups()
+                standings.append(
+                    PredictedStanding(
+                        user=user,
+                        tournament_id=last,
+                        team_id=team_id,
+                        zone=zone,
+                        position=int(position),
+                    )
+                )
+        user.save(update_fields=['preferences'])
+    PredictedStanding.objects.bulk_create(
+        standings, batch_size=1000, ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0019_scorechange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PredictedStanding',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                (
+                    'zone',
+                    models.CharField(blank=True, default='', max_length=64),
+                ),
+                ('position', models.PositiveIntegerField()),
+                ('points', models.PositiveIntegerField(default=0)),
+                ('goal_difference', models.IntegerField(default=0)),
+                ('goals', models.PositiveIntegerField(default=0)),
+                (
+                    'team',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='ega.team',
+                    ),
+                ),
+                (
+                    'tournament',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='ega.tournament',
+                    ),
+                ),
+                (
+                    'user',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='predictedstanding',
+            index=models.Index(
+                fields=['user', 'tournament', 'zone', 'position'],
+                name='ega_predicted_standing_idx',
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name='predictedstanding',
+            unique_together={('user', 'tournament', 'team')},
+        ),
+        migrations.RunPython(
+            move_predicted_rankings, migrations.RunPython.noop
+        ),
+    ]
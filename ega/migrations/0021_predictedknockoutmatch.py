@@ -0,0 +1,78 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0020_predictedstanding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PredictedKnockoutMatch',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                (
+                    'away',
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='+',
+                        to='ega.team',
+                    ),
+                ),
+                (
+                    'home',
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='+',
+                        to='ega.team',
+                    ),
+                ),
+                (
+                    'match',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='ega.match',
+                    ),
+                ),
+                (
+                    'tournament',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='ega.tournament',
+                    ),
+                ),
+                (
+                    'user',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='predictedknockoutmatch',
+            index=models.Index(
+                fields=['user', 'tournament'],
+                name='ega_predicted_knockout_idx',
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name='predictedknockoutmatch',
+            unique_together={('user', 'match')},
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def create_missing_team_stats(apps, schema_editor):
+    Tournament = apps.get_model('ega', 'Tournament')
+    TeamStats = apps.get_model('ega', 'TeamStats')
+
+    stats = []
+    for tournament in Tournament.objects.all():
+        existing = set(
+            TeamStats.objects.filter(tournament=tournament).values_list(
+                'team_id', flat=True
+            )
+        )
+        stats.extend(
+            TeamStats(tournament=tournament, team_id=team_id)
+            for team_id in tournament.teams.values_list('id', flat=True)
+            if team_id not in existing
+        )
+    TeamStats.objects.bulk_create(stats, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0021_predictedknockoutmatch'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            create_missing_team_stats, migrations.RunPython.noop
+        ),
+    ]
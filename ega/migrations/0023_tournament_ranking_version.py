@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0022_create_missing_team_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tournament',
+            name='ranking_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0023_tournament_ranking_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scoringjob',
+            name='previous_teams',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
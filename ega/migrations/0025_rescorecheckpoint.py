@@ -0,0 +1,40 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0024_scoringjob_previous_teams'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RescoreCheckpoint',
+            fields=[
+                (
+                    'id',
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID',
+                    ),
+                ),
+                ('round', models.CharField(blank=True, max_length=128)),
+                ('last_match', models.PositiveIntegerField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+                (
+                    'tournament',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='ega.tournament',
+                    ),
+                ),
+            ],
+            options={
+                'unique_together': {('tournament', 'round')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ega', '0025_rescorecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='match',
+            name='away_placeholder',
+            field=models.CharField(
+                blank=True,
+                help_text='Shown until the team is known: a group position (e.g. 1A) or W/L and the id of another knockout match of the tournament (e.g. W49), so create the previous rounds first and use their ids.',
+                max_length=200,
+            ),
+        ),
+        migrations.AlterField(
+            model_name='match',
+            name='home_placeholder',
+            field=models.CharField(
+                blank=True,
+                help_text='Shown until the team is known: a group position (e.g. 1A) or W/L and the id of another knockout match of the tournament (e.g. W49), so create the previous rounds first and use their ids.',
+                max_length=200,
+            ),
+        ),
+    ]
@@ -1,19 +1,41 @@
 import collections
+import hashlib
 import json
 import random
+import re
 import string
+import time
+import uuid
 
-from collections import defaultdict
 from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.mail.message import EmailMessage
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import IntegrityError, connection, models
-from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, Value, When
-from django.db.models.functions import Cast
-from django.db.models.signals import post_save
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    Max,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.lookups import Exact, GreaterThan, LessThan
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
 from django.dispatch import receiver
 from django.utils.text import slugify
 from django.utils.timezone import now
@@ -23,55 +45,229 @@ from ega.constants import (
     HOURS_TO_DEADLINE,
     INVITE_BODY,
     INVITE_SUBJECT,
+    KNOCKOUT_RESULT_PLACEHOLDER,
     MATCH_WON_POINTS,
     MATCH_TIE_POINTS,
     MATCH_LOST_POINTS,
+    PENALTIES_MATCH_POINTS,
     NEXT_MATCHES_DAYS,
+    RANKING_CACHE_TIMEOUT,
+    RANKING_EXPORT_CHUNK_SIZE,
+    SCORING_JOB_MAX_ATTEMPTS,
+    SCORING_JOB_RETRY_DELAY,
+    STARRED_MATCH_POINTS,
     WINNER_MATCH_POINTS,
 )
-from ega.managers import LeagueManager, PredictionManager, TeamStatsManager
+from ega.managers import (
+    LeagueManager,
+    PredictionManager,
+    TeamStatsManager,
+)
 
 
 ALNUM_CHARS = string.ascii_letters + string.digits
-RANKING_SQL = """
-SELECT u.username as username, u.avatar as avatar,
-       r.x1 as x1, r.x3 as x3, r.xx1 as xx1, r.xx3 as xx3,
-       cp.score as champion, cp.score + r.total as total
+MISSING = object()
+PLACEHOLDER_HELP_TEXT = (
+    'Shown until the team is known: a group position (e.g. 1A) or W/L '
+    'and the id of another knockout match of the tournament (e.g. W49), '
+    'so create the previous rounds first and use their ids.'
+)
+EXPECTED_STANDINGS_SQL = """
+SELECT r.user_id, %s, r.x1, r.x3, r.xx1, r.xx3,
+       COALESCE(cp.score, 0), COALESCE(cp.score, 0) + r.total
 FROM (SELECT
     pred.user_id,
-    SUM(case when score=1 then 1 else 0 end) AS x1,
-    SUM(case when score=3 then 1 else 0 end) AS x3,
-    SUM(case when score=2 then 1 else 0 end) AS xx1,
-    SUM(case when score=4 then 1 else 0 end) AS xx3,
+    SUM(case when score=%s then 1 else 0 end) AS x1,
+    SUM(case when score=%s then 1 else 0 end) AS x3,
+    SUM(case when score=%s then 1 else 0 end) AS xx1,
+    SUM(case when score=%s then 1 else 0 end) AS xx3,
     SUM(score) AS total
     FROM ega_prediction pred
     INNER JOIN ega_match m ON (pred.match_id=m.id)
     WHERE tournament_id=%s
     GROUP BY pred.user_id
 ) r
-INNER JOIN ega_championprediction cp
+LEFT OUTER JOIN ega_championprediction cp
     ON (cp.user_id=r.user_id AND cp.tournament_id=%s)
-INNER JOIN ega_egauser u ON (r.user_id=u.id)
-ORDER BY total DESC, x3 DESC, champion DESC
 """
+STANDINGS_SQL = (
+    """
+INSERT INTO ega_standing
+    (user_id, tournament_id, x1, x3, xx1, xx3, champion, total)"""
+    + EXPECTED_STANDINGS_SQL
+)
+RANKING_SQL = """
+SELECT u.id as user_id, u.username as username, u.avatar as avatar,
+       s.x1 as x1, s.x3 as x3, s.xx1 as xx1, s.xx3 as xx3,
+       s.champion as champion, s.total as total,
+       RANK() OVER (
+           ORDER BY s.total DESC, s.x3 DESC, s.champion DESC
+       ) as position
+FROM ega_standing s
+INNER JOIN ega_egauser u ON (s.user_id=u.id)
+{members}
+WHERE s.tournament_id=%s
+"""
+RANKING_ORDER_BY = 'total DESC, x3 DESC, champion DESC, user_id'
+LIVE_RANKING_SQL = """
+SELECT r.user_id as user_id, r.username as username, r.avatar as avatar,
+       r.x1 + COALESCE(l.x1, 0) as x1, r.x3 + COALESCE(l.x3, 0) as x3,
+       r.xx1 + COALESCE(l.xx1, 0) as xx1, r.xx3 + COALESCE(l.xx3, 0) as xx3,
+       r.champion as champion, r.total + COALESCE(l.live, 0) as total,
+       COALESCE(l.live, 0) as live,
+       RANK() OVER (
+           ORDER BY r.total + COALESCE(l.live, 0) DESC,
+               r.x3 + COALESCE(l.x3, 0) DESC, r.champion DESC
+       ) as position
+FROM ({ranking}) r
+LEFT OUTER JOIN (SELECT
+    pred.user_id,
+    SUM(case when points=%s then 1 else 0 end) AS x1,
+    SUM(case when points=%s then 1 else 0 end) AS x3,
+    SUM(case when points=%s then 1 else 0 end) AS xx1,
+    SUM(case when points=%s then 1 else 0 end) AS xx3,
+    SUM(points) AS live
+    FROM ({predictions}) pred
+    GROUP BY pred.user_id
+) l ON (l.user_id=r.user_id)
+"""
+ROUND_STANDINGS_SQL = """
+INSERT INTO ega_roundstanding
+    (tournament_id, round, user_id, position, total, exacts)
+SELECT s.tournament_id, %s, s.user_id,
+       RANK() OVER (
+           ORDER BY s.total DESC, s.x3 DESC, s.champion DESC
+       ),
+       s.total, s.x3 + s.xx3
+FROM ega_standing s
+WHERE s.tournament_id=%s
+"""
+FINAL_STANDINGS_SQL = """
+INSERT INTO ega_finalstanding
+    (tournament_id, user_id, position, x1, x3, xx1, xx3, champion, total,
+     played, score, winners, exacts)
+SELECT s.tournament_id, s.user_id,
+       RANK() OVER (
+           ORDER BY s.total DESC, s.x3 DESC, s.champion DESC
+       ),
+       s.x1, s.x3, s.xx1, s.xx3, s.champion, s.total,
+       COALESCE(p.played, 0), COALESCE(p.score, 0),
+       COALESCE(p.winners, 0), COALESCE(p.exacts, 0)
+FROM ega_standing s
+LEFT OUTER JOIN (SELECT
+    pred.user_id,
+    COUNT(*) AS played,
+    SUM(score) AS score,
+    SUM(case when score>0 then 1 else 0 end) AS winners,
+    SUM(case when score=%s then 1 else 0 end) AS exacts
+    FROM ega_prediction pred
+    INNER JOIN ega_match m ON (pred.match_id=m.id)
+    WHERE tournament_id=%s AND m.finished=%s
+    GROUP BY pred.user_id
+) p ON (p.user_id=s.user_id)
+WHERE s.tournament_id=%s
+"""
+ALL_TIME_STANDINGS_SQL = """
+INSERT INTO ega_alltimestanding
+    (user_id, total, exacts, tournaments, best_finish)
+SELECT f.user_id, SUM(f.total), SUM(f.x3 + f.xx3), COUNT(*), MIN(f.position)
+FROM ega_finalstanding f
+GROUP BY f.user_id
+"""
+FINAL_RANKING_SQL = """
+SELECT u.id as user_id, u.username as username, u.avatar as avatar,
+       f.x1 as x1, f.x3 as x3, f.xx1 as xx1, f.xx3 as xx3,
+       f.champion as champion, f.total as total,
+       RANK() OVER (ORDER BY f.position) as position
+FROM ega_finalstanding f
+INNER JOIN ega_egauser u ON (f.user_id=u.id)
+{members}
+WHERE f.tournament_id=%s
+"""
+FINAL_RANKING_ORDER_BY = 'position, user_id'
 ROUND_RANKING_SQL = """
-SELECT u.username as username, u.avatar as avatar,
+SELECT u.id as user_id, u.username as username, u.avatar as avatar,
        r.x1 as x1, r.x3 as x3, r.xx1 as xx1, r.xx3 as xx3,
-       r.total as total
+       r.total as total,
+       RANK() OVER (ORDER BY r.total DESC, r.x3 DESC) as position
 FROM (SELECT
     pred.user_id,
-    SUM(case when score=1 then 1 else 0 end) AS x1,
-    SUM(case when score=3 then 1 else 0 end) AS x3,
-    SUM(case when score=2 then 1 else 0 end) AS xx1,
-    SUM(case when score=4 then 1 else 0 end) AS xx3,
+    SUM(case when score=%s then 1 else 0 end) AS x1,
+    SUM(case when score=%s then 1 else 0 end) AS x3,
+    SUM(case when score=%s then 1 else 0 end) AS xx1,
+    SUM(case when score=%s then 1 else 0 end) AS xx3,
     SUM(score) AS total
     FROM ega_prediction pred
     INNER JOIN ega_match m ON (pred.match_id=m.id)
+    {members}
     WHERE tournament_id=%s AND m.round=%s
     GROUP BY pred.user_id
 ) r
 INNER JOIN ega_egauser u ON (r.user_id=u.id)
-ORDER BY total DESC, x3 DESC
+"""
+ROUND_RANKING_ORDER_BY = 'total DESC, x3 DESC, user_id'
+TEAM_STATS_SQL = """
+SELECT r.team_id,
+       SUM(case when r.gf > r.gc then 1 else 0 end) AS won,
+       SUM(case when r.gf = r.gc then 1 else 0 end) AS tie,
+       SUM(case when r.gf < r.gc then 1 else 0 end) AS lost,
+       COALESCE(SUM(r.gf), 0) AS gf,
+       COALESCE(SUM(r.gc), 0) AS gc
+FROM (
+    SELECT home_id AS team_id, home_goals AS gf, away_goals AS gc
+    FROM ega_match
+    WHERE tournament_id=%s AND finished=%s AND knockout=%s
+        AND home_id IS NOT NULL
+    UNION ALL
+    SELECT away_id AS team_id, away_goals AS gf, home_goals AS gc
+    FROM ega_match
+    WHERE tournament_id=%s AND finished=%s AND knockout=%s
+        AND away_id IS NOT NULL
+) r
+GROUP BY r.team_id
+"""
+PREDICTED_STANDINGS_SQL = """
+INSERT INTO ega_predictedstanding
+    (user_id, tournament_id, team_id, zone, position, points,
+     goal_difference, goals)
+SELECT %s, %s, s.team_id, s.zone,
+       ROW_NUMBER() OVER (
+           PARTITION BY s.zone
+           ORDER BY s.points DESC, s.goal_difference DESC, s.goals DESC,
+                    s.team_id
+       ),
+       s.points, s.goal_difference, s.goals
+FROM (SELECT
+    r.team_id,
+    COALESCE(ts.zone, '') AS zone,
+    SUM(case when r.gf > r.gc then %s
+             when r.gf = r.gc then %s
+             else %s end) AS points,
+    SUM(r.gf - r.gc) AS goal_difference,
+    SUM(r.gf) AS goals
+    FROM (
+        SELECT m.home_id AS team_id, p.home_goals AS gf, p.away_goals AS gc
+        FROM ega_prediction p
+        INNER JOIN ega_match m ON (p.match_id=m.id)
+        WHERE p.user_id=%s AND m.tournament_id=%s AND m.knockout=%s
+            AND m.home_id IS NOT NULL
+            AND p.home_goals IS NOT NULL AND p.away_goals IS NOT NULL
+        UNION ALL
+        SELECT m.away_id AS team_id, p.away_goals AS gf, p.home_goals AS gc
+        FROM ega_prediction p
+        INNER JOIN ega_match m ON (p.match_id=m.id)
+        WHERE p.user_id=%s AND m.tournament_id=%s AND m.knockout=%s
+            AND m.away_id IS NOT NULL
+            AND p.home_goals IS NOT NULL AND p.away_goals IS NOT NULL
+    ) r
+    LEFT OUTER JOIN ega_teamstats ts
+        ON (ts.team_id=r.team_id AND ts.tournament_id=%s)
+    GROUP BY r.team_id, ts.zone
+) s
+"""
+LEAGUE_MEMBERS_SQL = """
+    INNER JOIN ega_leaguemember lm
+        ON (lm.user_id={} AND lm.league_id=%s)
 """
 
 
@@ -87,6 +283,270 @@ def dictfetchall(cursor):
     ]
 
 
+class RankingRow(object):
+    """A ranking row, a compact alternative to a row dict.
+
+    Values are kept in the cursor row tuple, with a column index shared by
+    all the rows of a query. Columns are available both as attributes and
+    as keys (row['total']).
+    """
+
+    __slots__ = ('_index', '_values', 'last_position', 'gap')
+
+    def __init__(self, index, values, last_position=None, gap=False):
+        self._index = index
+        self._values = values
+        self.last_position = last_position
+        self.gap = gap
+
+    def __getattr__(self, name):
+        # only called for names other than the slots above
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._values[self._index[name]]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __reduce__(self):
+        return (
+            RankingRow,
+            (self._index, self._values, self.last_position, self.gap),
+        )
+
+    def __repr__(self):
+        return '<RankingRow: %s>' % dict(
+            (name, self._values[i]) for name, i in self._index.items()
+        )
+
+
+def rowfetchall(cursor):
+    """Returns all rows from a cursor as RankingRow instances."""
+    index = {col[0]: i for i, col in enumerate(cursor.description)}
+    return [RankingRow(index, row) for row in cursor.fetchall()]
+
+
+def ranking_version(tournament_id):
+    """Return the current version of the tournament cached rankings."""
+    return (
+        Tournament.objects.filter(id=tournament_id)
+        .values_list('ranking_version', flat=True)
+        .first()
+    )
+
+
+def invalidate_rankings(tournament_id):
+    """Bump the tournament rankings version, discarding cached ones.
+
+    The version lives in the DB, so every process sees the bump (once
+    committed). It is time based, so a rolled back bump is never reused.
+    """
+    Tournament.objects.filter(id=tournament_id).update(
+        ranking_version=Greatest(
+            F('ranking_version') + 1, Value(time.time_ns() // 1000)
+        )
+    )
+
+
+class Ranking(object):
+    """Users ranking, lazily fetched (one slice at a time) from the DB.
+
+    If a cache key is given, every query result is cached (until the
+    tournament rankings are invalidated, see invalidate_rankings).
+    """
+
+    def __init__(self, query, params, order_by, cache_key=None):
+        self.query = query
+        self.params = params
+        self.order_by = order_by
+        self.cache_key = cache_key
+        self._count = None
+        self._version = None
+
+    def _execute(self, query, params):
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+        return cursor
+
+    def _cached(self, name, func):
+        if self.cache_key is None:
+            return func()
+
+        tournament_id = self.cache_key[0]
+        if self._version is None:
+            self._version = ranking_version(tournament_id)
+        digest = hashlib.md5(repr(self.cache_key + name).encode('utf-8'))
+        key = 'ega:ranking:%s:%s:%s' % (
+            tournament_id,
+            self._version,
+            digest.hexdigest(),
+        )
+        result = cache.get(key, MISSING)
+        if result is MISSING:
+            result = func()
+            cache.set(key, result, RANKING_CACHE_TIMEOUT)
+        return result
+
+    def _fetchone(self, query, params):
+        row = self._execute(query, params).fetchone()
+        return row[0] if row is not None else None
+
+    def count(self):
+        """Return the number of users in the ranking."""
+        if self._count is None:
+            query = 'SELECT COUNT(*) FROM (' + self.query + ') ranking'
+            self._count = self._cached(
+                ('count',), lambda: self._fetchone(query, self.params)
+            )
+        return self._count
+
+    def position(self, user):
+        """Return user position (ties share it), or None if not ranked."""
+        query = (
+            'SELECT position FROM (' + self.query + ') ranking '
+            'WHERE user_id=%s'
+        )
+        params = self.params + [user.id]
+        return self._cached(
+            ('position', user.id), lambda: self._fetchone(query, params)
+        )
+
+    def around(self, user, top, context):
+        """Return the top rows plus the rows surrounding the given user.
+
+        Rows following a gap in the ranking are flagged with `gap` set.
+        """
+        rows = self[:top]
+        query = (
+            'SELECT num FROM (SELECT user_id, ROW_NUMBER() OVER (ORDER BY '
+            + self.order_by
+            + ') AS num FROM ('
+            + self.query
+            + ') ranking) numbered WHERE user_id=%s'
+        )
+        params = self.params + [user.id]
+        num = self._cached(
+            ('row', user.id), lambda: self._fetchone(query, params)
+        )
+        if num is None:
+            return rows
+
+        index = num - 1
+        start = max(index - context, top)
+        stop = index + context + 1
+        nearby = self[start:stop]
+        if nearby and start > top:
+            nearby[0].gap = True
+        return rows + nearby
+
+    def live(self, matches):
+        """Return the ranking including the in-progress matches points.
+
+        Each user total (and score categories counts) gets the points its
+        predictions would score if the matches ended with their current
+        result (in a `live` column), and users are ranked again, by the DB.
+        Nothing is written to the DB; results are cached per matches result.
+        """
+        state = tuple(
+            (
+                m.id,
+                m.home_goals,
+                m.away_goals,
+                m.pk_home_goals,
+                m.pk_away_goals,
+            )
+            for m in matches
+        )
+        live = Case(
+            *[
+                When(
+                    match=m.id,
+                    then=prediction_score_updates(m, defaults=True)['score'],
+                )
+                for m in matches
+            ],
+            default=Value(0),
+        )
+        predictions = (
+            Prediction.objects.filter(match__in=[m.id for m in matches])
+            .annotate(points=live)
+            .order_by()
+            .values('user_id', 'points')
+        )
+        query, params = predictions.query.sql_with_params()
+        params = (
+            list(self.params)
+            + list(matches[0].tournament.score_categories)
+            + list(params)
+        )
+        cache_key = None
+        if self.cache_key is not None:
+            cache_key = self.cache_key + (('live',) + state,)
+        return Ranking(
+            LIVE_RANKING_SQL.format(ranking=self.query, predictions=query),
+            params,
+            self.order_by,
+            cache_key,
+        )
+
+    def iterator(self, chunk_size=RANKING_EXPORT_CHUNK_SIZE):
+        """Yield every ranking row, uncached.
+
+        Rows are fetched in chunks through a server-side cursor (where the
+        DB supports it), so memory use does not depend on ranking size.
+        """
+        query = self.query + ' ORDER BY ' + self.order_by
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(query, self.params)
+            index = {col[0]: i for i, col in enumerate(cursor.description)}
+            rows = cursor.fetchmany(chunk_size)
+            while rows:
+                for row in rows:
+                    yield RankingRow(index, row)
+                rows = cursor.fetchmany(chunk_size)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[0:])
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start = key.start or 0
+            stop = key.stop
+            if start < 0 or (stop is not None and stop < 0):
+                raise ValueError('Negative indexing is not supported.')
+            if stop is None:
+                limit = connection.ops.no_limit_value()
+            else:
+                limit = max(stop - start, 0)
+
+            query = self.query + ' ORDER BY ' + self.order_by
+            params = list(self.params)
+            if limit is not None:
+                query += ' LIMIT %s'
+                params.append(limit)
+            if start:
+                query += ' OFFSET %s'
+                params.append(start)
+            return self._cached(
+                ('slice', start, limit),
+                lambda: rowfetchall(self._execute(query, params)),
+            )
+
+        rows = self[slice(key, key + 1)]
+        if not rows:
+            raise IndexError('Ranking index out of range.')
+        return rows[0]
+
+
 class EgaUser(AbstractUser):
     avatar = models.ImageField(
         upload_to='avatars',
@@ -101,6 +561,41 @@ class EgaUser(AbstractUser):
     referred_on = models.DateTimeField(null=True)
     preferences = models.JSONField(encoder=DjangoJSONEncoder, default=dict)
 
+    # user columns included in the (cached) rankings rows
+    RANKING_FIELDS = ('username', 'avatar')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._track_ranking_values()
+        return instance
+
+    def _track_ranking_values(self):
+        deferred = self.get_deferred_fields()
+        if deferred & set(self.RANKING_FIELDS):
+            self._ranking_values = None
+        else:
+            self._ranking_values = self._current_ranking_values()
+
+    def _current_ranking_values(self):
+        # avatar files are compared by name
+        return tuple(str(getattr(self, name)) for name in self.RANKING_FIELDS)
+
+    def ranking_values_changed(self):
+        """Whether the user columns shown in rankings changed since loaded.
+
+        They are considered changed if the user was not loaded from the DB
+        (or was loaded with some of them deferred).
+        """
+        loaded = getattr(self, '_ranking_values', None)
+        return loaded is None or loaded != self._current_ranking_values()
+
+    def invalidate_rankings(self):
+        """Discard the cached rankings of the user tournaments."""
+        tournaments = self.standing_set.values_list('tournament', flat=True)
+        for tournament_id in tournaments.distinct():
+            invalidate_rankings(tournament_id)
+
     @property
     def default_prediction(self):
         return self.preferences.get('default_prediction')
@@ -119,56 +614,105 @@ class EgaUser(AbstractUser):
             }
 
     def predicted_ranking(self, tournament):
-        return self.preferences.get('predicted_ranking', {})
+        """Return predicted team ids by position label (e.g. 1A, 2A)."""
+        standings = self.predictedstanding_set.filter(tournament=tournament)
+        return {
+            '{}{}'.format(position, zone): team_id
+            for zone, position, team_id in standings.values_list(
+                'zone', 'position', 'team'
+            )
+        }
 
     def update_predicted_ranking(self, tournament):
-        preds = self.prediction_set.filter(
-            match__tournament=tournament,
-            match__knockout=False,
-            home_goals__isnull=False,
-            away_goals__isnull=False,
+        """Recompute the user predicted group standings for tournament.
+
+        Teams are ranked in their zone (as in the tournament team stats) by
+        predicted points, goal difference and goals, in a single query.
+        """
+        params = [
+            self.id,
+            tournament.id,
+            MATCH_WON_POINTS,
+            MATCH_TIE_POINTS,
+            MATCH_LOST_POINTS,
+        ]
+        params += [self.id, tournament.id, False] * 2 + [tournament.id]
+        with transaction.atomic():
+            self.predictedstanding_set.filter(tournament=tournament).delete()
+            cursor = connection.cursor()
+            cursor.execute(PREDICTED_STANDINGS_SQL, params)
+            self.update_predicted_bracket(tournament)
+
+    def predicted_bracket(self, tournament):
+        """Return the user predicted knockout matches, in playing order."""
+        return (
+            self.predictedknockoutmatch_set.filter(tournament=tournament)
+            .select_related('match', 'home', 'away')
+            .order_by('match__when', 'match')
         )
 
-        # track (points, goal diff, goals) per team
-        stats = defaultdict(lambda: (0, 0, 0))
-        for p in preds:
-            home_points = away_points = MATCH_TIE_POINTS
-            if p.home_goals > p.away_goals:
-                home_points = MATCH_WON_POINTS
-                away_points = MATCH_LOST_POINTS
-            elif p.home_goals < p.away_goals:
-                home_points = MATCH_LOST_POINTS
-                away_points = MATCH_WON_POINTS
-            home_update = (
-                home_points,
-                p.home_goals - p.away_goals,
-                p.home_goals,
-            )
-            away_update = (
-                away_points,
-                p.away_goals - p.home_goals,
-                p.away_goals,
-            )
-            stats[p.match.home_id] = tuple(
-                map(sum, zip(stats[p.match.home_id], home_update))
-            )
-            stats[p.match.away_id] = tuple(
-                map(sum, zip(stats[p.match.away_id], away_update))
-            )
-
-        standings = sorted(stats.items(), key=lambda i: i[1], reverse=True)
-        stats = TeamStats.objects.filter(tournament=tournament)
-        zones = {s.team_id: s.zone for s in stats}
-        counters = defaultdict(lambda: 1)
-        rankings = {}
-        for team_id, _ in standings:
-            zone = zones[team_id]
-            pos = counters[zone]
-            counters[zone] += 1
-            label = '{}{}'.format(pos, zone)
-            rankings[label] = team_id
-        self.preferences['predicted_ranking'] = rankings
-        self.save(update_fields=['preferences'])
+    def update_predicted_bracket(self, tournament):
+        """Recompute the knockout matches teams according to predictions.
+
+        Knockout match placeholders are resolved with the user predicted
+        group standings (e.g. 1A) or the predicted result of a previous
+        knockout match (e.g. W49, see KNOCKOUT_RESULT_PLACEHOLDER).
+        """
+        standings = self.predicted_ranking(tournament)
+        matches = {m.id: m for m in tournament.match_set.filter(knockout=True)}
+        predictions = {
+            p.match_id: p
+            for p in self.prediction_set.filter(match__in=matches)
+        }
+        teams = {}
+        results = {}
+
+        def resolve(team_id, placeholder):
+            if team_id is not None:
+                return team_id
+            result = re.match(KNOCKOUT_RESULT_PLACEHOLDER, placeholder)
+            if result is None:
+                return standings.get(placeholder)
+            winner, loser = predicted_result(int(result['match']))
+            return winner if result['result'] == 'W' else loser
+
+        def predicted_result(match_id):
+            # placeholders may reference any match, whatever its date
+            match = matches.get(match_id)
+            if match is None or match_id in teams:
+                return results.get(match_id, (None, None))
+            teams[match_id] = (None, None)  # guard against cycles
+            home_id = resolve(match.home_id, match.home_placeholder)
+            away_id = resolve(match.away_id, match.away_placeholder)
+            teams[match_id] = (home_id, away_id)
+            prediction = predictions.get(match_id)
+            if prediction is not None and None not in (home_id, away_id):
+                winner = prediction.winner
+                if winner == 'L':
+                    results[match_id] = (home_id, away_id)
+                elif winner == 'V':
+                    results[match_id] = (away_id, home_id)
+            return results.get(match_id, (None, None))
+
+        bracket = []
+        for match_id, match in matches.items():
+            predicted_result(match_id)
+            home_id, away_id = teams[match_id]
+            bracket.append(
+                PredictedKnockoutMatch(
+                    user=self,
+                    tournament=tournament,
+                    match=match,
+                    home_id=home_id,
+                    away_id=away_id,
+                )
+            )
+
+        with transaction.atomic():
+            self.predictedknockoutmatch_set.filter(
+                tournament=tournament
+            ).delete()
+            PredictedKnockoutMatch.objects.bulk_create(bracket)
 
     def record_referral(self, other):
         created = False
@@ -212,6 +756,12 @@ class EgaUser(AbstractUser):
 
     def stats(self, tournament, round=None):
         """User stats for given tournament."""
+        if round is None and tournament.is_archived:
+            stats = tournament.finalstanding_set.filter(user=self).values(
+                'score', 'winners', 'exacts', count=F('played')
+            )
+            return stats.first() or dict(count=0, score=0, winners=0, exacts=0)
+
         stats = {}
         ranking = Prediction.objects.filter(
             match__tournament=tournament,
@@ -226,7 +776,7 @@ class EgaUser(AbstractUser):
         stats['score'] = sum(r.score for r in ranking)
         stats['winners'] = sum(1 for r in ranking if r.score > 0)
         stats['exacts'] = sum(
-            1 for r in ranking if r.score == EXACTLY_MATCH_POINTS
+            1 for r in ranking if r.score == tournament.exact_points
         )
         return stats
 
@@ -240,10 +790,127 @@ class Tournament(models.Model):
     image = models.ImageField(upload_to='tournaments', null=True, blank=True)
     published = models.BooleanField(default=False)
     finished = models.BooleanField(default=False)
+    # when final standings were frozen (see archive)
+    archived = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # scoring rules, see prediction_score_updates
+    exact_points = models.PositiveSmallIntegerField(
+        default=EXACTLY_MATCH_POINTS
+    )
+    winner_points = models.PositiveSmallIntegerField(
+        default=WINNER_MATCH_POINTS
+    )
+    goal_difference_points = models.PositiveSmallIntegerField(
+        default=0,
+        help_text='Bonus for the right winner and goal difference.',
+    )
+    starred_points = models.PositiveSmallIntegerField(
+        default=STARRED_MATCH_POINTS
+    )
+    penalties_points = models.PositiveSmallIntegerField(
+        default=PENALTIES_MATCH_POINTS,
+        help_text='Bonus for the right penalties winner.',
+    )
+    knockout_multiplier = models.PositiveSmallIntegerField(
+        default=1,
+        help_text='Exact, winner and goal difference points multiplier '
+        'for knockout matches.',
+    )
+    # cached rankings version, see invalidate_rankings
+    ranking_version = models.PositiveBigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
 
+    # rules deciding the score categories counted in standings
+    SCORE_CATEGORY_FIELDS = ('winner_points', 'exact_points', 'starred_points')
+
+    def save(self, *args, **kwargs):
+        previous = None
+        if not self._state.adding:
+            previous = (
+                Tournament.objects.filter(pk=self.pk)
+                .values_list(*self.SCORE_CATEGORY_FIELDS)
+                .first()
+            )
+            if kwargs.get('update_fields') is None:
+                # never write back a (possibly outdated) rankings version
+                kwargs['update_fields'] = [
+                    f.name
+                    for f in self._meta.concrete_fields
+                    if not f.primary_key and f.name != 'ranking_version'
+                ]
+        super().save(*args, **kwargs)
+        current = tuple(
+            getattr(self, name) for name in self.SCORE_CATEGORY_FIELDS
+        )
+        if previous is not None and previous != current:
+            # standings count scores by category, recount them all (so
+            # later score changes are applied with the new categories)
+            self.rebuild_standings()
+
+    @property
+    def score_categories(self):
+        """Scores counted as (x1, x3, xx1, xx3) in users standings.
+
+        That is: winner, exact, starred winner and starred exact. Scores
+        including other bonuses only count for the total.
+        """
+        return (
+            self.winner_points,
+            self.exact_points,
+            self.winner_points + self.starred_points,
+            self.exact_points + self.starred_points,
+        )
+
+    @property
+    def is_archived(self):
+        return self.finished and self.archived is not None
+
+    def archive(self):
+        """Freeze users final standings and stats, and the teams table."""
+        with transaction.atomic():
+            self.unarchive()
+            cursor = connection.cursor()
+            cursor.execute(
+                FINAL_STANDINGS_SQL,
+                [self.exact_points, self.id, True, self.id],
+            )
+            FinalTeamStats.objects.bulk_create(
+                FinalTeamStats(
+                    tournament=self,
+                    team_id=stats.team_id,
+                    zone=stats.zone,
+                    played=stats.played,
+                    won=stats.won,
+                    tie=stats.tie,
+                    lost=stats.lost,
+                    gf=stats.gf,
+                    gc=stats.gc,
+                    dg=stats.dg,
+                    points=stats.points,
+                    tie_breaker=stats.tie_breaker,
+                )
+                for stats in self.team_ranking()
+            )
+            update_all_time_standings(self)
+            self.archived = now()
+            Tournament.objects.filter(pk=self.pk).update(
+                archived=self.archived
+            )
+        invalidate_rankings(self.id)
+
+    def unarchive(self):
+        """Discard frozen standings, going back to the live ones."""
+        if self.archived is not None:
+            update_all_time_standings(self, sign=-1)
+        self.finalstanding_set.all().delete()
+        self.finalteamstats_set.all().delete()
+        AllTimeStanding.objects.filter(tournaments=0).delete()
+        self.archived = None
+        Tournament.objects.filter(pk=self.pk).update(archived=None)
+        invalidate_rankings(self.id)
+
     def current_round(self):
         current = None
         try:
@@ -253,28 +920,181 @@ class Tournament(models.Model):
             pass
         return current
 
+    def closed_rounds(self):
+        """Return rounds with no pending matches, in the order they closed."""
+        pending = self.match_set.filter(finished=False, suspended=False)
+        rounds = (
+            self.match_set.exclude(round='')
+            .exclude(round__in=pending.values('round'))
+            .values('round')
+            .annotate(last_played=Max('when'))
+            .order_by('last_played')
+        )
+        return [r['round'] for r in rounds]
+
+    def is_round_closed(self, round):
+        pending = self.match_set.filter(
+            round=round, finished=False, suspended=False
+        )
+        return bool(round) and not pending.exists()
+
+    def snapshot_round(self, round):
+        """Store users standings as of the given round end."""
+        with transaction.atomic():
+            self.roundstanding_set.filter(round=round).delete()
+            cursor = connection.cursor()
+            cursor.execute(ROUND_STANDINGS_SQL, [round, self.id])
+
+    def update_round_standings(self, round):
+        """Store (or discard) the round standings after a match is scored.
+
+        Standings are stored once the round is closed, provided it is the
+        current round (otherwise they would include later rounds scores;
+        use rebuild_round_standings to fix past rounds).
+        """
+        if not self.is_round_closed(round):
+            self.roundstanding_set.filter(round=round).delete()
+        elif round == self.current_round():
+            self.snapshot_round(round)
+
+    def rebuild_round_standings(self):
+        """Replay finished matches scores, round by round, from scratch.
+
+        Users standings are recomputed and the standings of every closed
+        round are stored as if its matches were played in order.
+        """
+        with transaction.atomic():
+            self.roundstanding_set.all().delete()
+            self.standing_set.update(
+                x1=0, x3=0, xx1=0, xx3=0, total=F('champion')
+            )
+            finished = self.match_set.filter(finished=True)
+            rounds = self.closed_rounds()
+            for round in rounds:
+                for match in finished.filter(round=round):
+                    update_standings(match)
+                self.snapshot_round(round)
+            for match in finished.exclude(round__in=rounds):
+                update_standings(match)
+        invalidate_rankings(self.id)
+
+    def previous_round_positions(self, users):
+        """Return users positions at the end of the previous round.
+
+        The previous round is the latest closed round other than the
+        current one (the latest round with played matches).
+        """
+        current = self.current_round()
+        snapshots = self.roundstanding_set.exclude(round=current)
+        rounds = [r for r in self.closed_rounds() if r != current]
+        if not rounds:
+            return {}
+        positions = snapshots.filter(round=rounds[-1], user__in=users)
+        return dict(positions.values_list('user_id', 'position'))
+
+    def live_matches(self):
+        """Return the matches in progress (with a partial result)."""
+        return list(
+            self.match_set.filter(
+                finished=False,
+                suspended=False,
+                home_goals__isnull=False,
+                away_goals__isnull=False,
+            )
+        )
+
     def next_matches(self, days=NEXT_MATCHES_DAYS):
         """Return matches in the next days."""
         tz_now = now() + timedelta(hours=HOURS_TO_DEADLINE)
         until = tz_now + timedelta(days=days)
         return self.match_set.filter(when__range=(tz_now, until))
 
-    def ranking(self, round=None):
-        """Users ranking in the tournament."""
-        if round is not None:
-            params = [self.id, round]
-            query = ROUND_RANKING_SQL
-        else:
-            params = [self.id, self.id]
+    def ranking(self, round=None, league=None):
+        """Users ranking in the tournament (or in one of its leagues)."""
+        # params before and after the league members join
+        before = []
+        if round is None and self.is_archived:
+            query = FINAL_RANKING_SQL
+            members_user = 'f.user_id'
+            order_by = FINAL_RANKING_ORDER_BY
+            params = [self.id]
+        elif round is None:
             query = RANKING_SQL
+            members_user = 's.user_id'
+            order_by = RANKING_ORDER_BY
+            params = [self.id]
+        else:
+            query = ROUND_RANKING_SQL
+            members_user = 'pred.user_id'
+            order_by = ROUND_RANKING_ORDER_BY
+            before = list(self.score_categories)
+            params = [self.id, round]
 
+        members = ''
+        if league is not None:
+            members = LEAGUE_MEMBERS_SQL.format(members_user)
+            params = [league.id] + params
+        params = before + params
+
+        cache_key = (self.id, round, league.id if league is not None else None)
+        return Ranking(
+            query.format(members=members), params, order_by, cache_key
+        )
+
+    def rebuild_standings(self):
+        """Recompute users standings from scratch."""
+        with transaction.atomic():
+            self.standing_set.all().delete()
+            cursor = connection.cursor()
+            cursor.execute(
+                STANDINGS_SQL,
+                [self.id, *self.score_categories, self.id, self.id],
+            )
+        invalidate_rankings(self.id)
+
+    def standings_mismatches(self):
+        """Return ids of users whose standing differs from a rebuilt one."""
         cursor = connection.cursor()
-        cursor.execute(query, params)
-        ranking = dictfetchall(cursor)
-        return ranking
+        cursor.execute(
+            EXPECTED_STANDINGS_SQL,
+            [self.id, *self.score_categories, self.id, self.id],
+        )
+        # skip the tournament id column
+        expected = {row[0]: tuple(row[2:]) for row in cursor.fetchall()}
+        stored = {
+            row[0]: tuple(row[1:])
+            for row in self.standing_set.values_list(
+                'user', 'x1', 'x3', 'xx1', 'xx3', 'champion', 'total'
+            )
+        }
+        empty = (0,) * 6
+        return sorted(
+            user_id
+            for user_id in expected.keys() | stored.keys()
+            if expected.get(user_id, empty) != stored.get(user_id, empty)
+        )
+
+    def scores_at(self, when):
+        """Return users predictions scores as of the given datetime.
+
+        Replayed from the score changes ledger (so only as complete as it).
+        """
+        changes = ScoreChange.objects.filter(
+            match__tournament=self, created__lte=when
+        )
+        return dict(
+            changes.values('user')
+            .annotate(total=Sum(F('new_score') - F('old_score')))
+            .values_list('user', 'total')
+        )
 
     def team_ranking(self):
         """Return tournament teams ranking."""
+        if self.is_archived:
+            return self.finalteamstats_set.order_by(
+                'zone', '-points', '-dg', '-gf', 'tie_breaker'
+            )
+
         ranking = (
             self.teamstats_set.all()
             .annotate(
@@ -284,6 +1104,36 @@ class Tournament(models.Model):
         )
         return ranking
 
+    def team_details(self, team_ids, latest=3):
+        """Return teams (stats, latest played matches), by team id.
+
+        Loaded in two queries for all the teams (stats are not created if
+        missing, see create_team_stats).
+        """
+        team_ids = set(team_ids)
+        stats = {
+            s.team_id: s for s in self.teamstats_set.filter(team__in=team_ids)
+        }
+        latest_matches = {team_id: [] for team_id in team_ids}
+        matches = (
+            self.match_set.filter(
+                Q(home__in=team_ids) | Q(away__in=team_ids),
+                finished=True,
+                when__lte=now(),
+            )
+            .select_related('home', 'away')
+            .order_by('-when')
+        )
+        for match in matches:
+            for team_id in (match.home_id, match.away_id):
+                team_matches = latest_matches.get(team_id)
+                if team_matches is not None and len(team_matches) < latest:
+                    team_matches.append(match)
+        return {
+            team_id: (stats.get(team_id), latest_matches[team_id])
+            for team_id in team_ids
+        }
+
     def most_common_results(self, n):
         """Return the most common results."""
         results = self.match_set.filter(
@@ -342,7 +1192,9 @@ class Match(models.Model):
         related_name='home_games',
         on_delete=models.CASCADE,
     )
-    home_placeholder = models.CharField(max_length=200, blank=True)
+    home_placeholder = models.CharField(
+        max_length=200, blank=True, help_text=PLACEHOLDER_HELP_TEXT
+    )
     away = models.ForeignKey(
         Team,
         blank=True,
@@ -350,7 +1202,9 @@ class Match(models.Model):
         related_name='away_games',
         on_delete=models.CASCADE,
     )
-    away_placeholder = models.CharField(max_length=200, blank=True)
+    away_placeholder = models.CharField(
+        max_length=200, blank=True, help_text=PLACEHOLDER_HELP_TEXT
+    )
     home_goals = models.IntegerField(null=True, blank=True)
     away_goals = models.IntegerField(null=True, blank=True)
     pk_home_goals = models.IntegerField(null=True, blank=True)
@@ -369,6 +1223,36 @@ class Match(models.Model):
     suspended = models.BooleanField(default=False)
     finished = models.BooleanField(default=False)
 
+    # fields affecting predictions scores and team stats
+    RESULT_FIELDS = frozenset(
+        (
+            'home_id',
+            'away_id',
+            'home_goals',
+            'away_goals',
+            'pk_home_goals',
+            'pk_away_goals',
+            'tournament_id',
+            'round',
+            'knockout',
+            'starred',
+            'finished',
+        )
+    )
+    # fields affecting users predicted brackets (see PredictedKnockoutMatch)
+    BRACKET_FIELDS = frozenset(
+        (
+            'home_id',
+            'away_id',
+            'home_placeholder',
+            'away_placeholder',
+            'tournament_id',
+            'knockout',
+        )
+    )
+    # changes tracked since the match was loaded (see changed_fields)
+    TRACKED_FIELDS = RESULT_FIELDS | BRACKET_FIELDS | {'suspended'}
+
     class Meta:
         ordering = ('when',)
 
@@ -377,6 +1261,56 @@ class Match(models.Model):
         away = self.away.name if self.away else self.away_placeholder
         return "%s vs %s" % (home, away)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._track_changes()
+        return instance
+
+    def _track_changes(self):
+        deferred = self.get_deferred_fields()
+        if any(
+            f.attname in deferred or f.name in deferred
+            for f in self._meta.concrete_fields
+            if f.attname in self.TRACKED_FIELDS
+        ):
+            self._loaded_values = None
+        else:
+            self._loaded_values = self._tracked_values()
+
+    def _tracked_values(self):
+        # as the DB would return them (e.g. goals assigned as strings)
+        values = {}
+        for name in self.TRACKED_FIELDS:
+            value = getattr(self, name)
+            try:
+                values[name] = self._meta.get_field(name).to_python(value)
+            except ValidationError:
+                values[name] = value
+        return values
+
+    def changed_fields(self):
+        """Return the tracked fields changed since the match was loaded.
+
+        All of them are considered changed if the match was not loaded from
+        the DB (or was loaded with some of them deferred).
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return set(self.TRACKED_FIELDS)
+        current = self._tracked_values()
+        return {
+            name for name, value in loaded.items() if current[name] != value
+        }
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._track_changes()
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._track_changes()
+
     @property
     def deadline(self):
         """Return deadline datetime or None if match date is not set."""
@@ -389,6 +1323,127 @@ class Match(models.Model):
     def is_expired(self):
         return self.deadline < now()
 
+    @property
+    def in_progress(self):
+        return (
+            not self.finished
+            and not self.suspended
+            and self.home_goals is not None
+            and self.away_goals is not None
+        )
+
+    def rescore(self, previous_teams=()):
+        """Recompute predictions scores and teams stats for this match.
+
+        Stats of previous_teams, (tournament id, team id) pairs the match
+        no longer involves, are recomputed as well.
+        """
+        update_related_predictions(Match, self, rescore=True)
+        update_related_stats(
+            Match, self, rescore=True, previous_teams=previous_teams
+        )
+
+    def score_changes(self):
+        """Return the number of predictions a rescore would change."""
+        predictions = self.prediction_set.all()
+        if not self.finished:
+            return predictions.exclude(score=0).count()
+        score = prediction_score_updates(self, defaults=True)['score']
+        return (
+            predictions.annotate(new_score=score)
+            .exclude(score=F('new_score'))
+            .count()
+        )
+
+    def bracket_tournaments(self, created=False):
+        """Return the tournaments whose predicted brackets a save changes."""
+        loaded = getattr(self, '_loaded_values', None)
+        if created or loaded is None:
+            return {self.tournament_id} if self.knockout else set()
+        if not self.changed_fields() & self.BRACKET_FIELDS:
+            return set()
+        tournaments = set()
+        if loaded['knockout']:
+            tournaments.add(loaded['tournament_id'])
+        if self.knockout:
+            tournaments.add(self.tournament_id)
+        return tournaments
+
+    def previous_teams(self):
+        """Return the (tournament id, team id) pairs replaced since loaded."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return set()
+        previous = {
+            (loaded['tournament_id'], loaded[name])
+            for name in ('home_id', 'away_id')
+            if loaded[name] is not None
+        }
+        current = {
+            (self.tournament_id, team_id)
+            for team_id in (self.home_id, self.away_id)
+            if team_id is not None
+        }
+        return previous - current
+
+    @staticmethod
+    def _team_results(values):
+        # stats a (tracked fields) match result adds up, by tournament/team
+        if (
+            not values['finished']
+            or values['knockout']
+            or values['home_goals'] is None
+            or values['away_goals'] is None
+        ):
+            return {}
+        home_goals = int(values['home_goals'])
+        away_goals = int(values['away_goals'])
+        results = {}
+        for team_id, gf, gc in (
+            (values['home_id'], home_goals, away_goals),
+            (values['away_id'], away_goals, home_goals),
+        ):
+            if team_id is None:
+                continue
+            stats = dict(
+                won=int(gf > gc), tie=int(gf == gc), lost=int(gf < gc)
+            )
+            stats.update(gf=gf, gc=gc, points=TeamStats._points(stats))
+            results[(values['tournament_id'], team_id)] = stats
+        return results
+
+    def team_stats_deltas(self, created=False):
+        """Return the team stats changes since the match was loaded.
+
+        Changes are keyed by (tournament id, team id) and include the match
+        teams even if unchanged; None if the previous result is unknown.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if created:
+            previous = {}
+        elif loaded is None:
+            return None
+        else:
+            previous = self._team_results(loaded)
+        current = self._team_results(
+            {name: getattr(self, name) for name in self.TRACKED_FIELDS}
+        )
+
+        deltas = {}
+        if self.home_id and self.away_id:
+            for team_id in (self.home_id, self.away_id):
+                deltas[(self.tournament_id, team_id)] = dict.fromkeys(
+                    TeamStats.STATS_FIELDS, 0
+                )
+        for sign, results in ((-1, previous), (1, current)):
+            for key, stats in results.items():
+                delta = deltas.setdefault(
+                    key, dict.fromkeys(TeamStats.STATS_FIELDS, 0)
+                )
+                for name, value in stats.items():
+                    delta[name] += sign * value
+        return deltas
+
 
 class Prediction(models.Model):
     """User prediction for a match."""
@@ -426,21 +1481,19 @@ class Prediction(models.Model):
 
     @property
     def home_team_stats(self):
-        if self.match.home is None:
+        if self.match.home_id is None:
             return None
-        stats, _ = self.match.home.teamstats_set.get_or_create(
-            tournament=self.match.tournament
-        )
-        return stats
+        return TeamStats.objects.filter(
+            team=self.match.home_id, tournament=self.match.tournament_id
+        ).first()
 
     @property
     def away_team_stats(self):
-        if self.match.away is None:
+        if self.match.away_id is None:
             return None
-        stats, _ = self.match.away.teamstats_set.get_or_create(
-            tournament=self.match.tournament
-        )
-        return stats
+        return TeamStats.objects.filter(
+            team=self.match.away_id, tournament=self.match.tournament_id
+        ).first()
 
     @property
     def penalties_home(self):
@@ -450,6 +1503,17 @@ class Prediction(models.Model):
     def penalties_away(self):
         return self.penalties == 'V'
 
+    @property
+    def winner(self):
+        """Return the predicted winner side (L or V), None if unknown."""
+        if self.home_goals is None or self.away_goals is None:
+            return None
+        if self.home_goals > self.away_goals:
+            return 'L'
+        if self.home_goals < self.away_goals:
+            return 'V'
+        return self.penalties or None
+
     def save(self, *args, **kwargs):
         # set trend value before saving
         if self.home_goals is not None and self.away_goals is not None:
@@ -496,6 +1560,183 @@ class ChampionPrediction(models.Model):
         super(ChampionPrediction, self).save(*args, **kwargs)
 
 
+class DefaultPrediction(models.Model):
+    """A user default prediction, synced from EgaUser.default_prediction.
+
+    Typed copy of the preferences value, so predictions scoring can look it
+    up by user instead of parsing JSON.
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE
+    )
+    home_goals = models.PositiveIntegerField(null=True, blank=True)
+    away_goals = models.PositiveIntegerField(null=True, blank=True)
+    penalties = models.CharField(max_length=1, blank=True)
+
+    def __str__(self):
+        return "%s: %s - %s" % (self.user, self.home_goals, self.away_goals)
+
+    @staticmethod
+    def from_preferences(preferences):
+        """Return (home_goals, away_goals, penalties) or None, if not set."""
+        default = preferences.get('default_prediction')
+        if default is None:
+            return None
+
+        def goals(value):
+            return None if value in (None, '') else int(value)
+
+        penalties = default.get('penalties')
+        return (
+            goals(default.get('home_goals')),
+            goals(default.get('away_goals')),
+            penalties if penalties in ('L', 'V') else '',
+        )
+
+    @classmethod
+    def sync(cls, user):
+        """Update (or remove) the user default prediction row."""
+        default = cls.from_preferences(user.preferences)
+        if default is None:
+            cls.objects.filter(user=user).delete()
+            return
+
+        home_goals, away_goals, penalties = default
+        cls.objects.update_or_create(
+            user=user,
+            defaults=dict(
+                home_goals=home_goals,
+                away_goals=away_goals,
+                penalties=penalties,
+            ),
+        )
+
+
+class Standing(models.Model):
+    """Accumulated user score in a tournament."""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE
+    )
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE)
+
+    # predictions count by score: winner (x1), exact (x3), and their
+    # starred versions (xx1, xx3)
+    x1 = models.IntegerField(default=0)
+    x3 = models.IntegerField(default=0)
+    xx1 = models.IntegerField(default=0)
+    xx3 = models.IntegerField(default=0)
+
+    champion = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('tournament', 'user'),)
+        indexes = [
+            models.Index(
+                fields=['tournament', '-total', '-x3', '-champion', 'user'],
+                name='ega_standing_ranking_idx',
+            )
+        ]
+
+    def __str__(self):
+        return "%s - %s" % (self.user, self.tournament)
+
+
+class PredictedStanding(models.Model):
+    """Team standing in its zone according to a user predictions."""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE
+    )
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE)
+    team = models.ForeignKey(Team, on_delete=models.CASCADE)
+
+    zone = models.CharField(default='', max_length=64, blank=True)
+    position = models.PositiveIntegerField()
+    points = models.PositiveIntegerField(default=0)
+    goal_difference = models.IntegerField(default=0)
+    goals = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('user', 'tournament', 'team'),)
+        indexes = [
+            models.Index(
+                fields=['user', 'tournament', 'zone', 'position'],
+                name='ega_predicted_standing_idx',
+            )
+        ]
+
+    def __str__(self):
+        return "%s - %s (%s%s)" % (
+            self.user,
+            self.team,
+            self.position,
+            self.zone,
+        )
+
+
+class PredictedKnockoutMatch(models.Model):
+    """Knockout match teams according to a user predictions."""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE
+    )
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE)
+    match = models.ForeignKey(Match, on_delete=models.CASCADE)
+
+    # unknown teams (e.g. groups not predicted yet) are left empty
+    home = models.ForeignKey(
+        Team, null=True, related_name='+', on_delete=models.CASCADE
+    )
+    away = models.ForeignKey(
+        Team, null=True, related_name='+', on_delete=models.CASCADE
+    )
+
+    class Meta:
+        unique_together = (('user', 'match'),)
+        indexes = [
+            models.Index(
+                fields=['user', 'tournament'],
+                name='ega_predicted_knockout_idx',
+            )
+        ]
+
+    def __str__(self):
+        return "%s - %s" % (self.user, self.match)
+
+    @property
+    def home_team(self):
+        """Return the predicted home team, or its placeholder if unknown."""
+        return self.home or self.match.home_placeholder
+
+    @property
+    def away_team(self):
+        """Return the predicted away team, or its placeholder if unknown."""
+        return self.away or self.match.away_placeholder
+
+
+class RoundStanding(models.Model):
+    """User standing in a tournament as of a round end."""
+
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE)
+    round = models.CharField(max_length=128)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE
+    )
+
+    position = models.PositiveIntegerField()
+    total = models.IntegerField(default=0)
+    exacts = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('tournament', 'round', 'user'),)
+
+    def __str__(self):
+        return "%s - %s (%s)" % (self.user, self.tournament, self.round)
+
+
 class TeamStats(models.Model):
     """Stats for a team in a given tournament."""
 
@@ -514,6 +1755,9 @@ class TeamStats(models.Model):
     points = models.PositiveIntegerField(default=0)
     tie_breaker = models.PositiveIntegerField(default=0)
 
+    # fields computed from the tournament matches
+    STATS_FIELDS = ('won', 'tie', 'lost', 'gf', 'gc', 'points')
+
     objects = TeamStatsManager()
 
     class Meta:
@@ -523,62 +1767,176 @@ class TeamStats(models.Model):
     def __str__(self):
         return "%s - %s" % (self.team, self.tournament)
 
-    def sync(self):
-        """Update team stats for tournament."""
-        home = Match.objects.filter(
-            tournament=self.tournament,
-            home=self.team,
-            knockout=False,
-            finished=True,
+    @staticmethod
+    def _points(stats):
+        return (
+            stats['won'] * MATCH_WON_POINTS
+            + stats['tie'] * MATCH_TIE_POINTS
+            + stats['lost'] * MATCH_LOST_POINTS
         )
-        away = Match.objects.filter(
-            tournament=self.tournament,
-            away=self.team,
+
+    def recompute(self):
+        """Return team stats computed from the tournament finished matches.
+
+        Computed in a single query, with conditional aggregates over both the
+        home and away matches of the team.
+        """
+        home = Q(home=self.team_id)
+        gf = Case(When(home, then=F('home_goals')), default=F('away_goals'))
+        gc = Case(When(home, then=F('away_goals')), default=F('home_goals'))
+        stats = Match.objects.filter(
+            home | Q(away=self.team_id),
+            tournament=self.tournament_id,
             knockout=False,
             finished=True,
+        ).aggregate(
+            won=Count('id', filter=GreaterThan(gf, gc)),
+            tie=Count('id', filter=Exact(gf, gc)),
+            lost=Count('id', filter=LessThan(gf, gc)),
+            gf=Coalesce(Sum(gf), 0),
+            gc=Coalesce(Sum(gc), 0),
         )
+        stats['points'] = self._points(stats)
+        return stats
 
-        self.won = (
-            home.filter(home_goals__gt=F('away_goals')).count()
-            + away.filter(away_goals__gt=F('home_goals')).count()
-        )
-        self.tie = (
-            home.filter(home_goals=F('away_goals')).count()
-            + away.filter(away_goals=F('home_goals')).count()
-        )
-        self.lost = (
-            home.filter(home_goals__lt=F('away_goals')).count()
-            + away.filter(away_goals__lt=F('home_goals')).count()
-        )
+    @classmethod
+    def recompute_all(cls, tournament):
+        """Return every team stats for the tournament, by team id.
 
-        # goals stats
-        home_goals = home.aggregate(
-            home_gf=Sum('home_goals'), home_gc=Sum('away_goals')
-        )
-        away_goals = away.aggregate(
-            away_gf=Sum('away_goals'), away_gc=Sum('home_goals')
-        )
-        self.gf = 0
-        if home_goals['home_gf'] is not None:
-            self.gf += home_goals['home_gf']
-        if away_goals['away_gf'] is not None:
-            self.gf += away_goals['away_gf']
+        Computed in a single query grouping home and away results by team.
+        """
+        cursor = connection.cursor()
+        cursor.execute(TEAM_STATS_SQL, [tournament.id, True, False] * 2)
+        stats = {}
+        for team_id, won, tie, lost, gf, gc in cursor.fetchall():
+            stats[team_id] = dict(won=won, tie=tie, lost=lost, gf=gf, gc=gc)
+            stats[team_id]['points'] = cls._points(stats[team_id])
+        return stats
 
-        self.gc = 0
-        if home_goals['home_gc'] is not None:
-            self.gc += home_goals['home_gc']
-        if away_goals['away_gc'] is not None:
-            self.gc += away_goals['away_gc']
+    @classmethod
+    def rebuild(cls, tournament):
+        """Recompute and store every team stats for the tournament."""
+        expected = cls.recompute_all(tournament)
+        empty = dict.fromkeys(cls.STATS_FIELDS, 0)
+        with transaction.atomic():
+            stored = cls.objects.filter(tournament=tournament)
+            missing = set(expected) - set(
+                stored.order_by().values_list('team_id', flat=True)
+            )
+            cls.objects.bulk_create(
+                [
+                    cls(team_id=team_id, tournament=tournament)
+                    for team_id in missing
+                ],
+                ignore_conflicts=True,
+            )
+            team_stats = list(stored)
+            for stats in team_stats:
+                for name, value in expected.get(stats.team_id, empty).items():
+                    setattr(stats, name, value)
+            cls.objects.bulk_update(team_stats, cls.STATS_FIELDS)
+        return team_stats
 
-        self.points = self._points()
+    def sync(self):
+        """Update team stats for tournament."""
+        for name, value in self.recompute().items():
+            setattr(self, name, value)
         self.save()
 
-    def _points(self):
-        return (
-            self.won * MATCH_WON_POINTS
-            + self.tie * MATCH_TIE_POINTS
-            + self.lost * MATCH_LOST_POINTS
-        )
+
+class FinalStanding(models.Model):
+    """User final standing and stats in a finished tournament."""
+
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE
+    )
+    position = models.PositiveIntegerField()
+
+    x1 = models.IntegerField(default=0)
+    x3 = models.IntegerField(default=0)
+    xx1 = models.IntegerField(default=0)
+    xx3 = models.IntegerField(default=0)
+    champion = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+
+    # predictions stats (see EgaUser.stats)
+    played = models.IntegerField(default=0)
+    score = models.IntegerField(default=0)
+    winners = models.IntegerField(default=0)
+    exacts = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('tournament', 'user'),)
+        indexes = [
+            models.Index(
+                fields=['tournament', 'position', 'user'],
+                name='ega_finalstanding_ranking_idx',
+            )
+        ]
+
+    def __str__(self):
+        return "%s - %s" % (self.user, self.tournament)
+
+
+class FinalTeamStats(models.Model):
+    """Team final stats in a finished tournament."""
+
+    team = models.ForeignKey(Team, on_delete=models.CASCADE)
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE)
+
+    zone = models.CharField(default='', max_length=64, blank=True)
+
+    played = models.PositiveIntegerField(default=0)
+    won = models.PositiveIntegerField(default=0)
+    tie = models.PositiveIntegerField(default=0)
+    lost = models.PositiveIntegerField(default=0)
+
+    gf = models.PositiveIntegerField(default=0)
+    gc = models.PositiveIntegerField(default=0)
+    dg = models.IntegerField(default=0)
+
+    points = models.PositiveIntegerField(default=0)
+    tie_breaker = models.PositiveIntegerField(default=0)
+
+    objects = TeamStatsManager()
+
+    class Meta:
+        unique_together = (('tournament', 'team'),)
+
+    def __str__(self):
+        return "%s - %s" % (self.team, self.tournament)
+
+
+class AllTimeStanding(models.Model):
+    """User accumulated results across all finished tournaments."""
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE
+    )
+    total = models.IntegerField(default=0)
+    exacts = models.IntegerField(default=0)
+    tournaments = models.IntegerField(default=0)
+    best_finish = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-total', '-exacts', 'user'],
+                name='ega_alltimestanding_rank_idx',
+            )
+        ]
+
+    def __str__(self):
+        return str(self.user)
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute all-time standings from tournaments final standings."""
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cursor = connection.cursor()
+            cursor.execute(ALL_TIME_STANDINGS_SQL)
 
 
 class League(models.Model):
@@ -606,10 +1964,7 @@ class League(models.Model):
         return LeagueMember.objects.get(league=self, is_owner=True).user
 
     def ranking(self, round=None):
-        ranking = self.tournament.ranking(round=round)
-        users = self.members.values_list('username', flat=True)
-        ranking = [r for r in ranking if r['username'] in users]
-        return ranking
+        return self.tournament.ranking(round=round, league=self)
 
     def save(self, *args, **kwargs):
         # generate slug
@@ -643,117 +1998,724 @@ class LeagueMember(models.Model):
         return str(self.user)
 
 
-@receiver(post_save, sender=Match, dispatch_uid="update-scores")
-def update_related_predictions(sender, instance, **kwargs):
-    """Update score for predictions related to the changed match."""
-    home_goals = instance.home_goals
-    away_goals = instance.away_goals
-    predictions = instance.prediction_set
+class ScoringJob(models.Model):
+    """A pending match scoring (predictions and team stats update).
 
-    if not instance.finished:
-        # update starred field for predictions (only while not played)
-        predictions.update(starred=instance.starred, score=0)
-        return
+    There is at most one job per match, so repeated saves of the same match
+    are coalesced until a worker runs it (see the run_worker command).
+    """
 
-    # reset predictions
-    predictions.update(score=0)
+    match = models.OneToOneField(Match, on_delete=models.CASCADE)
+    created = models.DateTimeField(default=now)
+    run_after = models.DateTimeField(default=now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # [tournament id, team id] pairs replaced by the queued saves, whose
+    # stats have to be recomputed too
+    previous_teams = models.JSONField(default=list, blank=True)
 
-    # update unpredicted predictions with default values, taken from the
-    # user's preferences (if any)
+    class Meta:
+        ordering = ('run_after', 'id')
 
-    def default_prediction_goals(side):
-        return (
-            EgaUser.objects.filter(pk=OuterRef('user_id'))
-            .annotate(
-                goals=Cast(
-                    'preferences__default_prediction__%s_goals' % side,
-                    models.PositiveIntegerField(),
+    def __str__(self):
+        return str(self.match)
+
+    @classmethod
+    def enqueue(cls, match):
+        """Queue (or requeue, resetting its retries) the match scoring."""
+        with transaction.atomic():
+            job, created = cls.objects.select_for_update().get_or_create(
+                match=match
+            )
+            previous_teams = {tuple(pair) for pair in job.previous_teams}
+            previous_teams |= match.previous_teams()
+            job.previous_teams = sorted(previous_teams)
+            job.run_after = now()
+            job.attempts = 0
+            job.last_error = ''
+            job.save()
+        return job
+
+    @classmethod
+    def pending(cls):
+        """Jobs ready to run (not failed too many times)."""
+        return cls.objects.filter(
+            run_after__lte=now(), attempts__lt=SCORING_JOB_MAX_ATTEMPTS
+        )
+
+    @property
+    def failed(self):
+        return self.attempts >= SCORING_JOB_MAX_ATTEMPTS
+
+    def run(self):
+        """Score the job match and remove the job; return whether it ran.
+
+        Jobs locked by another worker are skipped. On error the job is kept
+        (with its error) and retried later, up to SCORING_JOB_MAX_ATTEMPTS.
+        """
+        try:
+            with transaction.atomic():
+                job = (
+                    ScoringJob.objects.select_for_update(skip_locked=True)
+                    .filter(pk=self.pk)
+                    .select_related('match')
+                    .first()
+                )
+                if job is None:
+                    return False
+                job.match.rescore(
+                    previous_teams=[tuple(pair) for pair in job.previous_teams]
                 )
+                job.delete()
+        except Exception as e:
+            attempts = self.attempts + 1
+            ScoringJob.objects.filter(pk=self.pk).update(
+                attempts=attempts,
+                last_error=repr(e),
+                run_after=now()
+                + timedelta(seconds=SCORING_JOB_RETRY_DELAY * attempts),
             )
-            .values('goals')[:1]
+            raise
+        return True
+
+
+class RescoreCheckpoint(models.Model):
+    """Progress of a tournament rescore, to resume it if interrupted.
+
+    See the rescore_tournament command; saved along with every batch of
+    rescored matches, and removed once the rescore is done.
+    """
+
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE)
+    round = models.CharField(max_length=128, blank=True)
+    # id of the last rescored match (matches are rescored by id)
+    last_match = models.PositiveIntegerField()
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (('tournament', 'round'),)
+
+    def __str__(self):
+        return "%s %s: %s" % (self.tournament, self.round, self.last_match)
+
+
+class ScoreChange(models.Model):
+    """A prediction score change (append-only ledger).
+
+    Every scoring run records the predictions whose score changed, under
+    the same run id; standings are updated from these deltas.
+    """
+
+    run = models.UUIDField(db_index=True)
+    created = models.DateTimeField(default=now, db_index=True)
+    prediction = models.ForeignKey(Prediction, on_delete=models.CASCADE)
+    match = models.ForeignKey(Match, on_delete=models.CASCADE)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE
+    )
+    old_score = models.PositiveSmallIntegerField()
+    new_score = models.PositiveSmallIntegerField()
+
+    def __str__(self):
+        return "%s: %s -> %s" % (
+            self.prediction,
+            self.old_score,
+            self.new_score,
         )
 
-    def default_prediction_penalties():
-        return (
-            EgaUser.objects.filter(pk=OuterRef('user_id'))
-            .annotate(
-                penalties=Case(
-                    When(
-                        preferences__default_prediction__penalties='L',
-                        then=Value('L'),
-                    ),
-                    When(
-                        preferences__default_prediction__penalties='V',
-                        then=Value('V'),
-                    ),
-                    When(
-                        preferences__default_prediction__penalties='',
-                        then=Value(''),
-                    ),
-                    default=Value(''),
+    @classmethod
+    def record(cls, predictions, score, run):
+        """Append the changes the score expression makes to the predictions.
+
+        Changes are computed and inserted by the DB (INSERT ... SELECT),
+        before predictions are updated.
+        """
+        changes = (
+            predictions.annotate(new_score=score)
+            .exclude(score=F('new_score'))
+            .order_by()
+            .values('id', 'match_id', 'user_id', 'score', 'new_score')
+        )
+        sql, params = changes.query.sql_with_params()
+        run_value = cls._meta.get_field('run').get_db_prep_value(
+            run, connection
+        )
+        created = cls._meta.get_field('created').get_db_prep_value(
+            now(), connection
+        )
+        cursor = connection.cursor()
+        cursor.execute(
+            'INSERT INTO ega_scorechange '
+            '(prediction_id, match_id, user_id, old_score, new_score, '
+            'run, created) '
+            'SELECT changes.*, %s, %s FROM (' + sql + ') changes',
+            (run_value, created) + tuple(params),
+        )
+
+
+def create_missing_standings(tournament, predictions):
+    """Make sure every user with one of the predictions has a standing."""
+    missing = (
+        predictions.exclude(user__standing__tournament=tournament.id)
+        .order_by()
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
+    champions = dict(
+        ChampionPrediction.objects.filter(
+            tournament=tournament.id, user__in=missing
+        ).values_list('user_id', 'score')
+    )
+    Standing.objects.bulk_create(
+        [
+            Standing(
+                user_id=user_id,
+                tournament_id=tournament.id,
+                champion=champions.get(user_id, 0),
+                total=champions.get(user_id, 0),
+            )
+            for user_id in missing
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def apply_score_changes(tournament, run):
+    """Update users standings with the score changes of a scoring run."""
+    changes = ScoreChange.objects.filter(run=run)
+    user_changes = changes.filter(user=OuterRef('user')).values('user')
+    x1, x3, xx1, xx3 = tournament.score_categories
+
+    def delta(expression):
+        return Subquery(
+            user_changes.annotate(delta=Sum(expression)).values('delta')
+        )
+
+    def count_delta(score):
+        return delta(
+            Case(When(new_score=score, then=1), default=0)
+            - Case(When(old_score=score, then=1), default=0)
+        )
+
+    Standing.objects.filter(
+        tournament=tournament.id, user__in=changes.values('user')
+    ).update(
+        x1=F('x1') + count_delta(x1),
+        x3=F('x3') + count_delta(x3),
+        xx1=F('xx1') + count_delta(xx1),
+        xx3=F('xx3') + count_delta(xx3),
+        total=F('total') + delta(F('new_score') - F('old_score')),
+    )
+
+
+def update_standings(match, sign=1):
+    """Add (or remove, if sign is -1) match scores to users standings."""
+    predictions = Prediction.objects.filter(match=match)
+    if sign > 0:
+        create_missing_standings(match.tournament, predictions)
+
+    user_prediction = predictions.filter(user=OuterRef('user'))
+    x1, x3, xx1, xx3 = match.tournament.score_categories
+
+    def score_count(score):
+        return sign * Subquery(
+            user_prediction.annotate(
+                count=Case(
+                    When(score=score, then=1),
+                    default=0,
+                    output_field=models.IntegerField(),
                 )
+            ).values('count')[:1]
+        )
+
+    Standing.objects.filter(
+        tournament=match.tournament_id,
+        user__in=predictions.exclude(score=0).values('user'),
+    ).update(
+        x1=F('x1') + score_count(x1),
+        x3=F('x3') + score_count(x3),
+        xx1=F('xx1') + score_count(xx1),
+        xx3=F('xx3') + score_count(xx3),
+        total=F('total')
+        + sign * Subquery(user_prediction.values('score')[:1]),
+    )
+
+
+def update_all_time_standings(tournament, sign=1):
+    """Add (or remove, if sign is -1) tournament final standings."""
+    final = FinalStanding.objects.filter(tournament=tournament)
+    if sign > 0:
+        missing = final.exclude(user__alltimestanding__isnull=False)
+        AllTimeStanding.objects.bulk_create(
+            [
+                AllTimeStanding(user_id=user_id)
+                for user_id in missing.values_list('user_id', flat=True)
+            ],
+            ignore_conflicts=True,
+        )
+
+    user_final = final.filter(user=OuterRef('user'))
+    total = user_final.values('total')[:1]
+    exacts = user_final.annotate(all_exacts=F('x3') + F('xx3'))
+    exacts = exacts.values('all_exacts')[:1]
+    best_finish = FinalStanding.objects.filter(user=OuterRef('user'))
+    if sign < 0:
+        best_finish = best_finish.exclude(tournament=tournament)
+    best_finish = best_finish.order_by('position').values('position')[:1]
+
+    AllTimeStanding.objects.filter(user__in=final.values('user')).update(
+        total=F('total') + sign * Subquery(total),
+        exacts=F('exacts') + sign * Subquery(exacts),
+        tournaments=F('tournaments') + sign,
+        best_finish=Subquery(best_finish),
+    )
+
+
+def prediction_score_updates(match, defaults=False):
+    """Return the update kwargs scoring the predictions for a finished match.
+
+    Predictions are scored as stored, so unpredicted results should be
+    filled first (see fill_default_predictions). If defaults is set, the
+    user's default prediction (joined) is used for unpredicted results
+    instead, for queries not updating predictions.
+
+    The tournament scoring rules are compiled into the score expression, so
+    custom rules are as cheap as the default ones.
+    """
+    home_goals, away_goals, penalties = (
+        F(name) for name in ('home_goals', 'away_goals', 'penalties')
+    )
+    if defaults:
+        use_default = Q(
+            home_goals__isnull=True,
+            away_goals__isnull=True,
+            user__defaultprediction__isnull=False,
+        )
+        home_goals, away_goals, penalties = (
+            Case(
+                When(use_default, then=F('user__defaultprediction__' + name)),
+                default=F(name),
             )
-            .values('penalties')[:1]
+            for name in ('home_goals', 'away_goals', 'penalties')
         )
 
-    predictions.filter(
+    exact = Q(
+        Exact(home_goals, match.home_goals),
+        Exact(away_goals, match.away_goals),
+    )
+    if match.home_goals > match.away_goals:
+        winner = GreaterThan(home_goals, away_goals)
+    elif match.home_goals < match.away_goals:
+        winner = LessThan(home_goals, away_goals)
+    else:
+        winner = Exact(home_goals, away_goals)
+
+    rules = match.tournament
+    multiplier = rules.knockout_multiplier if match.knockout else 1
+    points = [
+        (exact, rules.exact_points * multiplier),
+        (winner, rules.winner_points * multiplier),
+    ]
+    if rules.goal_difference_points:
+        goal_difference = Q(
+            winner,
+            Exact(
+                home_goals - away_goals, match.home_goals - match.away_goals
+            ),
+        )
+        points.insert(
+            1,
+            (
+                goal_difference,
+                (rules.winner_points + rules.goal_difference_points)
+                * multiplier,
+            ),
+        )
+
+    # scoring predictions get the starred and penalties bonus points
+    bonus = Case(
+        When(starred=True, then=Value(rules.starred_points)),
+        default=Value(0),
+    )
+    if match.pk_home_goals is not None and match.pk_away_goals is not None:
+        side = 'L' if match.pk_home_goals > match.pk_away_goals else 'V'
+        bonus += Case(
+            When(
+                Q(Exact(home_goals, away_goals), Exact(penalties, side)),
+                then=Value(rules.penalties_points),
+            ),
+            default=Value(0),
+        )
+
+    score = Case(
+        *[When(condition, then=Value(p) + bonus) for condition, p in points],
+        default=Value(0),
+    )
+    return dict(score=score)
+
+
+def fill_default_predictions(predictions):
+    """Fill unpredicted results with the user's default prediction (if any).
+
+    Done in a single UPDATE restricted to the unpredicted rows of users
+    having a default, so scoring then reads plain columns.
+    """
+    default_prediction = DefaultPrediction.objects.filter(
+        user=OuterRef('user_id')
+    )
+    return predictions.filter(
         home_goals__isnull=True,
         away_goals__isnull=True,
-        user__preferences__default_prediction__isnull=False,
+        user__in=DefaultPrediction.objects.values('user'),
     ).update(
         source='preferences',
-        home_goals=Subquery(default_prediction_goals('home')),
-        away_goals=Subquery(default_prediction_goals('away')),
-        penalties=Subquery(default_prediction_penalties()),
+        **{
+            name: Subquery(default_prediction.values(name)[:1])
+            for name in ('home_goals', 'away_goals', 'penalties')
+        },
     )
 
-    # update exact predictions
-    predictions.filter(home_goals=home_goals, away_goals=away_goals).update(
-        score=EXACTLY_MATCH_POINTS
+
+def score_matches(matches):
+    """Score the predictions for the given matches (of the same tournament).
+
+    Unpredicted results of finished matches are filled with the user's
+    default prediction (if any), then every prediction is scored in a
+    single UPDATE, and standings, round standings and rankings are updated
+    once for all the matches.
+    """
+    tournament = matches[0].tournament
+    whens = {}
+    for match in matches:
+        if match.finished:
+            updates = prediction_score_updates(match)
+        else:
+            # update starred field for predictions (only while not played)
+            updates = dict(starred=Value(match.starred), score=Value(0))
+        for name, expression in updates.items():
+            whens.setdefault(name, []).append(
+                When(match=match.id, then=expression)
+            )
+    updates = {
+        name: Case(
+            *match_whens,
+            default=F(name),
+            output_field=Prediction._meta.get_field(name),
+        )
+        for name, match_whens in whens.items()
+    }
+
+    # record score changes, then apply them to standings
+    predictions = Prediction.objects.filter(match__in=matches)
+    fill_default_predictions(
+        predictions.filter(
+            match__in=[match.id for match in matches if match.finished]
+        )
     )
+    run = uuid.uuid4()
+    ScoreChange.record(predictions, updates['score'], run)
+    predictions.update(**updates)
+    create_missing_standings(tournament, predictions)
+    apply_score_changes(tournament, run)
+
+    for round in sorted({match.round for match in matches}):
+        tournament.update_round_standings(round)
+    invalidate_rankings(tournament.id)
+
+
+def update_team_stats(deltas):
+    """Apply team stats changes (see Match.team_stats_deltas) in the DB.
+
+    Stats missing (or out of sync, so they would go negative) are
+    recomputed from scratch instead.
+    """
+    for (tournament_id, team_id), delta in sorted(deltas.items()):
+        team_stats = TeamStats.objects.filter(
+            tournament=tournament_id, team=team_id
+        )
+        changes = {
+            name: F(name) + value for name, value in delta.items() if value
+        }
+        try:
+            with transaction.atomic():
+                if changes:
+                    updated = team_stats.update(**changes)
+                else:
+                    updated = team_stats.exists()
+        except IntegrityError:
+            updated = False
+        if not updated:
+            stats, created = TeamStats.objects.get_or_create(
+                team_id=team_id, tournament_id=tournament_id
+            )
+            stats.sync()
 
-    # update winner predictions
-    if home_goals > away_goals:
-        predictions.exclude(
-            home_goals=home_goals, away_goals=away_goals
-        ).filter(home_goals__gt=F('away_goals')).update(
-            score=WINNER_MATCH_POINTS
+
+def update_match_results(matches):
+    """Save the results of many matches, scoring them in a single pass.
+
+    Matches are saved with a single UPDATE (so no post_save signal is sent)
+    and scored once per tournament; team stats are updated once for each
+    affected team. Return the matches whose result changed.
+    """
+    changed = [
+        match
+        for match in matches
+        if match.changed_fields() & Match.RESULT_FIELDS
+    ]
+    if not changed:
+        return []
+
+    fields = [
+        f.name
+        for f in Match._meta.concrete_fields
+        if f.attname in Match.RESULT_FIELDS
+    ]
+    deltas = {}
+    resync = []
+    with transaction.atomic():
+        Match.objects.bulk_update(changed, fields)
+        by_tournament = {}
+        for match in changed:
+            by_tournament.setdefault(match.tournament_id, []).append(match)
+            match_deltas = match.team_stats_deltas()
+            if match_deltas is None:
+                # previous result unknown, recompute its teams from scratch
+                resync.append(match)
+                continue
+            for key, delta in match_deltas.items():
+                team_delta = deltas.setdefault(
+                    key, dict.fromkeys(TeamStats.STATS_FIELDS, 0)
+                )
+                for name, value in delta.items():
+                    team_delta[name] += value
+        for tournament_matches in by_tournament.values():
+            score_matches(tournament_matches)
+        update_team_stats(deltas)
+        for match in resync:
+            sync_team_stats(match)
+        rebuild_predicted_brackets(
+            set().union(*(match.bracket_tournaments() for match in changed))
         )
-    elif home_goals < away_goals:
-        predictions.exclude(
-            home_goals=home_goals, away_goals=away_goals
-        ).filter(home_goals__lt=F('away_goals')).update(
-            score=WINNER_MATCH_POINTS
+
+    for match in changed:
+        match._track_changes()
+    return changed
+
+
+def rebuild_predicted_brackets(tournament_ids):
+    """Recompute the users predicted brackets for the given tournaments.
+
+    Users without predictions in a tournament get no bracket (views.home
+    shows the knockout matches as they are).
+    """
+    for tournament in Tournament.objects.filter(id__in=tournament_ids):
+        with transaction.atomic():
+            PredictedKnockoutMatch.objects.filter(
+                tournament=tournament
+            ).delete()
+            users = EgaUser.objects.filter(
+                prediction__match__tournament=tournament
+            ).distinct()
+            for user in users:
+                user.update_predicted_bracket(tournament)
+
+
+def match_result_changed(instance, created=False, rescore=False, **kwargs):
+    """Whether a match save may change predictions scores or team stats."""
+    return (
+        created
+        or rescore
+        or bool(instance.changed_fields() & Match.RESULT_FIELDS)
+    )
+
+
+@receiver(post_save, sender=Match, dispatch_uid="update-scores")
+@transaction.atomic
+def update_related_predictions(sender, instance, **kwargs):
+    """Update score for predictions related to the changed match."""
+    if not match_result_changed(instance, **kwargs):
+        if 'suspended' in instance.changed_fields():
+            # the match round may be closed (or reopened) now
+            instance.tournament.update_round_standings(instance.round)
+        return
+
+    loaded = getattr(instance, '_loaded_values', None)
+    if (
+        loaded is not None
+        and loaded['tournament_id'] != instance.tournament_id
+    ):
+        # the match (already scored) predictions moved to another tournament
+        for tournament in Tournament.objects.filter(
+            id__in=(loaded['tournament_id'], instance.tournament_id)
+        ):
+            tournament.rebuild_standings()
+
+    if getattr(instance, 'defer_scoring', False):
+        instance.scoring_job = ScoringJob.enqueue(instance)
+        return
+
+    score_matches([instance])
+
+
+@receiver(post_save, sender=Match, dispatch_uid="update-brackets")
+def update_predicted_brackets(sender, instance, created=False, **kwargs):
+    """Rebuild predicted brackets once knockout matches change."""
+    rebuild_predicted_brackets(instance.bracket_tournaments(created))
+
+
+@receiver(post_delete, sender=Match, dispatch_uid="delete-brackets")
+def delete_predicted_brackets(sender, instance, **kwargs):
+    """Rebuild predicted brackets once a knockout match is removed."""
+    if instance.knockout:
+        rebuild_predicted_brackets({instance.tournament_id})
+
+
+@receiver(post_delete, sender=Match, dispatch_uid="delete-stats")
+def delete_related_stats(sender, instance, **kwargs):
+    """Remove a deleted match result from its teams stats."""
+    if instance.finished and not instance.knockout:
+        # stats of a deleted tournament are already gone
+        for stats in TeamStats.objects.filter(
+            tournament=instance.tournament_id,
+            team__in=(instance.home_id, instance.away_id),
+        ):
+            stats.sync()
+
+
+@receiver(pre_delete, sender=Prediction, dispatch_uid="delete-prediction")
+def remove_prediction_score(sender, instance, **kwargs):
+    """Remove a deleted prediction score from its user standing.
+
+    Also sent for the predictions of deleted matches (and tournaments).
+    """
+    if not instance.score:
+        return
+    tournament = instance.match.tournament
+    counters = {
+        name: F(name) - 1
+        for name, score in zip(
+            ('x1', 'x3', 'xx1', 'xx3'), tournament.score_categories
         )
+        if score == instance.score
+    }
+    Standing.objects.filter(
+        user=instance.user_id, tournament=tournament
+    ).update(total=F('total') - instance.score, **counters)
+    invalidate_rankings(tournament.id)
+
+
+@receiver(post_save, sender=EgaUser, dispatch_uid="sync-default-prediction")
+def update_default_prediction(sender, instance, update_fields=None, **kwargs):
+    """Keep the user default prediction row in sync with its preferences."""
+    if update_fields is not None and 'preferences' not in update_fields:
+        return
+    DefaultPrediction.sync(instance)
+
+
+@receiver(post_save, sender=EgaUser, dispatch_uid="update-user-rankings")
+def update_user_rankings(sender, instance, created=False, **kwargs):
+    """Discard cached rankings showing the user old username or avatar."""
+    if not created and instance.ranking_values_changed():
+        instance.invalidate_rankings()
+    instance._track_ranking_values()
+
+
+@receiver(pre_delete, sender=EgaUser, dispatch_uid="delete-user-rankings")
+def delete_user_rankings(sender, instance, **kwargs):
+    """Discard cached rankings including a deleted user."""
+    # before the user standings are deleted along with it
+    instance.invalidate_rankings()
+
+
+@receiver(post_save, sender=Tournament, dispatch_uid="archive-tournament")
+def archive_finished_tournament(sender, instance, **kwargs):
+    """Freeze final standings once the tournament is finished."""
+    if instance.finished and instance.archived is None:
+        instance.archive()
+    elif not instance.finished and instance.archived is not None:
+        instance.unarchive()
+
+
+@receiver(
+    m2m_changed, sender=Tournament.teams.through, dispatch_uid="team-stats"
+)
+def create_team_stats(sender, instance, action, reverse, pk_set, **kwargs):
+    """Create the stats for teams added to a tournament."""
+    if action != 'post_add':
+        return
+    if reverse:
+        # teams added from the team side (instance is a team)
+        pairs = [(tournament_id, instance.id) for tournament_id in pk_set]
     else:
-        predictions.exclude(
-            home_goals=home_goals, away_goals=away_goals
-        ).filter(home_goals=F('away_goals'), home_goals__isnull=False).update(
-            score=WINNER_MATCH_POINTS
-        )
+        pairs = [(instance.id, team_id) for team_id in pk_set]
+    TeamStats.objects.bulk_create(
+        [
+            TeamStats(tournament_id=tournament_id, team_id=team_id)
+            for tournament_id, team_id in pairs
+        ],
+        ignore_conflicts=True,
+    )
 
-    # update starred predictions
-    predictions.filter(score__gt=0, starred=True).update(score=F('score') + 1)
 
-    # update penalties predictions
-    penalties = (
-        instance.pk_home_goals is not None
-        and instance.pk_away_goals is not None
+@receiver(post_save, sender=ChampionPrediction, dispatch_uid="update-champion")
+def update_related_standing(sender, instance, **kwargs):
+    """Update user standing with the champion prediction score."""
+    Standing.objects.filter(
+        user=instance.user_id, tournament=instance.tournament_id
+    ).update(
+        total=F('total') - F('champion') + instance.score,
+        champion=instance.score,
     )
-    if penalties:
-        ties = predictions.filter(score__gt=0, home_goals=F('away_goals'))
-        if instance.pk_home_goals > instance.pk_away_goals:
-            ties.filter(penalties='L').update(score=F('score') + 1)
-        else:
-            ties.filter(penalties='V').update(score=F('score') + 1)
+    invalidate_rankings(instance.tournament_id)
+
+
+@receiver(post_save, sender=LeagueMember, dispatch_uid="join-league")
+@receiver(post_delete, sender=LeagueMember, dispatch_uid="leave-league")
+def update_league_ranking(sender, instance, **kwargs):
+    """Discard cached rankings once league members change."""
+    invalidate_rankings(instance.league.tournament_id)
 
 
 @receiver(post_save, sender=Match, dispatch_uid="update-stats")
 def update_related_stats(sender, instance, **kwargs):
     """Update team stats related to the changed match."""
-    if instance.home and instance.away:
-        for team in (instance.home, instance.away):
+    if not match_result_changed(instance, **kwargs):
+        return
+
+    if getattr(instance, 'defer_scoring', False):
+        # updated by the scoring job, see update_related_predictions
+        return
+
+    deltas = None
+    if not kwargs.get('rescore'):
+        deltas = instance.team_stats_deltas(
+            created=kwargs.get('created', False)
+        )
+    if deltas is None:
+        # previous result unknown (or rescoring), recompute from scratch
+        sync_team_stats(instance, kwargs.get('previous_teams', ()))
+    else:
+        update_team_stats(deltas)
+
+
+def sync_team_stats(match, previous_teams=()):
+    """Recompute the match teams stats from scratch.
+
+    Stats of the teams the match involved when loaded (and those in
+    previous_teams, as (tournament id, team id) pairs) are recomputed too.
+    """
+    synced = set()
+    if match.home and match.away:
+        for team in (match.home, match.away):
             stats, created = TeamStats.objects.get_or_create(
-                team=team, tournament=instance.tournament
+                team=team, tournament=match.tournament
             )
             stats.sync()
+            synced.add((match.tournament_id, team.id))
+    previous_teams = set(previous_teams) | match.previous_teams()
+    for tournament_id, team_id in sorted(previous_teams - synced):
+        for stats in TeamStats.objects.filter(
+            tournament=tournament_id, team=team_id
+        ):
+            stats.sync()
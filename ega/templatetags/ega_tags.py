@@ -45,13 +45,6 @@ def get_friends_leagues(user, slug):
     return user.league_set.filter(tournament__slug=slug)
 
 
-@register.simple_tag
-def get_latest_matches(team, tournament):
-    if team is None:
-        return None
-    return team.latest_matches(tournament)
-
-
 @register.simple_tag
 def get_user_stats(user, tournament):
     return user.stats(tournament)
@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from django.test import TestCase as BaseTestCase
 from django.utils.crypto import get_random_string
 from django.utils.text import slugify
@@ -38,3 +39,8 @@ class Factory(object):
 
 class TestCase(BaseTestCase):
     factory = Factory()
+
+    def setUp(self):
+        super().setUp()
+        # cached rankings are keyed by tournament id, which may be reused
+        cache.clear()
@@ -0,0 +1,319 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TransactionTestCase
+
+from ega.models import (
+    Match,
+    Prediction,
+    RescoreCheckpoint,
+    Standing,
+    TeamStats,
+    score_matches,
+)
+from ega.tests.helpers import Factory, TestCase
+
+
+class RescoreTournamentTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.matches = []
+        for i in range(3):
+            match = self.factory.make_match(tournament=self.tournament)
+            self.factory.make_prediction(
+                match=match, home_goals=1, away_goals=0
+            )
+            match.home_goals = 1
+            match.away_goals = 0
+            match.finished = True
+            match.save()
+            self.matches.append(match)
+        # scores gone wrong (e.g. after a scoring rules change)
+        Prediction.objects.update(score=0)
+
+    def call(self, **options):
+        out = StringIO()
+        call_command(
+            'rescore_tournament',
+            self.tournament.slug,
+            stdout=out,
+            stderr=StringIO(),
+            **options
+        )
+        return out.getvalue()
+
+    def scores(self):
+        return list(
+            Prediction.objects.order_by('match_id').values_list(
+                'score', flat=True
+            )
+        )
+
+    def test_dry_run(self):
+        with mock.patch.object(Match, 'rescore') as rescore:
+            output = self.call(dry_run=True)
+        rescore.assert_not_called()
+        self.assertIn('3 matches, 3 scores would change', output)
+        self.assertEqual(self.scores(), [0, 0, 0])
+        self.assertFalse(RescoreCheckpoint.objects.exists())
+
+    def test_rescore(self):
+        with mock.patch.object(Match, 'score_changes') as score_changes:
+            output = self.call()
+        score_changes.assert_not_called()
+        self.assertIn('3 matches rescored', output)
+        self.assertEqual(self.scores(), [3, 3, 3])
+        self.assertFalse(RescoreCheckpoint.objects.exists())
+
+    def test_resume(self):
+        interrupted = self.matches[1]
+        rescore = Match.rescore
+
+        def interrupt(match, **kwargs):
+            if match.id == interrupted.id:
+                raise KeyboardInterrupt
+            rescore(match, **kwargs)
+
+        with mock.patch.object(
+            Match, 'rescore', autospec=True, side_effect=interrupt
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                self.call(batch_size=1)
+        checkpoint = RescoreCheckpoint.objects.get()
+        self.assertEqual(checkpoint.last_match, self.matches[0].id)
+        self.assertEqual(self.scores(), [3, 0, 0])
+
+        with mock.patch.object(
+            Match, 'rescore', autospec=True, side_effect=rescore
+        ) as resumed:
+            output = self.call(resume=True)
+        self.assertEqual(
+            [c.args[0].id for c in resumed.call_args_list],
+            [m.id for m in self.matches[1:]],
+        )
+        self.assertIn('2 matches rescored', output)
+        self.assertEqual(self.scores(), [3, 3, 3])
+        self.assertFalse(RescoreCheckpoint.objects.exists())
+
+    def test_resume_nothing(self):
+        with self.assertRaisesMessage(
+            CommandError, 'No interrupted rescore to resume'
+        ):
+            self.call(resume=True)
+
+
+class VerifyScoresTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.match = self.factory.make_match(tournament=self.tournament)
+        self.prediction = self.factory.make_prediction(
+            match=self.match, home_goals=1, away_goals=0
+        )
+        self.match.home_goals = 1
+        self.match.away_goals = 0
+        self.match.finished = True
+        self.match.save()
+
+    def call(self, *args, **options):
+        out = StringIO()
+        call_command(
+            'verify_scores',
+            self.tournament.slug,
+            *args,
+            processes=1,
+            stdout=out,
+            **options
+        )
+        return out.getvalue()
+
+    def test_consistent(self):
+        output = self.call()
+        self.assertIn(
+            '0 matches with 0 wrong scores, 0 wrong team stats', output
+        )
+        self.assertIn('Done.', output)
+
+    def test_wrong_score_detected(self):
+        Prediction.objects.filter(pk=self.prediction.pk).update(score=0)
+        out = StringIO()
+        # the user standing no longer matches the scores either
+        with self.assertRaisesMessage(
+            CommandError, 'Found 2 mismatches (use --repair to fix them)'
+        ):
+            call_command(
+                'verify_scores', self.tournament.slug, processes=1, stdout=out
+            )
+        self.assertIn('1 matches with 1 wrong scores', out.getvalue())
+        self.prediction.refresh_from_db()
+        self.assertEqual(self.prediction.score, 0)
+
+    def test_wrong_stats_and_standings_detected(self):
+        TeamStats.objects.filter(team=self.match.home).update(won=0)
+        Standing.objects.filter(tournament=self.tournament).update(total=7)
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, 'Found 2 mismatches'):
+            call_command(
+                'verify_scores', processes=1, stdout=out, chunk_size=1
+            )
+        self.assertIn('1 wrong team stats', out.getvalue())
+        self.assertIn('1 wrong standings', out.getvalue())
+
+    def test_repair(self):
+        Prediction.objects.filter(pk=self.prediction.pk).update(score=0)
+        TeamStats.objects.filter(team=self.match.home).update(won=0)
+        output = self.call(repair=True)
+        self.assertIn('Rescored: %s' % self.match, output)
+        self.assertIn('Rebuilt team stats: %s' % self.tournament, output)
+
+        self.prediction.refresh_from_db()
+        self.assertEqual(self.prediction.score, 3)
+        self.assertEqual(TeamStats.objects.get(team=self.match.home).won, 1)
+        self.assertEqual(
+            Standing.objects.get(tournament=self.tournament).total, 3
+        )
+        # nothing left to repair
+        self.assertIn('0 matches with 0 wrong scores', self.call())
+
+    def test_unknown_tournament(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown tournament: xyz'):
+            call_command('verify_scores', 'xyz', processes=1)
+
+
+class VerifyScoresProcessesTestCase(TransactionTestCase):
+    factory = Factory()
+
+    def test_worker_processes(self):
+        tournament = self.factory.make_tournament()
+        for i in range(3):
+            match = self.factory.make_match(tournament=tournament)
+            self.factory.make_prediction(
+                match=match, home_goals=1, away_goals=0
+            )
+            match.home_goals = 1
+            match.away_goals = 0
+            match.finished = True
+            match.save()
+        Prediction.objects.filter(match=match).update(score=0)
+
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, 'Found 2 mismatches'):
+            call_command(
+                'verify_scores',
+                tournament.slug,
+                processes=2,
+                chunk_size=1,
+                stdout=out,
+            )
+        self.assertIn('1 matches with 1 wrong scores', out.getvalue())
+
+
+class EnterResultsTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.user = self.factory.make_user()
+        self.matches = []
+        for home_goals, away_goals in ((1, 0), (2, 2)):
+            match = self.factory.make_match(tournament=self.tournament)
+            self.factory.make_prediction(
+                match=match,
+                user=self.user,
+                home_goals=home_goals,
+                away_goals=away_goals,
+            )
+            self.matches.append(match)
+
+    def call(self, csv, **options):
+        out = StringIO()
+        with mock.patch('sys.stdin', StringIO(csv)):
+            call_command('enter_results', '-', stdout=out, **options)
+        return out.getvalue()
+
+    def test_single_scoring_pass(self):
+        a, b = self.matches
+        csv = 'match,home_goals,away_goals\n%d,1,0\n%d,0,1\n' % (a.id, b.id)
+        with mock.patch(
+            'ega.models.score_matches', wraps=score_matches
+        ) as scoring:
+            output = self.call(csv)
+        scoring.assert_called_once()
+        self.assertIn('2 of 2 match results changed', output)
+
+        self.assertEqual(
+            list(
+                Prediction.objects.order_by('match_id').values_list(
+                    'score', flat=True
+                )
+            ),
+            [3, 0],
+        )
+        standing = Standing.objects.get(user=self.user)
+        self.assertEqual((standing.total, standing.x3), (3, 1))
+        self.assertEqual(TeamStats.objects.get(team=b.away).points, 3)
+        for match in Match.objects.filter(id__in=(a.id, b.id)):
+            self.assertTrue(match.finished)
+
+    def test_unfinished_and_unchanged(self):
+        a, b = self.matches
+        csv = 'match,home_goals,away_goals\n%d,1,0\n' % a.id
+        self.call(csv, unfinished=True)
+        a.refresh_from_db()
+        self.assertEqual(
+            (a.home_goals, a.away_goals, a.finished), (1, 0, False)
+        )
+
+        output = self.call(csv, unfinished=True)
+        self.assertIn('0 of 1 match results changed', output)
+
+    def test_finished_not_reopened(self):
+        a, b = self.matches
+        csv = 'match,home_goals,away_goals\n%d,1,0\n' % a.id
+        self.call(csv)
+        with self.assertRaisesMessage(
+            CommandError, 'Already finished: %d (use --reopen' % a.id
+        ):
+            self.call(csv, unfinished=True)
+        a.refresh_from_db()
+        self.assertTrue(a.finished)
+        self.assertEqual(Prediction.objects.get(match=a).score, 3)
+
+        output = self.call(csv, unfinished=True, reopen=True)
+        self.assertIn('1 of 1 match results changed', output)
+        a.refresh_from_db()
+        self.assertFalse(a.finished)
+        self.assertEqual(Prediction.objects.get(match=a).score, 0)
+
+    def test_penalties(self):
+        a, b = self.matches
+        self.call(
+            'match,home_goals,away_goals,pk_home_goals,pk_away_goals\n'
+            '%d,2,2,4,3\n' % b.id
+        )
+        b.refresh_from_db()
+        self.assertEqual((b.pk_home_goals, b.pk_away_goals), (4, 3))
+
+    def test_invalid_rows(self):
+        a, b = self.matches
+        for csv, error in (
+            (
+                'match,home_goals,away_goals\nx,1,0\n',
+                'Invalid result at line 2',
+            ),
+            (
+                'match,home_goals,away_goals\n%d,1,0\n%d,one,0\n'
+                % (a.id, b.id),
+                'Invalid result at line 3',
+            ),
+            ('match,home_goals\n%d,1\n' % a.id, 'Missing goals at line 2'),
+            ('match,home_goals,away_goals\n0,1,0\n', 'Unknown match: 0'),
+        ):
+            with self.subTest(error=error):
+                with self.assertRaisesMessage(CommandError, error):
+                    self.call(csv)
+        # nothing was saved
+        self.assertFalse(Match.objects.filter(finished=True).exists())
+        self.assertFalse(Prediction.objects.exclude(score=0).exists())
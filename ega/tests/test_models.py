@@ -1,10 +1,36 @@
+import itertools
+import pickle
+import tempfile
+
+from datetime import timedelta
 from unittest import mock
 
 from django.conf import settings
 from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 
 from ega.constants import INVITE_SUBJECT, INVITE_BODY
+from ega.models import (
+    AllTimeStanding,
+    ChampionPrediction,
+    DefaultPrediction,
+    EgaUser,
+    League,
+    LeagueMember,
+    Match,
+    PredictedStanding,
+    Prediction,
+    ScoreChange,
+    ScoringJob,
+    Standing,
+    TeamStats,
+    Tournament,
+    ranking_version,
+    update_match_results,
+)
 from ega.tests.helpers import TestCase
 
 ADMINS = ['natalia@gmail.com', 'matias@gmail.com']
@@ -70,6 +96,25 @@ class EgaUserTestCase(TestCase):
             user.preferences, {'default_prediction': user.default_prediction}
         )
 
+    def test_default_prediction_synced(self):
+        user = self.factory.make_user()
+        self.assertFalse(DefaultPrediction.objects.filter(user=user).exists())
+
+        user.default_prediction = (2, 2, 'V')
+        user.save()
+        self.assertEqual(
+            DefaultPrediction.objects.filter(user=user)
+            .values_list('home_goals', 'away_goals', 'penalties')
+            .get(),
+            (2, 2, 'V'),
+        )
+
+        user.default_prediction = None
+        user.save(update_fields=['last_login'])
+        self.assertTrue(DefaultPrediction.objects.filter(user=user).exists())
+        user.save()
+        self.assertFalse(DefaultPrediction.objects.filter(user=user).exists())
+
 
 class UpdateRelatedPredictions(TestCase):
     def finish_match(
@@ -471,6 +516,618 @@ class UpdateRelatedPredictions(TestCase):
         )
 
 
+class ScoringRulesTestCase(TestCase):
+    """Compare single-UPDATE scoring against the previous step-by-step rules.
+
+    legacy_score mirrors the former sequence of UPDATEs: reset, default
+    prediction fill, exact, winner, starred and penalties.
+    """
+
+    GOALS = (None, 0, 1, 2)
+    DEFAULTS = (
+        {'home_goals': 1, 'away_goals': 0, 'penalties': ''},
+        {'home_goals': 1, 'away_goals': 1, 'penalties': 'L'},
+        {'home_goals': 0, 'away_goals': 0, 'penalties': 'V'},
+        {'home_goals': 2, 'away_goals': 1},
+        {'home_goals': 1},
+    )
+    RESULTS = ((0, 0), (1, 1), (2, 1), (1, 2), (0, 2))
+    PENALTIES = (None, (4, 3), (3, 4), (2, 2))
+
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.predictions = []
+        for home_goals, away_goals, penalties, starred in itertools.product(
+            self.GOALS, self.GOALS, ('', 'L', 'V'), (False, True)
+        ):
+            self.predictions.append(
+                dict(
+                    user=self.factory.make_user(),
+                    home_goals=home_goals,
+                    away_goals=away_goals,
+                    penalties=penalties,
+                    starred=starred,
+                )
+            )
+        for default, predicted in itertools.product(self.DEFAULTS, (None, 2)):
+            user = self.factory.make_user(
+                preferences={'default_prediction': default}
+            )
+            self.predictions.append(
+                dict(user=user, home_goals=predicted, away_goals=predicted)
+            )
+
+    def legacy_score(self, match, prediction):
+        home_goals = prediction.get('home_goals')
+        away_goals = prediction.get('away_goals')
+        penalties = prediction.get('penalties', '')
+        source = 'web'
+        default = prediction['user'].default_prediction
+        if home_goals is None and away_goals is None and default is not None:
+            home_goals = default.get('home_goals')
+            away_goals = default.get('away_goals')
+            penalties = default.get('penalties', '')
+            source = 'preferences'
+
+        score = 0
+        predicted = home_goals is not None and away_goals is not None
+        if (home_goals, away_goals) == (match.home_goals, match.away_goals):
+            score = 3
+        elif predicted and (
+            (match.home_goals > match.away_goals and home_goals > away_goals)
+            or (
+                match.home_goals < match.away_goals and home_goals < away_goals
+            )
+            or (
+                match.home_goals == match.away_goals
+                and home_goals == away_goals
+            )
+        ):
+            score = 1
+
+        if score > 0 and prediction.get('starred', False):
+            score += 1
+        if score > 0 and match.pk_home_goals is not None:
+            side = 'L' if match.pk_home_goals > match.pk_away_goals else 'V'
+            if home_goals == away_goals and penalties == side:
+                score += 1
+        return (home_goals, away_goals, penalties, source, score)
+
+    def test_scores_match_legacy_rules(self):
+        for (home_goals, away_goals), pk_goals in itertools.product(
+            self.RESULTS, self.PENALTIES
+        ):
+            match = self.factory.make_match(tournament=self.tournament)
+            Prediction.objects.bulk_create(
+                Prediction(match=match, **p) for p in self.predictions
+            )
+            match.home_goals = home_goals
+            match.away_goals = away_goals
+            match.pk_home_goals, match.pk_away_goals = pk_goals or (None, None)
+            match.finished = True
+            match.save()
+
+            scored = {
+                p.user_id: (
+                    p.home_goals,
+                    p.away_goals,
+                    p.penalties,
+                    p.source,
+                    p.score,
+                )
+                for p in match.prediction_set.all()
+            }
+            expected = {
+                p['user'].id: self.legacy_score(match, p)
+                for p in self.predictions
+            }
+            with self.subTest(result=(home_goals, away_goals), pk=pk_goals):
+                self.assertEqual(scored, expected)
+
+    def test_single_update(self):
+        match = self.factory.make_match(tournament=self.tournament)
+        self.factory.make_prediction(match=match, home_goals=1, away_goals=0)
+        match.home_goals = 1
+        match.away_goals = 0
+        match.finished = True
+
+        with CaptureQueriesContext(connection) as queries:
+            match.save()
+
+        updates = [
+            q['sql']
+            for q in queries
+            if q['sql'].startswith('UPDATE "ega_prediction"')
+        ]
+        # unpredicted results filled from defaults, then scored
+        fill, score = updates
+        self.assertIn('IS NULL', fill)
+        self.assertEqual(fill.count('"ega_defaultprediction"'), 4)
+        self.assertNotIn('"ega_defaultprediction"', score)
+
+    def test_custom_rules(self):
+        tournament = self.factory.make_tournament(
+            exact_points=7,
+            winner_points=2,
+            goal_difference_points=2,
+            starred_points=3,
+            penalties_points=3,
+            knockout_multiplier=2,
+        )
+        users = [self.factory.make_user() for i in range(4)]
+        for knockout in (False, True):
+            match = self.factory.make_match(
+                tournament=tournament, knockout=knockout
+            )
+            for user, (home_goals, away_goals, starred) in zip(
+                users,
+                ((2, 1, False), (3, 2, False), (3, 1, False), (2, 1, True)),
+            ):
+                self.factory.make_prediction(
+                    match=match,
+                    user=user,
+                    home_goals=home_goals,
+                    away_goals=away_goals,
+                    starred=starred,
+                )
+            match.home_goals = 2
+            match.away_goals = 1
+            match.finished = True
+            match.save()
+
+            multiplier = 2 if knockout else 1
+            scores = dict(match.prediction_set.values_list('user', 'score'))
+            expected = {
+                users[0].id: 7 * multiplier,
+                users[1].id: 4 * multiplier,
+                users[2].id: 2 * multiplier,
+                users[3].id: 7 * multiplier + 3,
+            }
+            with self.subTest(knockout=knockout):
+                self.assertEqual(scores, expected)
+
+        # knockout scores only count for the standings total
+        standings = {
+            s.user_id: (s.x1, s.x3, s.xx1, s.xx3, s.total)
+            for s in tournament.standing_set.all()
+        }
+        self.assertEqual(standings[users[0].id], (0, 1, 0, 0, 21))
+        self.assertEqual(standings[users[2].id], (1, 0, 0, 0, 6))
+        self.assertEqual(standings[users[3].id], (0, 0, 0, 1, 27))
+
+    def test_custom_penalties_rules(self):
+        tournament = self.factory.make_tournament(penalties_points=2)
+        match = self.factory.make_match(tournament=tournament, knockout=True)
+        prediction = self.factory.make_prediction(
+            match=match, home_goals=1, away_goals=1, penalties='V'
+        )
+        match.home_goals = match.away_goals = 0
+        match.pk_home_goals = 3
+        match.pk_away_goals = 4
+        match.finished = True
+        match.save()
+
+        prediction.refresh_from_db()
+        self.assertEqual(prediction.score, 3)
+
+    def test_rescore(self):
+        match = self.factory.make_match(tournament=self.tournament)
+        prediction = self.factory.make_prediction(
+            match=match, home_goals=1, away_goals=0
+        )
+        match.home_goals = 1
+        match.away_goals = 0
+        match.finished = True
+        match.save()
+        self.assertEqual(match.score_changes(), 0)
+
+        # change the result skipping the post_save handlers
+        Match.objects.filter(pk=match.pk).update(home_goals=2)
+        match.refresh_from_db()
+        self.assertEqual(match.score_changes(), 1)
+
+        match.rescore()
+        prediction.refresh_from_db()
+        self.assertEqual(prediction.score, 1)
+        self.assertEqual(match.score_changes(), 0)
+
+    def test_default_prediction_changes(self):
+        user = self.factory.make_user(
+            preferences={
+                'default_prediction': {
+                    'home_goals': 2,
+                    'away_goals': 1,
+                    'penalties': '',
+                }
+            }
+        )
+        match = self.factory.make_match(tournament=self.tournament)
+        prediction = self.factory.make_prediction(match=match, user=user)
+        Match.objects.filter(pk=match.pk).update(
+            home_goals=2, away_goals=1, finished=True
+        )
+        match.refresh_from_db()
+        # defaults are read (not stored) by the read only queries
+        self.assertEqual(match.score_changes(), 1)
+
+        match.rescore()
+        prediction.refresh_from_db()
+        self.assertEqual(
+            (prediction.home_goals, prediction.away_goals), (2, 1)
+        )
+        self.assertEqual(prediction.source, 'preferences')
+        self.assertEqual(prediction.score, 3)
+        self.assertEqual(match.score_changes(), 0)
+
+
+class MatchChangesTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.match = self.factory.make_match()
+        self.prediction = self.factory.make_prediction(
+            match=self.match, home_goals=1, away_goals=0
+        )
+        self.match.home_goals = 1
+        self.match.away_goals = 0
+        self.match.finished = True
+        self.match.save()
+
+    def test_changed_fields(self):
+        match = Match.objects.get(pk=self.match.pk)
+        self.assertEqual(match.changed_fields(), set())
+
+        match.referee = 'Collina'
+        match.home_goals = 2
+        self.assertEqual(match.changed_fields(), {'home_goals'})
+
+        match.save()
+        self.assertEqual(match.changed_fields(), set())
+
+        deferred = Match.objects.only('id').get(pk=self.match.pk)
+        self.assertEqual(deferred.changed_fields(), Match.TRACKED_FIELDS)
+
+    def scoring_queries(self, match):
+        """Save match, returning its predictions/stats writes."""
+        with CaptureQueriesContext(connection) as queries:
+            match.save()
+        writes = (
+            query['sql'].replace('"', '') for query in queries.captured_queries
+        )
+        return [
+            sql
+            for sql in writes
+            if sql.startswith(
+                (
+                    'UPDATE ega_prediction',
+                    'INSERT INTO ega_scorechange',
+                    'UPDATE ega_teamstats',
+                    'INSERT INTO ega_teamstats',
+                )
+            )
+        ]
+
+    def test_unchanged_result_skips_scoring(self):
+        match = Match.objects.get(pk=self.match.pk)
+        match.when = now()
+        match.description = 'Final'
+        match.location = 'Maracaná'
+        self.assertEqual(self.scoring_queries(match), [])
+
+        match.away_goals = 1
+        writes = self.scoring_queries(match)
+        for statement in (
+            'UPDATE ega_prediction',
+            'INSERT INTO ega_scorechange',
+            'UPDATE ega_teamstats',
+        ):
+            self.assertTrue(
+                any(sql.startswith(statement) for sql in writes), statement
+            )
+        self.prediction.refresh_from_db()
+        self.assertEqual(self.prediction.score, 0)
+
+    def test_string_goals(self):
+        # as assigned by the update_matches importer
+        match = Match.objects.get(pk=self.match.pk)
+        match.home_goals = '1'
+        match.away_goals = '0'
+        self.assertEqual(match.changed_fields(), set())
+        with mock.patch('ega.models.invalidate_rankings') as invalidate:
+            self.assertEqual(self.scoring_queries(match), [])
+        invalidate.assert_not_called()
+
+        match.away_goals = '1'
+        self.assertEqual(match.changed_fields(), {'away_goals'})
+
+    def test_suspended_updates_round_standings(self):
+        match = Match.objects.get(pk=self.match.pk)
+        match.suspended = True
+        with mock.patch.object(
+            Tournament, 'update_round_standings'
+        ) as update_round_standings:
+            match.save()
+        update_round_standings.assert_called_once_with(match.round)
+
+
+class ScoreChangeTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.match = self.factory.make_match(tournament=self.tournament)
+        self.exact = self.factory.make_prediction(
+            match=self.match, home_goals=1, away_goals=0
+        )
+        self.winner = self.factory.make_prediction(
+            match=self.match, home_goals=2, away_goals=0
+        )
+        self.factory.make_prediction(
+            match=self.match, home_goals=0, away_goals=0
+        )
+
+    def save_result(self, home_goals, away_goals, finished=True):
+        self.match.home_goals = home_goals
+        self.match.away_goals = away_goals
+        self.match.finished = finished
+        self.match.save()
+
+    def changes(self):
+        return list(
+            ScoreChange.objects.order_by('created', 'prediction').values_list(
+                'prediction', 'old_score', 'new_score'
+            )
+        )
+
+    def test_only_changes_recorded(self):
+        self.save_result(1, 0)
+        self.assertEqual(
+            self.changes(), [(self.exact.id, 0, 3), (self.winner.id, 0, 1)]
+        )
+        runs = set(ScoreChange.objects.values_list('run', flat=True))
+        self.assertEqual(len(runs), 1)
+
+        self.match.rescore()
+        self.assertEqual(len(self.changes()), 2)
+
+        self.save_result(2, 0)
+        self.assertEqual(
+            self.changes()[2:], [(self.exact.id, 3, 1), (self.winner.id, 1, 3)]
+        )
+
+        self.save_result(None, None, finished=False)
+        self.assertEqual(
+            self.changes()[4:], [(self.exact.id, 1, 0), (self.winner.id, 3, 0)]
+        )
+        self.assertEqual(
+            list(self.tournament.standing_set.values_list('total', flat=True)),
+            [0, 0, 0],
+        )
+
+    def test_scores_at(self):
+        self.save_result(1, 0)
+        before = now()
+        self.save_result(2, 0)
+
+        self.assertEqual(
+            self.tournament.scores_at(before),
+            {self.exact.user_id: 3, self.winner.user_id: 1},
+        )
+        self.assertEqual(
+            self.tournament.scores_at(now()),
+            {self.exact.user_id: 1, self.winner.user_id: 3},
+        )
+
+
+class ScoringJobTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.match = self.factory.make_match()
+        self.prediction = self.factory.make_prediction(
+            match=self.match, home_goals=1, away_goals=0
+        )
+
+    def save_result(self, home_goals, away_goals):
+        self.match.home_goals = home_goals
+        self.match.away_goals = away_goals
+        self.match.finished = True
+        self.match.defer_scoring = True
+        self.match.save()
+
+    def test_deferred_and_coalesced(self):
+        self.save_result(2, 0)
+        self.save_result(1, 0)
+
+        self.prediction.refresh_from_db()
+        self.assertEqual(self.prediction.score, 0)
+        self.assertEqual(
+            list(ScoringJob.pending().values_list('match', flat=True)),
+            [self.match.id],
+        )
+
+        job = ScoringJob.objects.get()
+        self.assertTrue(job.run())
+
+        self.prediction.refresh_from_db()
+        self.assertEqual(self.prediction.score, 3)
+        self.assertFalse(ScoringJob.objects.exists())
+        self.assertEqual(
+            self.match.home.teamstats_set.get().points,
+            3,
+        )
+
+    def test_deferred_team_swap(self):
+        self.save_result(1, 0)
+        ScoringJob.objects.get().run()
+        home = self.match.home
+        self.assertEqual(home.teamstats_set.get().points, 3)
+
+        # swapped twice before the job runs
+        for i in range(2):
+            self.match.home = self.factory.make_team()
+            self.match.defer_scoring = True
+            self.match.save()
+        ScoringJob.objects.get().run()
+
+        self.assertEqual(home.teamstats_set.get().points, 0)
+        self.assertEqual(self.match.home.teamstats_set.get().points, 3)
+        for stats in TeamStats.objects.all():
+            expected = stats.recompute()
+            self.assertEqual(
+                {name: getattr(stats, name) for name in expected}, expected
+            )
+
+    def test_failed_job_retried_later(self):
+        self.save_result(1, 0)
+        job = ScoringJob.objects.get()
+
+        with mock.patch.object(Match, 'rescore', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                job.run()
+
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.last_error, 'ValueError()')
+        self.assertFalse(ScoringJob.pending().exists())
+
+        # a new result requeues it
+        self.save_result(2, 0)
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 0)
+        self.assertTrue(ScoringJob.pending().exists())
+
+
+class TeamStatsDeltasTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.teams = [self.factory.make_team() for i in range(3)]
+        self.match = self.factory.make_match(
+            tournament=self.tournament, home=self.teams[0], away=self.teams[1]
+        )
+        self.match = Match.objects.get(id=self.match.id)
+
+    def save_result(self, home_goals, away_goals, finished=True):
+        self.match.home_goals = home_goals
+        self.match.away_goals = away_goals
+        self.match.finished = finished
+        with mock.patch.object(TeamStats, 'sync', autospec=True) as sync:
+            self.match.save()
+        sync.assert_not_called()
+
+    def assert_stats_consistent(self):
+        for stats in TeamStats.objects.filter(tournament=self.tournament):
+            expected = stats.recompute()
+            self.assertEqual(
+                {name: getattr(stats, name) for name in expected}, expected
+            )
+
+    def test_result_correction(self):
+        self.save_result(2, 0)
+        self.assertEqual(TeamStats.objects.get(team=self.teams[0]).points, 3)
+        self.save_result(1, 1)
+        self.assert_stats_consistent()
+        self.assertEqual(TeamStats.objects.get(team=self.teams[0]).gf, 1)
+
+    def test_unfinished(self):
+        self.save_result(2, 0)
+        self.save_result(2, 0, finished=False)
+        self.assert_stats_consistent()
+        self.assertEqual(TeamStats.objects.get(team=self.teams[1]).lost, 0)
+
+    def test_team_swap(self):
+        self.save_result(0, 3)
+        # stats for the new team are created (and computed from scratch)
+        self.match.home = self.teams[2]
+        self.match.save()
+        self.assert_stats_consistent()
+        self.assertEqual(TeamStats.objects.get(team=self.teams[2]).lost, 1)
+        self.assertEqual(TeamStats.objects.get(team=self.teams[0]).lost, 0)
+
+    def test_out_of_sync_stats_recomputed(self):
+        self.save_result(2, 0)
+        TeamStats.objects.filter(team=self.teams[0]).update(won=0)
+        self.match.home_goals = 0
+        self.match.save()
+        self.assert_stats_consistent()
+
+
+class BulkResultsTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.users = [self.factory.make_user() for i in range(2)]
+        self.matches = [
+            self.factory.make_match(tournament=self.tournament)
+            for i in range(3)
+        ]
+        for match in self.matches:
+            for user, goals in zip(self.users, ((1, 0), (0, 0))):
+                self.factory.make_prediction(
+                    match=match,
+                    user=user,
+                    home_goals=goals[0],
+                    away_goals=goals[1],
+                )
+
+    def enter_results(self, results):
+        matches = list(
+            Match.objects.filter(id__in=[m.id for m in self.matches]).order_by(
+                'id'
+            )
+        )
+        for match, (home_goals, away_goals) in zip(matches, results):
+            match.home_goals = home_goals
+            match.away_goals = away_goals
+            match.finished = True
+        return update_match_results(matches)
+
+    def test_scored_in_a_single_pass(self):
+        with mock.patch.object(
+            TeamStats, 'sync', autospec=True
+        ) as sync, mock.patch.object(
+            Tournament, 'update_round_standings'
+        ) as update_round_standings:
+            changed = self.enter_results([(1, 0), (0, 0), (2, 1)])
+
+        self.assertEqual(changed, self.matches)
+        # team stats are updated from the results deltas, and round
+        # standings once per round
+        sync.assert_not_called()
+        update_round_standings.assert_called_once_with('')
+        self.assertEqual(
+            ScoreChange.objects.values('run').distinct().count(), 1
+        )
+
+    def test_same_as_one_by_one(self):
+        self.enter_results([(1, 0), (0, 0), (2, 1)])
+        u1, u2 = self.users
+        scores = Prediction.objects.order_by(
+            'match_id', 'user_id'
+        ).values_list('score', flat=True)
+        self.assertEqual(list(scores), [3, 0, 0, 3, 1, 0])
+        self.assertEqual(self.tournament.standings_mismatches(), [])
+        self.assertEqual(self.tournament.standing_set.get(user=u1).total, 4)
+        home_stats = TeamStats.objects.get(team=self.matches[2].home)
+        self.assertEqual(home_stats.points, 3)
+        self.assertEqual(home_stats.gf, 2)
+
+        # correcting a result rescores only that match
+        changed = self.enter_results([(1, 0), (0, 0), (0, 0)])
+        self.assertEqual(changed, [self.matches[2]])
+        self.assertEqual(self.tournament.standings_mismatches(), [])
+        self.assertEqual(self.tournament.standing_set.get(user=u2).total, 6)
+        home_stats.refresh_from_db()
+        self.assertEqual(home_stats.points, 1)
+
+    def test_unchanged_results_skipped(self):
+        self.enter_results([(1, 0), (0, 0), (2, 1)])
+        with CaptureQueriesContext(connection) as queries:
+            changed = self.enter_results([(1, 0), (0, 0), (2, 1)])
+        self.assertEqual(changed, [])
+        # only the matches are loaded
+        self.assertEqual(len(queries), 1)
+
+
 class PredictedRankingTestCase(TestCase):
     def test_empty(self):
         tournament = self.factory.make_tournament()
@@ -533,3 +1190,959 @@ class PredictedRankingTestCase(TestCase):
             "2B": match2.away.id,
         }
         self.assertEqual(ranking, expected)
+
+    def test_update_per_tournament(self):
+        user = self.factory.make_user()
+        matches = []
+        for i in range(2):
+            tournament = self.factory.make_tournament()
+            match = self.factory.make_match(tournament=tournament)
+            self.factory.make_prediction(
+                match=match, user=user, home_goals=0, away_goals=2
+            )
+            knockout = self.factory.make_match(
+                tournament=tournament, knockout=True
+            )
+            self.factory.make_prediction(
+                match=knockout, user=user, home_goals=5, away_goals=0
+            )
+            user.update_predicted_ranking(tournament)
+            matches.append(match)
+
+        for match in matches:
+            self.assertEqual(
+                user.predicted_ranking(match.tournament),
+                {"1": match.away.id, "2": match.home.id},
+            )
+        standing = PredictedStanding.objects.get(
+            user=user, team=matches[0].away
+        )
+        self.assertEqual(
+            (standing.points, standing.goal_difference, standing.goals),
+            (3, 2, 2),
+        )
+
+
+class TeamDetailsTestCase(TestCase):
+    def test_stats_created_with_tournament_teams(self):
+        tournament = self.factory.make_tournament()
+        team = self.factory.make_team()
+        other = self.factory.make_team()
+        tournament.teams.add(team)
+        other.tournament_set.add(tournament)
+        self.assertEqual(
+            set(
+                TeamStats.objects.filter(tournament=tournament).values_list(
+                    'team', flat=True
+                )
+            ),
+            {team.id, other.id},
+        )
+
+    def test_team_details(self):
+        tournament = self.factory.make_tournament()
+        team = self.factory.make_team()
+        played = []
+        for i in range(4):
+            match = self.factory.make_match(
+                tournament=tournament,
+                home=team,
+                when=now() - timedelta(days=i + 1),
+            )
+            match.home_goals = match.away_goals = i
+            match.finished = True
+            match.save()
+            played.append(match)
+        newcomer = self.factory.make_team()
+
+        with self.assertNumQueries(2):
+            details = tournament.team_details([team.id, newcomer.id])
+        stats, latest = details[team.id]
+        self.assertEqual(stats.tie, 4)
+        self.assertEqual(latest, played[:3])
+        self.assertEqual(details[newcomer.id], (None, []))
+
+
+class PredictedBracketTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.user = self.factory.make_user()
+        self.groups = []
+        for zone in ('A', 'B'):
+            match = self.factory.make_match(tournament=self.tournament)
+            TeamStats.objects.filter(team__in=(match.home, match.away)).update(
+                zone=zone
+            )
+            self.factory.make_prediction(
+                match=match, user=self.user, home_goals=1, away_goals=0
+            )
+            self.groups.append(match)
+
+        def knockout(home, away, days):
+            return self.factory.make_match(
+                tournament=self.tournament,
+                home=None,
+                away=None,
+                home_placeholder=home,
+                away_placeholder=away,
+                knockout=True,
+                when=now() + timedelta(days=days),
+            )
+
+        self.semi1 = knockout('1A', '2B', 1)
+        self.semi2 = knockout('1B', '2A', 2)
+        self.final = knockout('W%d' % self.semi1.id, 'W%d' % self.semi2.id, 4)
+        self.third = knockout('L%d' % self.semi1.id, 'L%d' % self.semi2.id, 3)
+
+    def bracket(self):
+        return [
+            (m.match, m.home_team, m.away_team)
+            for m in self.user.predicted_bracket(self.tournament)
+        ]
+
+    def test_from_group_standings(self):
+        self.user.update_predicted_ranking(self.tournament)
+        a, b = self.groups
+        semi1 = 'W%d' % self.semi1.id
+        semi2 = 'W%d' % self.semi2.id
+        with self.assertNumQueries(1):
+            bracket = self.bracket()
+        self.assertEqual(
+            bracket,
+            [
+                (self.semi1, a.home, b.away),
+                (self.semi2, b.home, a.away),
+                (self.third, 'L%d' % self.semi1.id, 'L%d' % self.semi2.id),
+                (self.final, semi1, semi2),
+            ],
+        )
+
+    def test_from_knockout_predictions(self):
+        self.factory.make_prediction(
+            match=self.semi1, user=self.user, home_goals=0, away_goals=2
+        )
+        self.factory.make_prediction(
+            match=self.semi2,
+            user=self.user,
+            home_goals=1,
+            away_goals=1,
+            penalties='L',
+        )
+        self.user.update_predicted_ranking(self.tournament)
+        a, b = self.groups
+        self.assertEqual(
+            self.bracket()[2:],
+            [
+                (self.third, a.home, a.away),
+                (self.final, b.away, b.home),
+            ],
+        )
+
+        # an actual team overrides the predicted one
+        self.final.home = a.home
+        self.final.save()
+        self.user.update_predicted_bracket(self.tournament)
+        self.assertEqual(self.bracket()[3], (self.final, a.home, b.home))
+
+    def test_rebuilt_by_knockout_changes(self):
+        def rebuilt(change):
+            with mock.patch.object(
+                EgaUser,
+                'update_predicted_bracket',
+                autospec=True,
+                side_effect=EgaUser.update_predicted_bracket,
+            ) as update:
+                change()
+            return update.called
+
+        self.user.update_predicted_ranking(self.tournament)
+        a, b = self.groups
+        self.assertFalse(rebuilt(a.save))
+
+        self.final.home = a.home
+        self.assertTrue(rebuilt(self.final.save))
+        self.assertEqual(
+            self.bracket()[3], (self.final, a.home, 'W%d' % self.semi2.id)
+        )
+        self.final.home_placeholder = 'W1'
+        self.assertTrue(rebuilt(self.final.save))
+        self.final.referee = 'Collina'
+        self.assertFalse(rebuilt(self.final.save))
+        # rescheduling does not change the bracket teams
+        self.final.when = now()
+        self.assertFalse(rebuilt(self.final.save))
+
+        self.assertTrue(rebuilt(self.third.delete))
+        self.assertEqual(len(self.bracket()), 3)
+        self.assertTrue(
+            rebuilt(
+                lambda: self.factory.make_match(
+                    tournament=self.tournament, knockout=True
+                )
+            )
+        )
+        self.assertEqual(len(self.bracket()), 4)
+
+        # bulk entered results setting the actual teams
+        self.semi1.home = b.home
+        self.assertTrue(rebuilt(lambda: update_match_results([self.semi1])))
+        self.assertIn(
+            (self.semi1, b.home), [(m, home) for m, home, _ in self.bracket()]
+        )
+
+    def test_placeholders_regardless_of_dates(self):
+        # the final played (or rescheduled) before its semifinals
+        self.final.when = now()
+        self.final.save()
+        self.factory.make_prediction(
+            match=self.semi1, user=self.user, home_goals=0, away_goals=2
+        )
+        self.factory.make_prediction(
+            match=self.semi2, user=self.user, home_goals=2, away_goals=0
+        )
+        self.user.update_predicted_ranking(self.tournament)
+        a, b = self.groups
+        self.assertEqual(self.bracket()[0], (self.final, b.away, b.home))
+
+
+class StandingTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.users = [self.factory.make_user() for i in range(3)]
+
+    def finish_match(self, match, home_goals, away_goals):
+        match.home_goals = home_goals
+        match.away_goals = away_goals
+        match.finished = True
+        match.save()
+
+    def make_match(self, predictions, **kwargs):
+        match = self.factory.make_match(tournament=self.tournament, **kwargs)
+        for user, (home_goals, away_goals) in zip(self.users, predictions):
+            self.factory.make_prediction(
+                match=match,
+                user=user,
+                home_goals=home_goals,
+                away_goals=away_goals,
+                starred=kwargs.get('starred', False),
+            )
+        return match
+
+    def assert_ranking(self, expected):
+        ranking = [
+            (r['username'], r['total'], r['x1'], r['x3'])
+            for r in self.tournament.ranking()
+        ]
+        self.assertEqual(ranking, expected)
+
+        # a full rebuild matches the incrementally updated standings
+        self.tournament.rebuild_standings()
+        ranking = [
+            (r['username'], r['total'], r['x1'], r['x3'])
+            for r in self.tournament.ranking()
+        ]
+        self.assertEqual(ranking, expected)
+
+    def test_ranking_updated_on_match_result(self):
+        u1, u2, u3 = [u.username for u in self.users]
+        match = self.make_match([(1, 0), (2, 0), (0, 1)])
+        self.finish_match(match, 1, 0)
+        self.assert_ranking([(u1, 3, 0, 1), (u2, 1, 1, 0), (u3, 0, 0, 0)])
+
+        match = self.make_match([(0, 0), (0, 0), (0, 0)], starred=True)
+        self.finish_match(match, 0, 0)
+        self.assert_ranking([(u1, 7, 0, 1), (u2, 5, 1, 0), (u3, 4, 0, 0)])
+
+    def test_ranking_result_correction(self):
+        u1, u2, u3 = [u.username for u in self.users]
+        match = self.make_match([(1, 0), (2, 0), (0, 1)])
+        self.finish_match(match, 1, 0)
+        self.finish_match(match, 0, 1)
+        self.assert_ranking([(u3, 3, 0, 1), (u1, 0, 0, 0), (u2, 0, 0, 0)])
+
+        match.finished = False
+        match.save()
+        self.assert_ranking([(u1, 0, 0, 0), (u2, 0, 0, 0), (u3, 0, 0, 0)])
+
+    def test_ranking_champion_score(self):
+        u1, u2, u3 = [u.username for u in self.users]
+        match = self.make_match([(1, 0), (2, 0), (0, 1)])
+        self.finish_match(match, 1, 0)
+        champion = ChampionPrediction.objects.create(
+            user=self.users[2], tournament=self.tournament
+        )
+        champion.score = 8
+        champion.save()
+
+        self.assert_ranking([(u3, 8, 0, 0), (u1, 3, 0, 1), (u2, 1, 1, 0)])
+
+    def test_standings_mismatches(self):
+        match = self.make_match([(1, 0), (2, 0), (0, 1)])
+        self.finish_match(match, 1, 0)
+        self.assertEqual(self.tournament.standings_mismatches(), [])
+
+        self.tournament.standing_set.filter(user=self.users[1]).update(total=5)
+        self.assertEqual(
+            self.tournament.standings_mismatches(), [self.users[1].id]
+        )
+        self.tournament.rebuild_standings()
+        self.assertEqual(self.tournament.standings_mismatches(), [])
+
+    def test_deleted_match(self):
+        match = self.make_match([(1, 0), (2, 0), (0, 1)])
+        self.finish_match(match, 1, 0)
+        other = self.make_match([(1, 1)])
+        self.finish_match(other, 1, 1)
+        self.assertEqual(
+            self.tournament.standing_set.get(user=self.users[0]).total, 6
+        )
+
+        match.delete()
+        self.assertEqual(self.tournament.standings_mismatches(), [])
+        self.assertEqual(
+            self.tournament.standing_set.get(user=self.users[0]).total, 3
+        )
+        self.assertEqual(
+            [r['total'] for r in self.tournament.ranking()], [3, 0, 0]
+        )
+        stats = TeamStats.objects.get(
+            tournament=self.tournament, team=match.home
+        )
+        self.assertEqual((stats.won, stats.points), (0, 0))
+
+    def test_deleted_prediction(self):
+        match = self.make_match([(1, 0), (2, 0)])
+        self.finish_match(match, 1, 0)
+        match.prediction_set.get(user=self.users[0]).delete()
+        self.assertEqual(self.tournament.standings_mismatches(), [])
+        standing = self.tournament.standing_set.get(user=self.users[0])
+        self.assertEqual((standing.x3, standing.total), (0, 0))
+
+    def test_match_moved(self):
+        match = self.make_match([(1, 0), (2, 0)])
+        self.finish_match(match, 1, 0)
+        other = self.factory.make_tournament()
+        match.tournament = other
+        match.save()
+        for tournament in (self.tournament, other):
+            self.assertEqual(tournament.standings_mismatches(), [])
+        self.assertEqual([r['total'] for r in other.ranking()], [3, 1])
+        # no predictions left in the previous tournament
+        self.assertEqual(self.tournament.ranking().count(), 0)
+
+    def test_scoring_rules_change(self):
+        match = self.make_match([(1, 0), (2, 0)])
+        self.finish_match(match, 1, 0)
+
+        self.tournament.exact_points = 5
+        self.tournament.winner_points = 2
+        self.tournament.save()
+        self.assertEqual(self.tournament.standings_mismatches(), [])
+        match.rescore()
+        self.assertEqual(self.tournament.standings_mismatches(), [])
+        standings = self.tournament.standing_set.order_by('user_id')
+        self.assertEqual(
+            list(standings.values_list('x1', 'x3', 'total')),
+            [(0, 1, 5), (1, 0, 2)],
+        )
+
+    def test_team_stats_recompute(self):
+        match = self.make_match([])
+        self.finish_match(match, 2, 1)
+        stats = TeamStats.objects.get(
+            tournament=self.tournament, team=match.home
+        )
+        expected = dict(won=1, tie=0, lost=0, gf=2, gc=1, points=3)
+        with self.assertNumQueries(1):
+            self.assertEqual(stats.recompute(), expected)
+
+        TeamStats.objects.filter(id=stats.id).update(won=0, points=0)
+        stats.refresh_from_db()
+        self.assertEqual(stats.recompute(), expected)
+        stats.sync()
+        stats.refresh_from_db()
+        self.assertEqual(stats.won, 1)
+        self.assertEqual(stats.points, 3)
+
+    def test_team_stats_rebuild(self):
+        first = self.make_match([])
+        self.finish_match(first, 2, 1)
+        second = self.make_match([], home=first.away)
+        self.finish_match(second, 1, 1)
+        self.make_match([], home=first.home, away=second.away)
+        expected = {
+            stats.team_id: stats.recompute()
+            for stats in TeamStats.objects.filter(tournament=self.tournament)
+        }
+        self.assertEqual(
+            TeamStats.recompute_all(self.tournament),
+            expected,
+        )
+
+        TeamStats.objects.filter(team=first.home).delete()
+        TeamStats.objects.filter(team=first.away).update(won=3, points=9)
+        # grouped stats, stored teams, missing stats, all stats and update
+        # (plus the transaction savepoints)
+        with self.assertNumQueries(7):
+            TeamStats.rebuild(self.tournament)
+        stored = TeamStats.objects.filter(tournament=self.tournament)
+        self.assertEqual(
+            {
+                stats.team_id: {
+                    name: getattr(stats, name)
+                    for name in TeamStats.STATS_FIELDS
+                }
+                for stats in stored
+            },
+            expected,
+        )
+
+
+class LeagueRankingTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.league = League.objects.create(
+            name='friends', tournament=self.tournament
+        )
+        self.users = [self.factory.make_user() for i in range(4)]
+        for user in self.users[:2]:
+            LeagueMember.objects.create(user=user, league=self.league)
+
+        self.match = self.factory.make_match(
+            tournament=self.tournament, round='1'
+        )
+        for user, goals in zip(self.users, (2, 1, 1, 0)):
+            self.factory.make_prediction(
+                match=self.match, user=user, home_goals=goals, away_goals=0
+            )
+        self.match.home_goals = 1
+        self.match.away_goals = 0
+        self.match.finished = True
+        self.match.save()
+
+    def test_ranking(self):
+        ranking = [(r['username'], r['total']) for r in self.league.ranking()]
+        expected = [(self.users[1].username, 3), (self.users[0].username, 1)]
+        self.assertEqual(ranking, expected)
+
+    def test_round_ranking(self):
+        ranking = [
+            (r['username'], r['total']) for r in self.league.ranking(round='1')
+        ]
+        expected = [(self.users[1].username, 3), (self.users[0].username, 1)]
+        self.assertEqual(ranking, expected)
+
+    def test_round_ranking_other_round(self):
+        self.assertEqual(list(self.league.ranking(round='2')), [])
+
+    def test_ranking_other_league(self):
+        other = League.objects.create(
+            name='others', tournament=self.tournament
+        )
+        LeagueMember.objects.create(user=self.users[3], league=other)
+
+        ranking = [(r['username'], r['total']) for r in other.ranking()]
+        self.assertEqual(ranking, [(self.users[3].username, 0)])
+
+
+class RankingTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.match = self.factory.make_match(
+            tournament=self.tournament, round='1'
+        )
+        self.users = []
+        # two exacts, two winners, one miss
+        for goals in ((1, 0), (1, 0), (2, 0), (3, 1), (0, 1)):
+            user = self.factory.make_user()
+            self.factory.make_prediction(
+                match=self.match,
+                user=user,
+                home_goals=goals[0],
+                away_goals=goals[1],
+            )
+            self.users.append(user)
+        self.match.home_goals = 1
+        self.match.away_goals = 0
+        self.match.finished = True
+        self.match.save()
+
+    def test_count(self):
+        for round in (None, '1'):
+            with self.subTest(round=round):
+                ranking = self.tournament.ranking(round=round)
+                self.assertEqual(ranking.count(), 5)
+                self.assertEqual(len(ranking), 5)
+
+    def test_position_shared_by_ties(self):
+        for round in (None, '1'):
+            ranking = self.tournament.ranking(round=round)
+            positions = [ranking.position(u) for u in self.users]
+            with self.subTest(round=round):
+                self.assertEqual(positions, [1, 1, 3, 3, 5])
+
+    def test_position_not_ranked(self):
+        user = self.factory.make_user()
+        self.assertIsNone(self.tournament.ranking().position(user))
+
+    def test_slices(self):
+        for round in (None, '1'):
+            ranking = self.tournament.ranking(round=round)
+            usernames = [r['username'] for r in ranking]
+            with self.subTest(round=round):
+                self.assertEqual(len(usernames), 5)
+                self.assertEqual(
+                    [r['username'] for r in ranking[1:3]], usernames[1:3]
+                )
+                self.assertEqual(
+                    [r['username'] for r in ranking[3:]], usernames[3:]
+                )
+                self.assertEqual(ranking[4]['username'], usernames[4])
+                self.assertEqual(ranking[4]['position'], 5)
+                with self.assertRaises(IndexError):
+                    ranking[5]
+
+    def test_around_user_in_top(self):
+        ranking = self.tournament.ranking()
+        rows = ranking.around(self.users[1], top=2, context=1)
+        self.assertEqual([r['position'] for r in rows], [1, 1, 3])
+        self.assertFalse(any(r.gap for r in rows))
+
+    def test_around_user_below_top(self):
+        ranking = self.tournament.ranking(round='1')
+        rows = ranking.around(self.users[4], top=2, context=1)
+        self.assertEqual(
+            [(r.username, r.gap) for r in rows],
+            [
+                (ranking[0]['username'], False),
+                (ranking[1]['username'], False),
+                (ranking[3]['username'], True),
+                (self.users[4].username, False),
+            ],
+        )
+
+    def test_around_user_not_ranked(self):
+        user = self.factory.make_user()
+        league = League.objects.create(name='l', tournament=self.tournament)
+        LeagueMember.objects.create(user=self.users[4], league=league)
+        ranking = self.tournament.ranking(league=league)
+        self.assertEqual(
+            [r['username'] for r in ranking.around(user, top=3, context=1)],
+            [self.users[4].username],
+        )
+
+    def test_compact_rows(self):
+        for round in (None, '1'):
+            row = self.tournament.ranking(round=round)[0]
+            with self.subTest(round=round):
+                self.assertFalse(hasattr(row, '__dict__'))
+                self.assertEqual(row['total'], row.total)
+                self.assertIsNone(row.last_position)
+                with self.assertRaises(KeyError):
+                    row['unknown']
+
+                copy = pickle.loads(pickle.dumps(row))
+                self.assertEqual(
+                    [copy[name] for name in ('user_id', 'total', 'position')],
+                    [row.user_id, row.total, row.position],
+                )
+
+
+class RoundStandingTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.users = [self.factory.make_user() for i in range(2)]
+        self.start = now()
+
+    def make_match(self, round, day, predictions):
+        match = self.factory.make_match(
+            tournament=self.tournament,
+            round=round,
+            when=self.start + timedelta(days=day),
+        )
+        for user, (home_goals, away_goals) in zip(self.users, predictions):
+            self.factory.make_prediction(
+                match=match,
+                user=user,
+                home_goals=home_goals,
+                away_goals=away_goals,
+            )
+        return match
+
+    def finish_match(self, match, home_goals, away_goals):
+        match.home_goals = home_goals
+        match.away_goals = away_goals
+        match.finished = True
+        match.save()
+
+    def snapshot(self, round):
+        standings = self.tournament.roundstanding_set.filter(round=round)
+        return sorted(
+            standings.values_list('user_id', 'position', 'total', 'exacts')
+        )
+
+    def test_snapshot_on_round_close(self):
+        u1, u2 = [u.id for u in self.users]
+        m1 = self.make_match('1', 1, [(1, 0), (2, 0)])
+        m2 = self.make_match('1', 2, [(0, 0), (0, 1)])
+        m3 = self.make_match('2', 3, [(0, 1), (2, 2)])
+
+        self.finish_match(m1, 2, 0)
+        self.assertEqual(self.snapshot('1'), [])
+
+        self.finish_match(m2, 0, 1)
+        expected = [(u1, 2, 1, 0), (u2, 1, 6, 2)]
+        self.assertEqual(self.snapshot('1'), expected)
+
+        self.finish_match(m3, 1, 1)
+        self.assertEqual(self.snapshot('1'), expected)
+        self.assertEqual(self.snapshot('2'), [(u1, 2, 1, 0), (u2, 1, 7, 2)])
+        self.assertEqual(
+            self.tournament.previous_round_positions([u1, u2]),
+            {u1: 2, u2: 1},
+        )
+
+        # fixing a result reopens the round
+        m3.finished = False
+        m3.save()
+        self.assertEqual(self.snapshot('2'), [])
+
+    def test_rebuild(self):
+        u1, u2 = [u.id for u in self.users]
+        m1 = self.make_match('1', 1, [(1, 0), (0, 0)])
+        m2 = self.make_match('2', 2, [(0, 0), (0, 1)])
+        self.make_match('3', 3, [(0, 0), (0, 1)])
+        self.finish_match(m1, 1, 0)
+        self.finish_match(m2, 0, 1)
+        expected = {
+            '1': [(u1, 1, 3, 1), (u2, 2, 0, 0)],
+            '2': [(u1, 1, 3, 1), (u2, 1, 3, 1)],
+        }
+        self.assertEqual(self.snapshot('1'), expected['1'])
+        self.assertEqual(self.snapshot('2'), expected['2'])
+
+        self.tournament.roundstanding_set.all().delete()
+        self.tournament.standing_set.update(total=100)
+        self.tournament.rebuild_round_standings()
+
+        self.assertEqual(self.snapshot('1'), expected['1'])
+        self.assertEqual(self.snapshot('2'), expected['2'])
+        self.assertEqual(self.snapshot('3'), [])
+        self.assertEqual(
+            [r['total'] for r in self.tournament.ranking()], [3, 3]
+        )
+
+
+class ArchivedTournamentTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.users = [self.factory.make_user() for i in range(2)]
+        match = self.factory.make_match(tournament=self.tournament)
+        for user, goals in zip(self.users, (1, 2)):
+            self.factory.make_prediction(
+                match=match, user=user, home_goals=goals, away_goals=0
+            )
+        match.home_goals = 1
+        match.away_goals = 0
+        match.finished = True
+        match.save()
+
+    def finish(self):
+        self.tournament.finished = True
+        self.tournament.save()
+        # live data is not used anymore
+        self.tournament.standing_set.update(total=0, x3=0)
+        self.tournament.teamstats_set.update(won=0, points=0)
+
+    def test_archive_on_finish(self):
+        self.assertIsNone(self.tournament.archived)
+        self.finish()
+        self.assertTrue(self.tournament.is_archived)
+
+        ranking = [
+            (r['username'], r['total'], r['position'])
+            for r in self.tournament.ranking()
+        ]
+        self.assertEqual(
+            ranking,
+            [(self.users[0].username, 3, 1), (self.users[1].username, 1, 2)],
+        )
+        self.assertEqual(
+            self.users[0].stats(self.tournament),
+            dict(count=1, score=3, winners=1, exacts=1),
+        )
+        self.assertEqual(
+            [(s.won, s.points) for s in self.tournament.team_ranking()],
+            [(1, 3), (0, 0)],
+        )
+
+    def test_archived_stats_not_ranked(self):
+        self.finish()
+        user = self.factory.make_user()
+        self.assertEqual(
+            user.stats(self.tournament),
+            dict(count=0, score=0, winners=0, exacts=0),
+        )
+
+    def test_unarchive(self):
+        self.finish()
+        self.tournament.finished = False
+        self.tournament.save()
+
+        self.assertIsNone(self.tournament.archived)
+        self.assertFalse(self.tournament.finalstanding_set.exists())
+        self.assertEqual(
+            [r['total'] for r in self.tournament.ranking()], [0, 0]
+        )
+
+
+class AllTimeStandingTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [self.factory.make_user() for i in range(2)]
+
+    def play_tournament(self, *predictions):
+        tournament = self.factory.make_tournament()
+        match = self.factory.make_match(tournament=tournament)
+        for user, goals in zip(self.users, predictions):
+            self.factory.make_prediction(
+                match=match, user=user, home_goals=goals, away_goals=0
+            )
+        match.home_goals = 1
+        match.away_goals = 0
+        match.finished = True
+        match.save()
+        tournament.finished = True
+        tournament.save()
+        return tournament
+
+    def all_time(self):
+        return list(
+            AllTimeStanding.objects.order_by('-total').values_list(
+                'user_id', 'total', 'exacts', 'tournaments', 'best_finish'
+            )
+        )
+
+    def test_updated_on_archive(self):
+        u1, u2 = [u.id for u in self.users]
+        self.play_tournament(1, 2)
+        self.assertEqual(self.all_time(), [(u1, 3, 1, 1, 1), (u2, 1, 0, 1, 2)])
+
+        tournament = self.play_tournament(2, 1)
+        self.assertEqual(self.all_time(), [(u1, 4, 1, 2, 1), (u2, 4, 1, 2, 1)])
+
+        tournament.finished = False
+        tournament.save()
+        self.assertEqual(self.all_time(), [(u1, 3, 1, 1, 1), (u2, 1, 0, 1, 2)])
+
+    def test_rebuild(self):
+        self.play_tournament(1, 2)
+        self.play_tournament(0, 1)
+        expected = self.all_time()
+
+        AllTimeStanding.rebuild()
+        self.assertEqual(self.all_time(), expected)
+
+
+class LiveRankingTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.u1 = self.factory.make_user()
+        self.u2 = self.factory.make_user()
+        finished = self.factory.make_match(tournament=self.tournament)
+        self.factory.make_prediction(
+            match=finished, user=self.u1, home_goals=2, away_goals=0
+        )
+        finished.home_goals = 1
+        finished.away_goals = 0
+        finished.finished = True
+        finished.save()
+
+        self.match = self.factory.make_match(tournament=self.tournament)
+        self.factory.make_prediction(
+            match=self.match, user=self.u1, home_goals=0, away_goals=1
+        )
+        self.prediction = self.factory.make_prediction(
+            match=self.match,
+            user=self.u2,
+            home_goals=2,
+            away_goals=0,
+        )
+
+    def test_live_matches(self):
+        self.assertEqual(self.tournament.live_matches(), [])
+
+        self.match.home_goals = 2
+        self.match.away_goals = 0
+        self.match.save()
+
+        self.assertEqual(self.tournament.live_matches(), [self.match])
+        self.assertTrue(self.match.in_progress)
+
+    def test_live_ranking(self):
+        self.match.home_goals = 2
+        self.match.away_goals = 0
+        self.match.save()
+
+        ranking = self.tournament.ranking().live([self.match])
+
+        self.assertEqual(
+            [(r.user_id, r.total, r.live, r.position) for r in ranking],
+            [(self.u2.id, 3, 3, 1), (self.u1.id, 1, 0, 2)],
+        )
+        self.assertEqual(ranking.position(self.u1), 2)
+        self.assertEqual(ranking.count(), 2)
+        # exact live results count as such (e.g. to break ties)
+        self.assertEqual([r.x3 for r in ranking], [1, 0])
+        self.assertEqual(ranking[1:].pop().user_id, self.u1.id)
+        # nothing is written
+        self.prediction.refresh_from_db()
+        self.assertEqual(self.prediction.score, 0)
+        self.assertEqual([r.total for r in self.tournament.ranking()], [1, 0])
+
+    def test_live_exacts_break_ties(self):
+        # u3 only has (3) champion points, so it goes after u2 live exact
+        u3 = self.factory.make_user()
+        Standing.objects.create(
+            user=u3, tournament=self.tournament, champion=3, total=3
+        )
+        self.match.home_goals = 2
+        self.match.away_goals = 0
+        self.match.save()
+
+        ranking = self.tournament.ranking().live([self.match])
+        expected = [
+            (self.u2.id, 3, 1, 1),
+            (u3.id, 3, 0, 2),
+            (self.u1.id, 1, 0, 3),
+        ]
+        self.assertEqual(
+            [(r.user_id, r.total, r.x3, r.position) for r in ranking[:3]],
+            expected,
+        )
+        self.assertEqual(ranking.position(u3), 2)
+
+        # pages and positions are cached per live result
+        with self.assertNumQueries(1):
+            ranking = self.tournament.ranking().live([self.match])
+            self.assertEqual(
+                [(r.user_id, r.total, r.x3, r.position) for r in ranking[:3]],
+                expected,
+            )
+            self.assertEqual(ranking.position(u3), 2)
+
+        # u2 only gets the winner points now, tied with u1
+        self.match.away_goals = 1
+        ranking = self.tournament.ranking().live([self.match])
+        self.assertEqual(ranking.position(self.u2), 2)
+        self.assertEqual(ranking.position(self.u1), 2)
+
+
+class RankingCacheTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tournament = self.factory.make_tournament()
+        self.user = self.factory.make_user()
+        self.match = self.factory.make_match(tournament=self.tournament)
+        self.factory.make_prediction(
+            match=self.match, user=self.user, home_goals=1, away_goals=0
+        )
+
+    def finish_match(self, home_goals, away_goals):
+        self.match.home_goals = home_goals
+        self.match.away_goals = away_goals
+        self.match.finished = True
+        self.match.save()
+
+    def assert_cached(self):
+        self.finish_match(1, 0)
+        ranking = self.tournament.ranking()
+        self.assertEqual(ranking[0]['total'], 3)
+        self.assertEqual(ranking.count(), 1)
+        # only the rankings version is read
+        with self.assertNumQueries(1):
+            ranking = self.tournament.ranking()
+            self.assertEqual(ranking[0]['total'], 3)
+            self.assertEqual(ranking.count(), 1)
+
+        # scoring invalidates cached rankings
+        self.finish_match(2, 1)
+        self.assertEqual(self.tournament.ranking()[0]['total'], 1)
+
+    def test_locmem_cache(self):
+        self.assert_cached()
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            caches = {
+                'default': {
+                    'BACKEND': (
+                        'django.core.cache.backends.filebased.FileBasedCache'
+                    ),
+                    'LOCATION': location,
+                }
+            }
+            with self.settings(CACHES=caches):
+                cache.clear()
+                self.assert_cached()
+
+    def test_version_stored_in_db(self):
+        self.finish_match(1, 0)
+        self.assertEqual(self.tournament.ranking()[0]['total'], 3)
+        version = ranking_version(self.tournament.id)
+        self.assertGreater(version, 0)
+
+        # a tournament saved from an outdated instance keeps the version
+        stale = Tournament.objects.get(id=self.tournament.id)
+        self.finish_match(2, 1)
+        stale.name = 'renamed'
+        stale.save()
+        self.assertGreater(ranking_version(self.tournament.id), version)
+        self.assertEqual(self.tournament.ranking()[0]['total'], 1)
+
+    def test_league_members_invalidate(self):
+        self.finish_match(1, 0)
+        league = League.objects.create(
+            name='friends', tournament=self.tournament
+        )
+        self.assertEqual(league.ranking().count(), 0)
+
+        LeagueMember.objects.create(user=self.user, league=league)
+        self.assertEqual(league.ranking().count(), 1)
+
+    def test_champion_invalidates(self):
+        self.finish_match(1, 0)
+        self.assertEqual(self.tournament.ranking()[0]['total'], 3)
+
+        champion = ChampionPrediction.objects.create(
+            user=self.user, tournament=self.tournament, score=5
+        )
+        champion.save()
+        self.assertEqual(self.tournament.ranking()[0]['total'], 8)
+
+    def test_user_changes_invalidate(self):
+        self.finish_match(1, 0)
+        self.assertEqual(
+            self.tournament.ranking()[0]['username'], self.user.username
+        )
+        version = ranking_version(self.tournament.id)
+
+        # unrelated changes (e.g. on login) keep the cached rankings
+        user = EgaUser.objects.get(id=self.user.id)
+        user.last_login = now()
+        user.save()
+        self.assertEqual(ranking_version(self.tournament.id), version)
+
+        user.username = 'renamed'
+        user.save()
+        self.assertEqual(self.tournament.ranking()[0]['username'], 'renamed')
+
+        user.delete()
+        self.assertEqual(self.tournament.ranking().count(), 0)
@@ -4,13 +4,29 @@ import json
 from unittest import mock
 
 from django.contrib.sites.models import Site
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.urls.exceptions import NoReverseMatch
 from django.utils import translation
 from allauth.socialaccount.models import SocialApp
 
-from ega.constants import DEFAULT_TOURNAMENT, ROUND16_MATCHES
-from ega.models import EgaUser, Tournament
+from ega.constants import (
+    DEFAULT_TOURNAMENT,
+    RANKING_TEAMS_PER_PAGE,
+)
+from ega.models import (
+    AllTimeStanding,
+    EgaUser,
+    League,
+    LeagueMember,
+    Match,
+    ScoringJob,
+    Standing,
+    TeamStats,
+    Tournament,
+    score_matches,
+)
 from ega.tests.helpers import TestCase
 
 
@@ -199,17 +215,122 @@ class NextMatchesTestCase(BaseTestCase):
         ranking = self.user.predicted_ranking(self.tournament)
         self.assertEqual(ranking, {"1": m.home.id, "2": m.away.id})
 
+    def test_knockout_only_save_skips_predicted_ranking(self):
+        tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+        m = self.factory.make_match(
+            tournament=self.tournament, when=tomorrow, knockout=True
+        )
+        p = self.factory.make_prediction(match=m, user=self.user)
+
+        url = reverse("ega-next-matches", kwargs={"slug": DEFAULT_TOURNAMENT})
+        data = {
+            'form-INITIAL_FORMS': '1',
+            'form-TOTAL_FORMS': '1',
+            "form-MAX_NUM_FORMS": "1",
+            "form-0-home_goals": 1,
+            "form-0-away_goals": 0,
+            "form-0-id": p.id,
+        }
+        self.client.login(username='user', password='password')
+        with mock.patch.object(
+            EgaUser, 'update_predicted_ranking'
+        ) as update_predicted_ranking:
+            response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code, 302)
+        p.refresh_from_db()
+        self.assertEqual((p.home_goals, p.away_goals), (1, 0))
+        update_predicted_ranking.assert_not_called()
+
+
+class NextMatchesTeamDetailsTestCase(BaseTestCase):
+    def make_matches(self, n):
+        tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+        for i in range(n):
+            match = self.factory.make_match(
+                tournament=self.tournament, when=tomorrow
+            )
+            self.tournament.teams.add(match.home, match.away)
+            played = self.factory.make_match(
+                tournament=self.tournament,
+                home=match.home,
+                away=match.away,
+                when=tomorrow - datetime.timedelta(days=3),
+            )
+            played.home_goals = 2
+            played.away_goals = 1
+            played.finished = True
+            played.save()
+
+    def get_queries(self):
+        url = reverse("ega-next-matches", kwargs={"slug": DEFAULT_TOURNAMENT})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_team_details_loaded_at_once(self):
+        self.client.login(username='user', password='password')
+        self.make_matches(1)
+        self.get_queries()
+        response, one_match = self.get_queries()
+        form = response.context['formset'].forms[0]
+        self.assertEqual(form.home_stats.won, 1)
+        self.assertEqual(len(form.away_latest_matches), 1)
+
+        self.make_matches(4)
+        self.get_queries()
+        response, five_matches = self.get_queries()
+        # only the prediction trends are queried per match
+        self.assertEqual(five_matches - one_match, 4)
+
+    def test_team_stats_not_created(self):
+        self.client.login(username='user', password='password')
+        self.make_matches(1)
+        TeamStats.objects.all().delete()
+        response, _ = self.get_queries()
+        self.assertFalse(TeamStats.objects.exists())
+        self.assertIsNone(response.context['formset'].forms[0].home_stats)
+
 
 class HomeTestCase(BaseTestCase):
+    def make_knockout_matches(self):
+        tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+        placeholders = [('1A', '2B'), ('1B', '2A'), ('W{}', 'W{}')]
+        matches = []
+        for i, (home, away) in enumerate(placeholders):
+            if i == 2:
+                home, away = home.format(matches[0].id), away.format(
+                    matches[1].id
+                )
+            matches.append(
+                self.factory.make_match(
+                    tournament=self.tournament,
+                    home=None,
+                    away=None,
+                    home_placeholder=home,
+                    away_placeholder=away,
+                    knockout=True,
+                    round='Semifinal' if i < 2 else 'Final',
+                    when=tomorrow + datetime.timedelta(days=i),
+                )
+            )
+        return matches
+
     def test_round16_default(self):
         self.client.login(username='user', password='password')
-
         url = reverse("ega-home", kwargs={"slug": DEFAULT_TOURNAMENT})
+
         response = self.client.get(url)
+        self.assertEqual(response.context["round16"], [])
 
-        self.assertEqual(tuple(response.context["round16"]), ROUND16_MATCHES)
+        self.make_knockout_matches()
+        response = self.client.get(url)
+        self.assertEqual(
+            response.context["round16"], [('1A', '2B'), ('1B', '2A')]
+        )
 
     def test_round16_prediction_based(self):
+        self.make_knockout_matches()
         match1 = self.factory.make_match(tournament=self.tournament)
         match2 = self.factory.make_match(tournament=self.tournament)
         for t in (match1.home, match1.away):
@@ -230,14 +351,267 @@ class HomeTestCase(BaseTestCase):
         url = reverse("ega-home", kwargs={"slug": DEFAULT_TOURNAMENT})
         response = self.client.get(url)
 
-        ranking = {
-            "1A": match1.home,
-            "2A": match1.away,
-            "1B": match2.home,
-            "2B": match2.away,
-        }
         expected = [
-            (ranking.get(home, home), ranking.get(away, away))
-            for home, away in ROUND16_MATCHES
+            (match1.home, match2.away),
+            (match2.home, match1.away),
         ]
         self.assertEqual(response.context["round16"], expected)
+
+
+class RankingTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        match = self.factory.make_match(tournament=self.tournament)
+        for i in range(RANKING_TEAMS_PER_PAGE + 1):
+            self.factory.make_prediction(
+                match=match, home_goals=1, away_goals=0
+            )
+        self.factory.make_prediction(
+            match=match, user=self.user, home_goals=0, away_goals=0
+        )
+        match.home_goals = 1
+        match.away_goals = 0
+        match.finished = True
+        match.save()
+        self.client.login(username='user', password='password')
+
+    def test_ranking(self):
+        url = reverse("ega-ranking", kwargs={"slug": DEFAULT_TOURNAMENT})
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        ranking = response.context["ranking"]
+        self.assertEqual(ranking.paginator.count, RANKING_TEAMS_PER_PAGE + 2)
+        self.assertEqual(len(ranking), RANKING_TEAMS_PER_PAGE)
+        self.assertEqual(response.context["user_position"], 12)
+
+    def test_live_ranking(self):
+        match = self.factory.make_match(tournament=self.tournament)
+        self.factory.make_prediction(
+            match=match, user=self.user, home_goals=3, away_goals=0
+        )
+        match.home_goals = 3
+        match.away_goals = 0
+        match.starred = True
+        match.save()
+
+        url = reverse("ega-ranking", kwargs={"slug": DEFAULT_TOURNAMENT})
+        response = self.client.get(url)
+
+        self.assertEqual(response.context["live_matches"], [match])
+        self.assertEqual(response.context["user_position"], 1)
+        self.assertEqual(response.context["ranking"][0]['live'], 4)
+
+    def test_ranking_last_page(self):
+        url = reverse("ega-ranking", kwargs={"slug": DEFAULT_TOURNAMENT})
+        response = self.client.get(url, {'page': 2})
+
+        ranking = response.context["ranking"]
+        self.assertEqual(
+            [(r['username'], r['position']) for r in ranking],
+            [(ranking[0]['username'], 1), ('user', 12)],
+        )
+
+
+class ExportRankingTestCase(BaseTestCase):
+    url = reverse('ega-ranking-export', kwargs={'slug': DEFAULT_TOURNAMENT})
+
+    def setUp(self):
+        super().setUp()
+        match = self.factory.make_match(tournament=self.tournament, round='1')
+        self.other = self.factory.make_user()
+        self.factory.make_prediction(
+            match=match, user=self.other, home_goals=1, away_goals=0
+        )
+        self.factory.make_prediction(
+            match=match, user=self.user, home_goals=0, away_goals=0
+        )
+        match.home_goals = 1
+        match.away_goals = 0
+        match.finished = True
+        match.save()
+        self.league = League.objects.create(
+            name='friends', tournament=self.tournament
+        )
+        LeagueMember.objects.create(
+            user=self.user, league=self.league, is_owner=True
+        )
+        self.client.login(username='user', password='password')
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return response, content
+
+    def test_staff_only(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_csv(self):
+        self.user.is_staff = True
+        self.user.save()
+
+        response, content = self.export()
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(
+            content.splitlines(),
+            [
+                'position,user_id,username,x1,x3,xx1,xx3,champion,total',
+                '1,%s,%s,0,1,0,0,0,3' % (self.other.id, self.other.username),
+                '2,%s,user,0,0,0,0,0,0' % self.user.id,
+            ],
+        )
+
+    def test_league_owner_jsonl(self):
+        response, content = self.export(
+            format='jsonl', league=self.league.slug, round='1'
+        )
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('friends-1.jsonl', response['Content-Disposition'])
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(
+            [(r['username'], r['total'], r['champion']) for r in rows],
+            [('user', 0, None)],
+        )
+
+    def test_league_not_owner(self):
+        LeagueMember.objects.filter(user=self.user).update(is_owner=False)
+        response = self.client.get(self.url, {'league': self.league.slug})
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_format(self):
+        response = self.client.get(
+            self.url, {'format': 'xml', 'league': self.league.slug}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class HallOfFameTestCase(BaseTestCase):
+    def test_hall_of_fame(self):
+        AllTimeStanding.objects.create(user=self.user, total=10, tournaments=2)
+        self.client.login(username='user', password='password')
+
+        response = self.client.get(reverse('ega-hall-of-fame'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [r.user for r in response.context['ranking']], [self.user]
+        )
+
+
+class EnterResultsAdminTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        admin = EgaUser.objects.create_superuser(
+            username='admin', password='password', email='admin@example.com'
+        )
+        self.client.force_login(admin)
+        self.url = reverse('admin:ega_match_changelist')
+        self.tournament = self.factory.make_tournament()
+        self.user = self.factory.make_user()
+        self.matches = []
+        for i in range(2):
+            match = self.factory.make_match(tournament=self.tournament)
+            self.factory.make_prediction(
+                match=match, user=self.user, home_goals=1, away_goals=0
+            )
+            self.matches.append(match)
+
+    def post_results(self, *results):
+        data = {
+            'action': 'enter_results',
+            '_selected_action': [m.id for m in self.matches],
+            'apply': 'Save results',
+            'results-TOTAL_FORMS': len(self.matches),
+            'results-INITIAL_FORMS': len(self.matches),
+        }
+        for i, (match, (home_goals, away_goals)) in enumerate(
+            zip(self.matches, results)
+        ):
+            data.update(
+                {
+                    'results-%d-id' % i: match.id,
+                    'results-%d-home_goals' % i: home_goals,
+                    'results-%d-away_goals' % i: away_goals,
+                    'results-%d-finished' % i: 'on',
+                }
+            )
+        return self.client.post(self.url, data, follow=True)
+
+    def test_form(self):
+        response = self.client.post(
+            self.url,
+            {
+                'action': 'enter_results',
+                '_selected_action': [m.id for m in self.matches],
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'admin/ega/match/enter_results.html')
+        self.assertEqual(len(response.context['formset'].forms), 2)
+
+    def test_enter_results(self):
+        with mock.patch(
+            'ega.models.score_matches', wraps=score_matches
+        ) as scoring:
+            response = self.post_results((1, 0), (0, 2))
+        scoring.assert_called_once()
+        self.assertContains(response, '2 match results updated.')
+
+        self.assertEqual(
+            sorted(self.user.prediction_set.values_list('score', flat=True)),
+            [0, 3],
+        )
+        self.assertEqual(
+            Standing.objects.get(
+                user=self.user, tournament=self.tournament
+            ).total,
+            3,
+        )
+        self.assertEqual(
+            TeamStats.objects.get(team=self.matches[1].away).points, 3
+        )
+
+    def test_invalid_result(self):
+        with mock.patch('ega.models.score_matches') as scoring:
+            response = self.post_results((1, 0), ('two', 0))
+        scoring.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'admin/ega/match/enter_results.html')
+        self.assertTrue(response.context['formset'].errors[1])
+        self.assertFalse(Match.objects.filter(finished=True).exists())
+
+
+class MatchAdminTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        admin = EgaUser.objects.create_superuser(
+            username='admin', password='password', email='admin@example.com'
+        )
+        self.client.force_login(admin)
+        self.match = self.factory.make_match()
+        self.url = reverse('admin:ega_match_change', args=(self.match.id,))
+
+    def post_match(self, **changes):
+        data = {
+            'home': self.match.home_id,
+            'away': self.match.away_id,
+            'tournament': self.match.tournament_id,
+            'when_0': '',
+            'when_1': '',
+        }
+        data.update(changes)
+        return self.client.post(self.url, data, follow=True)
+
+    def test_scoring_queued(self):
+        response = self.post_match(home_goals=1, away_goals=0, finished='on')
+        self.assertContains(response, 'Scoring queued (1 pending jobs).')
+        self.assertTrue(ScoringJob.objects.filter(match=self.match).exists())
+
+    def test_nothing_to_score(self):
+        response = self.post_match(referee='Collina')
+        self.assertNotContains(response, 'Scoring queued')
+        self.assertFalse(ScoringJob.objects.exists())
+        self.assertEqual(Match.objects.get().referee, 'Collina')
@@ -31,6 +31,7 @@ urlpatterns = [
         ega.views.friend_join,
         name='ega-join',
     ),
+    path('hall-of-fame/', ega.views.hall_of_fame, name='ega-hall-of-fame'),
     path('<slug:slug>/', ega.views.home, name='ega-home'),
     path(
         '<slug:slug>/update-champion',
@@ -68,5 +69,10 @@ urlpatterns = [
         ega.views.ranking,
         name='ega-league-ranking',
     ),
+    path(
+        '<slug:slug>/export/',
+        ega.views.export_ranking,
+        name='ega-ranking-export',
+    ),
     path('<slug:slug>/stats/', ega.views.stats, name='ega-stats'),
 ]
@@ -9,25 +9,34 @@ from django.contrib import auth, messages
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.forms.models import modelformset_factory
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
 from django.utils import translation
+from django.utils.text import slugify
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 from django.views.decorators.http import require_GET, require_http_methods
 
 from ega.constants import (
-    EXACTLY_MATCH_POINTS,
     HISTORY_MATCHES_PER_PAGE,
+    HOME_RANKING_TOP,
     HOURS_TO_DEADLINE,
     INVITE_BODY,
     INVITE_LEAGUE,
     INVITE_SUBJECT,
+    LEAGUE_RANKING_TOP,
     NEXT_MATCHES_DAYS,
+    RANKING_AROUND_USER,
+    RANKING_EXPORT_FORMATS,
     RANKING_TEAMS_PER_PAGE,
-    ROUND16_MATCHES,
 )
+from ega.exports import ranking_lines
 from ega.forms import (
     ChampionPredictionForm,
     EgaUserForm,
@@ -36,13 +45,17 @@ from ega.forms import (
     PredictionForm,
 )
 from ega.models import (
+    AllTimeStanding,
     ChampionPrediction,
     EgaUser,
     League,
     LeagueMember,
     Match,
+    PredictedKnockoutMatch,
     Prediction,
+    Standing,
     Tournament,
+    invalidate_rankings,
 )
 
 
@@ -117,15 +130,39 @@ def meta_home(request):
     )
 
 
-def _predicted_round16(tournament, user):
-    predicted_ranking = user.predicted_ranking(tournament)
-    teams = {t.id: t for t in tournament.teams.all()}
+@login_required
+def hall_of_fame(request):
+    """Return users all-time ranking across finished tournaments."""
+    standings = AllTimeStanding.objects.select_related('user').order_by(
+        '-total', '-exacts', 'user'
+    )
+    paginator = Paginator(standings, RANKING_TEAMS_PER_PAGE)
+
+    page = request.GET.get('page')
+    try:
+        ranking = paginator.page(page)
+    except PageNotAnInteger:
+        ranking = paginator.page(1)
+    except EmptyPage:
+        ranking = paginator.page(paginator.num_pages)
+
+    return render(request, 'ega/hall_of_fame.html', {'ranking': ranking})
+
+
+def _predicted_first_round(tournament, user):
+    bracket = list(user.predicted_bracket(tournament))
+    if not bracket:
+        # no predictions yet (see EgaUser.update_predicted_bracket)
+        bracket = [
+            PredictedKnockoutMatch(match=m, home=m.home, away=m.away)
+            for m in tournament.match_set.filter(knockout=True)
+            .select_related('home', 'away')
+            .order_by('when', 'id')
+        ]
     return [
-        (
-            teams.get(predicted_ranking.get(home), home),
-            teams.get(predicted_ranking.get(away), away),
-        )
-        for home, away in ROUND16_MATCHES
+        (m.home_team, m.away_team)
+        for m in bracket
+        if m.match.round == bracket[0].match.round
     ]
 
 
@@ -148,7 +185,9 @@ def home(request, slug):
         except Prediction.DoesNotExist:
             m.user_prediction = None
 
-    top_ranking = tournament.ranking()[:7]
+    top_ranking = tournament.ranking().around(
+        request.user, top=HOME_RANKING_TOP, context=RANKING_AROUND_USER
+    )
     history = request.user.history(tournament)[:3]
     stats = request.user.stats(tournament)
 
@@ -157,7 +196,7 @@ def home(request, slug):
     )
     champion_form = ChampionPredictionForm(instance=champion)
 
-    round16 = _predicted_round16(tournament, request.user)
+    round16 = _predicted_first_round(tournament, request.user)
 
     return render(
         request,
@@ -352,7 +391,9 @@ def league_home(request, slug, league_slug):
         tournament__published=True,
     )
 
-    top_ranking = league.ranking()[:5]
+    top_ranking = league.ranking().around(
+        request.user, top=LEAGUE_RANKING_TOP, context=RANKING_AROUND_USER
+    )
     stats = request.user.stats(tournament)
 
     return render(
@@ -378,6 +419,11 @@ def next_matches(request, slug):
     Prediction.objects.bulk_create(
         [Prediction(user=request.user, match=m) for m in missing]
     )
+    standing, created = Standing.objects.get_or_create(
+        user=request.user, tournament=tournament
+    )
+    if created:
+        invalidate_rankings(tournament.id)
 
     # predictions for the next matches
     tz_now = now() + timedelta(hours=HOURS_TO_DEADLINE)
@@ -386,7 +432,7 @@ def next_matches(request, slug):
         user=request.user,
         match__tournament=tournament,
         match__when__range=(tz_now, until),
-    )
+    ).select_related('user', 'match__home', 'match__away')
 
     PredictionFormSet = modelformset_factory(
         Prediction, form=PredictionForm, extra=0
@@ -396,8 +442,22 @@ def next_matches(request, slug):
         formset = PredictionFormSet(request.POST, queryset=predictions)
         if formset.is_valid():
             formset.save()
-            request.user.update_predicted_ranking(tournament)
             expired_matches = any(f.expired for f in formset)
+            # predicted group standings only depend on group stage goals,
+            # while the predicted bracket depends on knockout results too
+            group_changed = knockout_changed = False
+            for f in formset:
+                if f.expired or not f.changed_data:
+                    continue
+                if f.instance.match.knockout:
+                    knockout_changed = True
+                elif {'home_goals', 'away_goals'} & set(f.changed_data):
+                    group_changed = True
+            if group_changed:
+                # the bracket is updated along with the standings
+                request.user.update_predicted_ranking(tournament)
+            elif knockout_changed:
+                request.user.update_predicted_bracket(tournament)
 
             if is_ajax:
                 return HttpResponse(
@@ -423,6 +483,26 @@ def next_matches(request, slug):
     else:
         formset = PredictionFormSet(queryset=predictions)
 
+    # teams stats and latest results, loaded at once for all the matches
+    matches = [f.instance.match for f in formset if f.instance.match_id]
+    teams = tournament.team_details(
+        team_id
+        for match in matches
+        for team_id in (match.home_id, match.away_id)
+        if team_id is not None
+    )
+    for form in formset:
+        home_id = away_id = None
+        if form.instance.match_id:
+            home_id = form.instance.match.home_id
+            away_id = form.instance.match.away_id
+        form.home_stats, form.home_latest_matches = teams.get(
+            home_id, (None, [])
+        )
+        form.away_stats, form.away_latest_matches = teams.get(
+            away_id, (None, [])
+        )
+
     return render(
         request,
         'ega/next_matches.html',
@@ -441,11 +521,14 @@ def match_details(request, slug, match_id):
     exacts = Prediction.objects.none()
     winners = Prediction.objects.none()
     if match.finished:
+        exact_points = tournament.exact_points
+        if match.knockout:
+            exact_points *= tournament.knockout_multiplier
         winners = Prediction.objects.filter(
-            match=match, score__gt=0, score__lt=EXACTLY_MATCH_POINTS
+            match=match, score__gt=0, score__lt=exact_points
         )
         exacts = Prediction.objects.filter(
-            match=match, score__gte=EXACTLY_MATCH_POINTS
+            match=match, score__gte=exact_points
         ).select_related('user')
 
     return render(
@@ -484,11 +567,13 @@ def ranking(request, slug, league_slug=None, round=None):
         if league
         else tournament.ranking(round=round)
     )
-    try:
-        position = ([r['username'] for r in scores]).index(user.username)
-        position += 1
-    except ValueError:
-        position = None
+    live_matches = []
+    if round is None and not tournament.is_archived:
+        # include provisional points from matches being played
+        live_matches = tournament.live_matches()
+        if live_matches:
+            scores = scores.live(live_matches)
+    position = scores.position(user)
     paginator = Paginator(scores, RANKING_TEAMS_PER_PAGE)
 
     page = request.GET.get('page')
@@ -499,6 +584,13 @@ def ranking(request, slug, league_slug=None, round=None):
     except EmptyPage:
         ranking = paginator.page(paginator.num_pages)
 
+    if round is None and league is None:
+        positions = tournament.previous_round_positions(
+            [r.user_id for r in ranking]
+        )
+        for r in ranking:
+            r.last_position = positions.get(r.user_id)
+
     stats = user.stats(tournament, round=round)
     round_choices = (
         tournament.match_set.filter(
@@ -523,12 +615,55 @@ def ranking(request, slug, league_slug=None, round=None):
             'round': round,
             'choices': round_choices,
             'ranking': ranking,
+            'live_matches': live_matches,
             'user_position': position,
             'stats': stats,
         },
     )
 
 
+@require_GET
+@login_required
+def export_ranking(request, slug):
+    """Stream the tournament (or league, or round) ranking as CSV/JSON lines.
+
+    Available to staff, and to league owners for their leagues.
+    """
+    tournament = get_object_or_404(Tournament, slug=slug)
+    format = request.GET.get('format', 'csv')
+    if format not in RANKING_EXPORT_FORMATS:
+        raise Http404
+    round = request.GET.get('round') or None
+    league_slug = request.GET.get('league')
+
+    if league_slug:
+        leagues = League.objects.filter(tournament=tournament)
+        if not request.user.is_staff:
+            leagues = leagues.filter(
+                leaguemember__user=request.user, leaguemember__is_owner=True
+            )
+        league = get_object_or_404(leagues, slug=league_slug)
+        scores = league.ranking(round=round)
+        filename = '%s-%s' % (tournament.slug, league.slug)
+    elif request.user.is_staff:
+        scores = tournament.ranking(round=round)
+        filename = tournament.slug
+    else:
+        raise Http404
+
+    if round is not None:
+        filename += '-%s' % slugify(round)
+    content_type = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(
+        ranking_lines(scores, format), content_type=content_type
+    )
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (
+        filename,
+        format,
+    )
+    return response
+
+
 @login_required
 def history(request, slug):
     """Return history for the specified tournament."""